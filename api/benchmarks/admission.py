@@ -0,0 +1,134 @@
+"""
+Overload check for admission control.
+
+Points AsyncPredictionClient at a scratch Redis list that no model worker
+reads, so every admitted request stays queued, and sends requests at a
+steady rate. Checks that:
+
+- requests are answered from the rate card past the degrade threshold;
+- they are refused with 503 and Retry-After past the queue depth limit;
+- they are refused with 429 past the in-flight limit.
+
+Reports how quickly refusals and degraded answers come back, and how far
+the queue overshot the limit between depth readings. Exits non-zero if
+any check fails. Run from the api directory with Redis up:
+
+    python -m benchmarks.admission --rate 2000
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from fastapi import HTTPException
+import prediction_client
+from prediction_client import AsyncPredictionClient
+from redis_conn import redis_conn
+
+SCRATCH_QUEUE = 'benchmarks:admission'
+REQUEST = {
+    'PULocationID': 132,
+    'DOLocationID': 236,
+    'store_and_fwd_flag': 'N',
+    'trip_distance': 3.66,
+    'tpep_pickup_datetime': datetime(2024, 5, 3, 8, 15)
+}
+
+
+async def surge(client: AsyncPredictionClient, n: int, rate: float, timeout: float) -> List[Tuple[str, float]]:
+    """(outcome, seconds to the answer) for n requests sent at rate per second."""
+    async def one() -> Tuple[str, float]:
+        start = time.perf_counter()
+        try:
+            reply = await client.get_prediction(dict(REQUEST), timeout=timeout)
+            outcome = 'degraded' if reply.get('degraded') else 'answered'
+        except HTTPException as e:
+            outcome = str(e.status_code) if e.status_code == 408 or e.headers.get('Retry-After') else 'error'
+        return outcome, time.perf_counter() - start
+
+    tasks = []
+    for _ in range(n):
+        tasks.append(asyncio.ensure_future(one()))
+        await asyncio.sleep(1 / rate)
+    return await asyncio.gather(*tasks)
+
+
+def summarize(results: List[Tuple[str, float]]) -> Dict[str, Any]:
+    summary = {}
+    for outcome in sorted({outcome for outcome, _ in results}):
+        timings = np.array([seconds for o, seconds in results if o == outcome]) * 1000
+        summary[outcome] = (len(timings), np.percentile(timings, 50), np.percentile(timings, 99))
+    return summary
+
+
+async def run(args) -> int:
+    # Requests go to a list nobody consumes, so admitted ones only leave by timing out
+    prediction_client.REQUEST_TRANSPORT = 'list'
+    prediction_client.REQUEST_QUEUE = SCRATCH_QUEUE
+    redis_client = redis_conn.async_client
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    client = AsyncPredictionClient()
+    admission = client.admission['interactive']
+
+    async def phase(description: str, degrade_depth: int, max_depth: int, max_in_flight: int, n: int):
+        await redis_client.delete(SCRATCH_QUEUE)
+        admission.degrade_queue_depth, admission.max_queue_depth, admission.max_in_flight = \
+            degrade_depth, max_depth, max_in_flight
+        admission.queue_depth = 0
+        results = await surge(client, n, args.rate, args.timeout)
+        depth = await redis_client.llen(SCRATCH_QUEUE)
+        summary = summarize(results)
+        print(f"{description}: queue reached {depth} requests")
+        for outcome, (count, p50, p99) in summary.items():
+            print(f"     {outcome:<9} {count:>5} requests  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+        return summary, depth
+
+    try:
+        # Degraded answers are not queued, so the queue stops growing near the threshold
+        summary, depth = await phase(f"degrade at queue depth {args.degrade_depth}",
+                                     args.degrade_depth, 0, 0, args.requests)
+        check('degraded' in summary and summary['degraded'][2] < args.max_refusal_ms,
+              f"requests past the degrade threshold get rate card quotes in under {args.max_refusal_ms} ms (p99)")
+
+        summary, depth = await phase(f"refuse at queue depth {args.max_depth}", 0, args.max_depth, 0, args.requests)
+        check('503' in summary and summary['503'][2] < args.max_refusal_ms,
+              f"requests past the queue depth limit are refused with 503 and Retry-After "
+              f"in under {args.max_refusal_ms} ms (p99), {max(0, depth - args.max_depth)} queued over the limit")
+
+        summary, _ = await phase(f"refuse at {args.max_in_flight} in flight", 0, 0, args.max_in_flight,
+                                 args.max_in_flight * 2)
+        check(summary.get('429', (0,))[0] == args.max_in_flight and summary.get('408', (0,))[0] == args.max_in_flight,
+              "requests past the in-flight limit are refused with 429 and Retry-After")
+        print(f"metrics: {client.stats()['interactive']}")
+        await client.stop()
+    finally:
+        await redis_client.delete(SCRATCH_QUEUE)
+        await redis_conn.close_async()
+    return len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check admission control under a request surge')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests in the queue depth surge')
+    parser.add_argument('--rate', type=float, default=2000, help='Requests sent per second')
+    parser.add_argument('--degrade-depth', type=int, default=200, help='Queue depth that triggers degraded mode')
+    parser.add_argument('--max-depth', type=int, default=500, help='Queue depth past which requests are refused')
+    parser.add_argument('--max-in-flight', type=int, default=100, help='In-flight requests past which requests are refused')
+    parser.add_argument('--timeout', type=float, default=3, help='Seconds an admitted request waits for its reply')
+    parser.add_argument('--max-refusal-ms', type=float, default=5, help='Largest acceptable p99 time to a refusal')
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
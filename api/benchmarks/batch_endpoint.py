@@ -0,0 +1,103 @@
+"""
+Throughput benchmark for the batch prediction endpoint.
+
+Prices the same number of random NYC trips through POST /api/v1/predictions
+(one trip per call) and POST /api/v1/predictions/batch, and reports
+trips/sec for each. Distances and pickup times are spread widely so few
+trips hit the quote cache. Exits non-zero if a batch answer differs from
+the single-trip answer for the same trip, or if an invalid trip fails more
+than its own entry. Needs the API, Redis and the model service running,
+e.g. with docker compose:
+
+    python -m benchmarks.batch_endpoint --url http://localhost:8000 --trips 2000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+# Roughly Manhattan, Brooklyn and Queens
+LAT_RANGE = (40.58, 40.88)
+LON_RANGE = (-74.02, -73.76)
+
+
+def random_trips(n: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            'pickup_location': {'latitude': rng.uniform(*LAT_RANGE), 'longitude': rng.uniform(*LON_RANGE)},
+            'dropoff_location': {'latitude': rng.uniform(*LAT_RANGE), 'longitude': rng.uniform(*LON_RANGE)},
+            'trip_distance': round(rng.uniform(0.5, 30), 2),
+            'pickup_datetime': (start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))).isoformat()
+        }
+        for _ in range(n)
+    ]
+
+
+def post(url: str, body: Any) -> Any:
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def single(base_url: str, trips: List[Dict[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(lambda trip: post(f"{base_url}/api/v1/predictions", trip), trips))
+
+
+def batched(base_url: str, trips: List[Dict[str, Any]], batch_size: int, concurrency: int) -> List[Dict[str, Any]]:
+    chunks = [trips[i:i + batch_size] for i in range(0, len(trips), batch_size)]
+    with ThreadPoolExecutor(concurrency) as pool:
+        responses = pool.map(lambda chunk: post(f"{base_url}/api/v1/predictions/batch", {'trips': chunk}), chunks)
+        return [item for response in responses for item in response['predictions']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the single-trip and batch prediction endpoints')
+    parser.add_argument('--url', type=str, default='http://localhost:8000', help='API base URL')
+    parser.add_argument('--trips', type=int, default=2000, help='Trips per endpoint')
+    parser.add_argument('--batch-size', type=int, default=200, help='Trips per batch call')
+    parser.add_argument('--concurrency', type=int, default=16, help='Calls in flight at once')
+    args = parser.parse_args()
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    # Answers come back in order and match the single-trip endpoint
+    sample = random_trips(50, seed=1)
+    batch_answers = batched(args.url, sample, len(sample), 1)
+    single_answers = single(args.url, sample, args.concurrency)
+    check(all(item['prediction'] == answer for item, answer in zip(batch_answers, single_answers)),
+          "batch predictions match single-trip predictions, in order")
+
+    invalid = dict(sample[0], trip_distance=250)
+    answers = batched(args.url, [sample[0], invalid, sample[1]], 3, 1)
+    check(answers[0]['prediction'] is not None and answers[1]['error'] and answers[2]['prediction'] is not None,
+          "an invalid trip gets its own error without failing the batch")
+
+    # Separate trip sets, so neither run is answered from the other's cached quotes
+    for name, run in (
+        ('single', lambda trips: single(args.url, trips, args.concurrency)),
+        (f'batch/{args.batch_size}', lambda trips: batched(args.url, trips, args.batch_size, args.concurrency)),
+    ):
+        trips = random_trips(args.trips, seed=hash(name) % 1000 + 2)
+        start = time.perf_counter()
+        answers = run(trips)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10} {len(answers) / elapsed:>8.0f} trips/s   ({elapsed:.2f}s for {len(answers)} trips)")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Cold-start benchmark for API zone loading.
+
+Times ZoneMapper construction in fresh interpreters, once loading the
+GeoJSON and CSV sources and once loading the compiled zone registry
+(see data/build_zone_registry.py). Run from the api directory:
+
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from services.zone_registry import ZONE_REGISTRY_PATH
+
+SNIPPET = """
+import logging, time
+logging.disable(logging.WARNING)
+start = time.perf_counter()
+import geopandas, pandas, shapely
+imports = time.perf_counter() - start
+start = time.perf_counter()
+from services.zone_mapper import ZoneMapper
+mapper = ZoneMapper()
+mapper.taxi_zones
+print(imports, time.perf_counter() - start)
+"""
+
+
+def time_cold_start(registry_path: str, runs: int):
+    """Median seconds for library imports and for loading a ZoneMapper."""
+    env = dict(os.environ, ZONE_REGISTRY_PATH=registry_path)
+    imports, loads = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-W', 'ignore', '-c', SNIPPET], env=env,
+                             capture_output=True, text=True, check=True)
+        import_time, load_time = map(float, out.stdout.strip().splitlines()[-1].split())
+        imports.append(import_time)
+        loads.append(load_time)
+    return statistics.median(imports), statistics.median(loads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark API zone loading cold start')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per variant')
+    parser.add_argument('--registry', type=str, default=str(ZONE_REGISTRY_PATH), help='Compiled zone registry')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.registry):
+        sys.exit(f"No zone registry at {args.registry}; build it with data/build_zone_registry.py")
+
+    for name, path in (('geojson + csv', os.devnull + '.missing'), ('zone registry', args.registry)):
+        imports, load = time_cold_start(path, args.runs)
+        print(f"{name:<14} imports {imports * 1000:>7.0f} ms   ZoneMapper() {load * 1000:>7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
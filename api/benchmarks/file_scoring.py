@@ -0,0 +1,142 @@
+"""
+Streaming file scoring check and benchmark.
+
+Writes a file of random NYC trips in each supported format, uploads it to
+POST /api/v1/predictions/file in 1 MB pieces, and reads the response as it
+streams back. Reports rows/sec and time to the first response bytes. Exits
+non-zero if a response has the wrong row count or order, if the invalid
+row is not flagged, or if a row has neither a prediction nor an error.
+With --api-pid (the API running on this host), it also reports the API
+process's peak memory, which should not grow with --rows. Needs the API,
+Redis and the model service running:
+
+    python -m benchmarks.file_scoring --url http://localhost:8000 --rows 100000
+"""
+import argparse
+import http.client
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from benchmarks.batch_endpoint import LAT_RANGE, LON_RANGE
+from services.file_scoring import MEDIA_TYPES
+
+
+def random_trips(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'trip_id': np.arange(n),
+        'pickup_latitude': rng.uniform(*LAT_RANGE, n),
+        'pickup_longitude': rng.uniform(*LON_RANGE, n),
+        'dropoff_latitude': rng.uniform(*LAT_RANGE, n),
+        'dropoff_longitude': rng.uniform(*LON_RANGE, n),
+        'trip_distance': np.round(rng.exponential(3.0, n), 2),
+        'pickup_datetime': (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, n), unit='s'))
+    })
+    frame.loc[1, 'trip_distance'] = 250.0  # one invalid row
+    return frame
+
+
+def write_file(frame: pd.DataFrame, file_format: str, path: str):
+    if file_format == 'ndjson':
+        frame.to_json(path, orient='records', lines=True, date_format='iso')
+    elif file_format == 'csv':
+        frame.to_csv(path, index=False)
+    elif file_format == 'parquet':
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path, row_group_size=10000)
+    else:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        with ipc.new_stream(path, table.schema) as writer:
+            writer.write_table(table, max_chunksize=10000)
+
+
+def file_pieces(path: str, size: int = 1 << 20) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            piece = f.read(size)
+            if not piece:
+                return
+            yield piece
+
+
+def read_response(data: bytes, file_format: str) -> pd.DataFrame:
+    if file_format == 'ndjson':
+        return pd.read_json(io.BytesIO(data), lines=True)
+    if file_format == 'csv':
+        return pd.read_csv(io.BytesIO(data))
+    if file_format == 'parquet':
+        return pq.read_table(io.BytesIO(data)).to_pandas()
+    return ipc.open_stream(io.BytesIO(data)).read_all().to_pandas()
+
+
+def peak_rss_mb(pid: Optional[int]) -> Optional[float]:
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def upload(url: str, path: str, file_format: str):
+    """(response bytes, seconds to the first response bytes)."""
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=600)
+    connection.request('POST', '/api/v1/predictions/file', body=file_pieces(path), encode_chunked=True,
+                       headers={'Content-Type': MEDIA_TYPES[file_format], 'Transfer-Encoding': 'chunked'})
+    start = time.perf_counter()
+    response = connection.getresponse()
+    if response.status != 200:
+        raise RuntimeError(f"{file_format}: HTTP {response.status} {response.read()[:500]!r}")
+    first = response.read1(1 << 16)
+    first_byte = time.perf_counter() - start
+    data = first + response.read()
+    connection.close()
+    return data, first_byte
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the streaming file scoring endpoint')
+    parser.add_argument('--url', type=str, default='http://localhost:8000', help='API base URL')
+    parser.add_argument('--rows', type=int, default=100000, help='Trips per file')
+    parser.add_argument('--formats', type=str, default=','.join(MEDIA_TYPES), help='Comma-separated formats')
+    parser.add_argument('--api-pid', type=int, default=None, help='PID of a local API process, to report its peak memory')
+    args = parser.parse_args()
+
+    trips = random_trips(args.rows)
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for file_format in args.formats.split(','):
+            path = os.path.join(directory, f"trips.{file_format}")
+            write_file(trips, file_format, path)
+            start = time.perf_counter()
+            data, first_byte = upload(args.url, path, file_format)
+            elapsed = time.perf_counter() - start
+            scored = read_response(data, file_format)
+
+            # Every row comes back in order, with either a prediction or the reason it has none
+            ok = (len(scored) == len(trips) and (scored['trip_id'].to_numpy() == trips['trip_id'].to_numpy()).all()
+                  and str(scored['error'].iloc[1]).startswith('trip_distance')
+                  and (scored['error'].isna() == scored['fare_amount'].notna()).all())
+            if not ok:
+                failures.append(file_format)
+            rss = peak_rss_mb(args.api_pid)
+            print(f"{'ok  ' if ok else 'FAIL'} {file_format:<8} {os.path.getsize(path) / 1e6:>7.1f} MB in  "
+                  f"{len(data) / 1e6:>7.1f} MB out  {len(scored) / elapsed:>8.0f} rows/s  "
+                  f"first bytes after {first_byte * 1000:.0f} ms"
+                  + (f"  API peak RSS {rss:.0f} MB" if rss is not None else ''))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
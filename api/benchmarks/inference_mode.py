@@ -0,0 +1,123 @@
+"""
+Side-by-side latency of the Redis and co-located inference modes.
+
+Sends the same stream of random model requests through AsyncPredictionClient
+(Redis and the model service) and LocalPredictionClient (a process pool in
+this process loading ../model, or MODEL_DIR), one at a time, and reports
+p50/p99/mean latency per mode for single trips and for batches. Exits
+non-zero if the two modes answer the same trips differently. Calls the
+clients directly, so the quote cache and HTTP are left out. Needs Redis and
+a model worker running:
+
+    python -m benchmarks.inference_mode --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import numpy as np
+from fastapi import HTTPException
+from local_prediction_client import LocalPredictionClient
+from prediction_client import AsyncPredictionClient
+from redis_conn import redis_conn
+
+# Zones with a row in taxi_zones.csv (57, 104 and 105 have none)
+ZONES = [zone for zone in range(1, 264) if zone not in (57, 104, 105)]
+
+
+def random_requests(n: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            'PULocationID': rng.choice(ZONES),
+            'DOLocationID': rng.choice(ZONES),
+            'store_and_fwd_flag': 'N',
+            'trip_distance': round(rng.uniform(0.5, 30), 2),
+            'tpep_pickup_datetime': start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+        }
+        for _ in range(n)
+    ]
+
+
+async def answer(client, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Reply for one trip, with an error reply as the answer for trips the model rejects."""
+    try:
+        return await client.get_prediction(dict(request))
+    except HTTPException as e:
+        return {'error': e.detail}
+
+
+async def latencies(call, requests: List[Any]) -> np.ndarray:
+    timings = []
+    for request in requests:
+        start = time.perf_counter()
+        await call(request)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def same_answer(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    fields = set(a) - {'request_id'}
+    return fields == set(b) - {'request_id'} and all(
+        a[field] == b[field] if isinstance(a[field], str) else abs(a[field] - b[field]) < 1e-6 for field in fields)
+
+
+async def run(args) -> int:
+    clients = {'redis': AsyncPredictionClient(), 'local': LocalPredictionClient(workers=args.workers)}
+    failures = []
+    try:
+        for client in clients.values():
+            client.start()
+        # Load the models in the pool and warm both paths up
+        warm_up = random_requests(50, seed=0)
+        for client in clients.values():
+            for request in warm_up:
+                await answer(client, request)
+
+        # Both modes give the same replies, for single trips and batches
+        sample = random_requests(200, seed=1)
+        answers = {name: [await answer(client, request) for request in sample]
+                   for name, client in clients.items()}
+        batches = {name: await client.get_predictions([dict(request) for request in sample] + [{'trip_distance': 1}])
+                   for name, client in clients.items()}
+        ok = (all(same_answer(a, b) for a, b in zip(answers['redis'], answers['local']))
+              and all(same_answer(a, b) for a, b in zip(batches['redis'], batches['local']))
+              and 'error' in batches['local'][-1] and 'error' in batches['redis'][-1])
+        print(f"{'ok  ' if ok else 'FAIL'} both modes return the same replies")
+        if not ok:
+            failures.append('contract')
+
+        # Fresh trips for each mode, so neither is served from the other's warm worker cache
+        print(f"{'mode':<6} {'request':<10} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+        for seed, (name, client) in enumerate(clients.items(), start=2):
+            trips = random_requests(args.requests, seed=seed)
+            single = await latencies(lambda request: answer(client, request), trips)
+            groups = [trips[i:i + args.batch_size] for i in range(0, len(trips), args.batch_size)]
+            batched = await latencies(lambda group: client.get_predictions([dict(r) for r in group]), groups)
+            for label, timings in (('single', single), (f'batch/{args.batch_size}', batched)):
+                print(f"{name:<6} {label:<10} {np.percentile(timings, 50):>8.2f} {np.percentile(timings, 99):>8.2f} "
+                      f"{timings.mean():>8.2f}")
+    finally:
+        for client in clients.values():
+            await client.stop()
+        await redis_conn.close_async()
+    return len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Redis and co-located inference latency')
+    parser.add_argument('--requests', type=int, default=2000, help='Single-trip requests per mode')
+    parser.add_argument('--batch-size', type=int, default=100, help='Trips per batch request')
+    parser.add_argument('--workers', type=int, default=1, help='Local inference processes')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
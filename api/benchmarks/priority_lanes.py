@@ -0,0 +1,103 @@
+"""
+Isolation check for the interactive and bulk priority lanes.
+
+Keeps the model service's queue full of batch requests while timing
+single-trip requests sent at a steady rate, twice: once with the batches
+sharing the interactive lane and once with them on the bulk lane. Reports
+interactive p50/p99 and bulk trips/sec for each run, and the per-lane
+stats /metrics shows. Exits non-zero if the bulk lane does not lower the
+interactive p99, or if bulk work stalls while interactive requests are
+being served. Calls AsyncPredictionClient directly, so the quote cache and
+HTTP are left out. Needs Redis and a model worker running:
+
+    python -m benchmarks.priority_lanes --batch-size 200 --bulk-concurrency 16
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from typing import Tuple
+import numpy as np
+from prediction_client import AsyncPredictionClient
+from redis_conn import redis_conn
+from benchmarks.inference_mode import random_requests
+
+
+async def run(client: AsyncPredictionClient, args, bulk_lane: str, seed: int) -> Tuple[np.ndarray, float]:
+    """Interactive latencies in ms, and bulk trips/sec, with batch requests on bulk_lane."""
+    stop = asyncio.Event()
+    bulk_trips = [0]
+
+    async def bulk_load(worker: int):
+        n = 0
+        while not stop.is_set():
+            trips = random_requests(args.batch_size, seed=seed * 1000000 + worker * 10000 + n)
+            predictions = await client.get_predictions(trips, lane=bulk_lane)
+            bulk_trips[0] += sum('error' not in prediction for prediction in predictions)
+            n += 1
+
+    async def timed(request) -> float:
+        start = time.perf_counter()
+        await client.get_prediction(request, lane='interactive')
+        return (time.perf_counter() - start) * 1000
+
+    loaders = [asyncio.ensure_future(bulk_load(i)) for i in range(args.bulk_concurrency)]
+    await asyncio.sleep(args.warmup)  # let the backlog build up
+    start, trips_before = time.perf_counter(), bulk_trips[0]
+    probes = []
+    for request in random_requests(args.probes, seed=seed):
+        probes.append(asyncio.ensure_future(timed(request)))
+        await asyncio.sleep(1 / args.rate)
+    latencies = await asyncio.gather(*probes)
+    bulk_rate = (bulk_trips[0] - trips_before) / (time.perf_counter() - start)
+    stop.set()
+    await asyncio.gather(*loaders)
+    return np.array(latencies), bulk_rate
+
+
+async def main_async(args) -> int:
+    client = AsyncPredictionClient()
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    try:
+        results = {}
+        for seed, bulk_lane in enumerate(('interactive', 'bulk'), start=1):
+            latencies, bulk_rate = await run(client, args, bulk_lane, seed)
+            results[bulk_lane] = (np.percentile(latencies, 50), np.percentile(latencies, 99), bulk_rate)
+            print(f"batches on the {bulk_lane + ' lane:':<17} interactive p50 {results[bulk_lane][0]:8.2f} ms  "
+                  f"p99 {results[bulk_lane][1]:8.2f} ms  bulk {bulk_rate:8.1f} trips/sec")
+
+        shared_p99, lane_p99 = results['interactive'][1], results['bulk'][1]
+        check(lane_p99 < shared_p99,
+              f"the bulk lane lowers interactive p99 ({lane_p99:.2f} ms vs {shared_p99:.2f} ms shared)")
+        check(results['bulk'][2] > 0, "bulk work keeps progressing while interactive requests are served")
+
+        for lane, stats in client.stats().items():
+            print(f"     {lane:<11} latency {stats['latency_ms']}  admitted {stats['admitted']}  "
+                  f"degraded {stats['degraded']}")
+        await client.stop()
+    finally:
+        await redis_conn.close_async()
+    return len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare interactive latency with and without a bulk lane')
+    parser.add_argument('--probes', type=int, default=500, help='Interactive requests timed per run')
+    parser.add_argument('--rate', type=float, default=100, help='Interactive requests sent per second')
+    parser.add_argument('--batch-size', type=int, default=200, help='Trips per bulk batch request')
+    parser.add_argument('--bulk-concurrency', type=int, default=16, help='Bulk batch requests in flight at once')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of bulk load before timing')
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    sys.exit(1 if asyncio.run(main_async(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
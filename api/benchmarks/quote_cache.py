@@ -0,0 +1,174 @@
+"""
+Single-flight and hit-rate check for the shared quote cache.
+
+Drives QuoteCache.get_quote against the Redis at REDIS_HOST/REDIS_PORT with
+a stand-in for the model call (a fixed delay that counts its calls), and
+exits non-zero if identical concurrent requests are not coalesced into one
+call, if a failed call is cached, if a new model version still serves
+old quotes, or if the model is sent an altered distance without a
+--distance-resolution opt-in. Then replays a burst of quotes concentrated on a few routes,
+as around an airport or a stadium, and reports how many reached the model.
+Run from the api directory with Redis up:
+
+    python -m benchmarks.quote_cache --requests 5000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from redis_conn import redis_conn
+from services.quote_cache import MODEL_VERSION_KEY, QUOTE_CACHE_PREFIX, QuoteCache
+
+
+class FakeModel:
+    """Answers like the model service after a fixed delay, counting calls."""
+
+    def __init__(self, latency: float, version: str = 'benchmark-v1'):
+        self.latency = latency
+        self.version = version
+        self.calls = 0
+        self.fail = False
+
+    async def get_prediction(self, data):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise HTTPException(status_code=500, detail='model failed')
+        return {
+            'request_id': str(self.calls),
+            'model_version': self.version,
+            'trip_duration': 10.0 + data['trip_distance'],
+            'fare_amount': 5.0 + 2.5 * data['trip_distance'],
+            'tolls_amount': 0.0,
+            'congestion_surcharge': 0.0,
+            'total_amount': 5.0 + 2.5 * data['trip_distance']
+        }
+
+
+def quote_request(pu: int, do: int, distance: float, pickup: datetime):
+    return {
+        'PULocationID': pu,
+        'DOLocationID': do,
+        'store_and_fwd_flag': 'N',
+        'trip_distance': distance,
+        'tpep_pickup_datetime': pickup
+    }
+
+
+async def clear(client):
+    keys = [key async for key in client.scan_iter(match=f"{QUOTE_CACHE_PREFIX}benchmark-*")]
+    if keys:
+        await client.delete(*keys)
+
+
+async def run(args) -> int:
+    client = redis_conn.async_client
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    previous_version = await client.get(MODEL_VERSION_KEY)
+    await client.set(MODEL_VERSION_KEY, 'benchmark-v1')
+    await clear(client)
+    pickup = datetime(2024, 5, 3, 17, 30)
+    try:
+        # By default the model prices the exact distance, cached or not
+        for ttl in (300, 0):
+            model = FakeModel(args.latency)
+            quote = await QuoteCache(ttl=ttl).get_quote(quote_request(7, 8, 17.43, pickup), model.get_prediction)
+            check(quote['trip_duration'] == 10.0 + 17.43,
+                  f"without a distance resolution the model prices the exact distance (ttl {ttl})")
+        quote = await QuoteCache(ttl=0, distance_resolution=args.distance_resolution).get_quote(
+            quote_request(7, 8, 17.43, pickup), model.get_prediction)
+        check(quote['trip_duration'] == 10.0 + 17.43, "with the cache disabled distances are never bucketed")
+
+        # Identical concurrent misses share one model call
+        model = FakeModel(args.latency)
+        cache = QuoteCache(distance_resolution=args.distance_resolution)
+        quotes = await asyncio.gather(*(cache.get_quote(quote_request(132, 236, 17.43, pickup), model.get_prediction)
+                                        for _ in range(100)))
+        check(model.calls == 1 and len({q['fare_amount'] for q in quotes}) == 1,
+              f"100 concurrent identical requests made {model.calls} model call(s)")
+
+        # Later requests in the same bucket are served from Redis, by any replica
+        other_replica = QuoteCache(distance_resolution=args.distance_resolution)
+        await other_replica.get_quote(quote_request(132, 236, 17.48, pickup + timedelta(minutes=20)),
+                                      model.get_prediction)
+        check(model.calls == 1 and other_replica.hits == 1, "a second replica hits the shared cache")
+
+        # Failures reach every waiter and are not cached
+        model.fail = True
+        results = await asyncio.gather(*(cache.get_quote(quote_request(1, 2, 3.0, pickup), model.get_prediction)
+                                         for _ in range(10)), return_exceptions=True)
+        model.fail = False
+        await cache.get_quote(quote_request(1, 2, 3.0, pickup), model.get_prediction)
+        check(all(isinstance(r, HTTPException) for r in results) and model.calls == 3,
+              "a failed model call fails its waiters and is retried next time")
+
+        # A new model version does not serve quotes cached for the old one
+        await client.set(MODEL_VERSION_KEY, 'benchmark-v2')
+        model.version = 'benchmark-v2'
+        fresh = QuoteCache(distance_resolution=args.distance_resolution)
+        await fresh.get_quote(quote_request(132, 236, 17.43, pickup), model.get_prediction)
+        check(model.calls == 4, "quotes are re-fetched after the model version changes")
+
+        # Burst of quotes concentrated on a few hot routes
+        await clear(client)
+        rng = random.Random(0)
+        hot = [(rng.randint(1, 263), rng.randint(1, 263), round(rng.uniform(1, 20), 1)) for _ in range(20)]
+        burst = []
+        for _ in range(args.requests):
+            if rng.random() < args.hot_share:
+                pu, do, distance = rng.choice(hot)
+                distance += rng.uniform(0, 0.09)
+            else:
+                pu, do, distance = rng.randint(1, 263), rng.randint(1, 263), rng.uniform(0.5, 30)
+            burst.append(quote_request(pu, do, distance, pickup + timedelta(minutes=rng.randint(0, 50))))
+
+        for name, cache in (('uncached', QuoteCache(ttl=0)),
+                            ('cached', QuoteCache(distance_resolution=args.distance_resolution))):
+            model = FakeModel(args.latency, version='benchmark-v2')
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one(request):
+                async with semaphore:
+                    await cache.get_quote(request, model.get_prediction)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(request) for request in burst))
+            elapsed = time.perf_counter() - start
+            stats = cache.stats()
+            print(f"{name:<9} {len(burst)} requests, {model.calls} model calls, "
+                  f"{stats['hits']} hits, {stats['coalesced']} coalesced, {len(burst) / elapsed:.0f} req/s")
+    finally:
+        await clear(client)
+        if previous_version is None:
+            await client.delete(MODEL_VERSION_KEY)
+        else:
+            await client.set(MODEL_VERSION_KEY, previous_version)
+        await redis_conn.close_async()
+    return len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the shared quote cache')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests in the burst')
+    parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight at once')
+    parser.add_argument('--hot-share', type=float, default=0.7, help='Share of the burst on the hot routes')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per model call')
+    parser.add_argument('--distance-resolution', type=float, default=0.1,
+                        help='Distance bucket, in miles, for the bucketed checks and the cached burst')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
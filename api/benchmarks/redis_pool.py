@@ -0,0 +1,155 @@
+"""
+Check of the API's Redis connection pool, reconnects and pipelining.
+
+With Redis unreachable (--down-port, where nothing listens), checks that
+importing redis_conn does not wait for Redis and that a failing command
+backs off without stalling the event loop. Against the Redis at
+REDIS_HOST/REDIS_PORT, checks that commands succeed after Redis drops every
+pooled connection, then sends --requests concurrent enqueues plus cache
+writes (what a quote miss costs) through a --pool-size pool, once as one
+command each and once through CommandBatcher, and reports wall time,
+connection acquisitions, pool waits and round-trips for both. Exits
+non-zero if any check fails:
+
+    python -m benchmarks.redis_pool --requests 5000 --pool-size 8
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+import redis
+from redis_conn import REDIS_MAX_CONNECTIONS, REDIS_RETRIES, CommandBatcher, redis_conn
+
+KEY_PREFIX = 'benchmark:redis_pool:'
+
+
+def check_import(check, down_port: int):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import redis_conn'], check=True,
+                   env=dict(os.environ, REDIS_PORT=str(down_port), REDIS_SHARDS=''),
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    elapsed = time.perf_counter() - start
+    check(elapsed < 5, f"importing redis_conn with Redis down takes {elapsed:.2f}s (no connection at import)")
+
+
+async def check_loop_unblocked(check, down_port: int):
+    client = redis_conn._create_async_client('localhost', down_port)
+    lags = []
+
+    async def ticker():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    ticking = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    try:
+        await client.get(f"{KEY_PREFIX}missing")
+        failed = False
+    except redis.ConnectionError:
+        failed = True
+    elapsed = time.perf_counter() - start
+    ticking.cancel()
+    await client.aclose()
+    check(failed, f"a command to an unreachable Redis fails after {REDIS_RETRIES} retries ({elapsed:.2f}s of backoff)")
+    check(max(lags) < 0.05, f"the event loop keeps running meanwhile ({len(lags)} ticks, "
+                            f"worst lag {max(lags) * 1000:.1f} ms)")
+
+
+async def check_reconnect(check):
+    client = redis_conn.async_client
+    await asyncio.gather(*(client.ping() for _ in range(8)))  # fill the pool with connections
+    killed = redis_conn.client.client_kill_filter(_type='normal', skipme=True)
+    try:
+        replies = await asyncio.gather(*(client.ping() for _ in range(8)))
+        recovered = all(replies)
+    except redis.RedisError:
+        recovered = False
+    check(recovered, f"commands succeed after Redis drops all {killed} connections")
+
+
+async def load(client, requests: int, batched: bool) -> float:
+    """Seconds to send an enqueue and a cache write for every request, all at once."""
+    batcher = CommandBatcher(client)
+
+    async def one(i: int):
+        payload, key = f"request-{i}", f"{KEY_PREFIX}quote:{i}"
+        if batched:
+            await asyncio.gather(batcher.submit(lambda pipe: pipe.lpush(f"{KEY_PREFIX}queue", payload)),
+                                 batcher.submit(lambda pipe: pipe.set(key, payload, ex=60)))
+        else:
+            await client.lpush(f"{KEY_PREFIX}queue", payload)
+            await client.set(key, payload, ex=60)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - start
+
+
+async def compare(check, args):
+    results = {}
+    for batched in (False, True):
+        # A fresh pool per run, so the counters cover that run only
+        client = redis_conn._create_async_client(*redis_conn.endpoints[0])
+        client.connection_pool.max_connections = args.pool_size
+        await load(client, 100, batched)  # open the connections
+        pool = client.connection_pool
+        acquired_before, exhausted_before = pool.acquired, pool.exhausted
+        elapsed = await load(client, args.requests, batched)
+        stats = pool.stats()
+        name = 'pipelined' if batched else 'one command each'
+        results[name] = elapsed
+        print(f"{name:<17} {args.requests / elapsed:9.0f} requests/sec  "
+              f"{pool.acquired - acquired_before:6d} acquisitions  "
+              f"{pool.exhausted - exhausted_before:6d} found the pool exhausted  "
+              f"wait p50 {stats['wait_ms']['p50']} ms  p99 {stats['wait_ms']['p99']} ms")
+        await client.aclose()
+    check(results['pipelined'] < results['one command each'],
+          f"pipelining is {results['one command each'] / results['pipelined']:.1f}x faster "
+          f"through a {args.pool_size}-connection pool")
+
+
+async def main_async(args) -> int:
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    print(f"pool size {REDIS_MAX_CONNECTIONS} connections per endpoint")
+    try:
+        check_import(check, args.down_port)
+        await check_loop_unblocked(check, args.down_port)
+        await check_reconnect(check)
+        await compare(check, args)
+
+        # The batcher shared by the API's own requests, for a look at what /metrics reports
+        batcher = redis_conn.batcher()
+        await asyncio.gather(*(batcher.submit(lambda pipe: pipe.ping()) for _ in range(100)))
+        check(batcher.stats()['pipelines'] < 100,
+              f"/metrics reports pooling and pipelining per endpoint: {redis_conn.stats()}")
+    finally:
+        keys = list(redis_conn.client.scan_iter(f"{KEY_PREFIX}*"))
+        if keys:
+            redis_conn.client.delete(*keys)
+        await redis_conn.close_async()
+    return len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the Redis connection pool, reconnects and pipelining')
+    parser.add_argument('--requests', type=int, default=5000, help='Concurrent requests to send')
+    parser.add_argument('--pool-size', type=int, default=8, help='Connections in the pool under load')
+    parser.add_argument('--down-port', type=int, default=6399, help='A port where no Redis listens')
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    sys.exit(1 if asyncio.run(main_async(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
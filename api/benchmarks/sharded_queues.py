@@ -0,0 +1,173 @@
+"""
+Check for request queues sharded over several Redis instances.
+
+First checks the consistent hash ring on its own: keys spread evenly over
+the shards, and adding a shard moves only about 1/(n+1) of them, all to the
+new shard. Then starts --shards local redis-server processes and the model
+service with REDIS_SHARDS listing them and --workers worker processes, sends
+requests through AsyncPredictionClient and checks that every one is answered
+and that every shard carried its share. Reports requests/sec, how the
+requests split between shards, and latency one request at a time. Exits
+non-zero if any check fails. Run from the api directory, with redis-server
+on the PATH (or --redis-server):
+
+    python -m benchmarks.sharded_queues --shards 3 --workers 2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List
+import numpy as np
+import redis
+from shard_ring import ShardRing
+
+MODEL_DIR = os.getenv('MODEL_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                '..', 'model'))
+# Zones with a row in taxi_zones.csv (57, 104 and 105 have none)
+ZONES = [zone for zone in range(1, 264) if zone not in (57, 104, 105)]
+
+
+def check_ring(check, shards: int, keys: int):
+    names = [f"localhost:{7000 + i}" for i in range(shards)]
+    sample = [f"request-{i}" for i in range(keys)]
+    ring = ShardRing(names)
+    owners = [ring.shard(key) for key in sample]
+    counts = Counter(owners)
+    spread = max(counts.values()) / min(counts.values())
+    check(len(counts) == shards and spread < 1.3,
+          f"{keys} keys spread over {shards} shards within 30% ({spread:.2f}x between the fullest and emptiest)")
+
+    grown = ShardRing(names + [f"localhost:{7000 + shards}"])
+    moved = [(old, grown.shard(key)) for key, old in zip(sample, owners) if grown.shard(key) != old]
+    share = len(moved) / keys
+    expected = 1 / (shards + 1)
+    check(abs(share - expected) < expected * 0.3 and all(new == shards for _, new in moved),
+          f"adding a shard moves {share:.1%} of keys (ideal {expected:.1%}), all to the new shard")
+
+
+def start_redis(binary: str, port: int) -> subprocess.Popen:
+    process = subprocess.Popen([binary, '--port', str(port), '--save', '', '--appendonly', 'no'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    client = redis.Redis(port=port)
+    for _ in range(50):
+        try:
+            client.ping()
+            return process
+        except redis.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"redis-server did not start on port {port}")
+
+
+async def run_requests(args, ports: List[int], check):
+    # The connection singleton reads REDIS_SHARDS when it is first imported
+    from prediction_client import AsyncPredictionClient
+    from redis_conn import redis_conn
+
+    rng = random.Random(1)
+    requests = [{
+        'PULocationID': rng.choice(ZONES),
+        'DOLocationID': rng.choice(ZONES),
+        'store_and_fwd_flag': 'N',
+        'trip_distance': round(rng.uniform(0.5, 30), 2),
+        'tpep_pickup_datetime': datetime(2024, 5, 3, rng.randint(0, 23), rng.randint(0, 59))
+    } for _ in range(args.requests)]
+    client = AsyncPredictionClient()
+    try:
+        # Wait for the workers to answer on every shard before starting the clock
+        deadline = time.monotonic() + args.timeout
+        while True:
+            try:
+                await asyncio.gather(*(client.get_prediction(dict(request), timeout=2) for request in requests[:20]))
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"the model service did not answer within {args.timeout}s")
+
+        before = [redis.Redis(port=port).info('stats')['total_commands_processed'] for port in ports]
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(request):
+            async with semaphore:
+                return await client.get_prediction(dict(request), timeout=args.timeout)
+
+        start = time.perf_counter()
+        replies = await asyncio.gather(*(one(request) for request in requests), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        after = [redis.Redis(port=port).info('stats')['total_commands_processed'] for port in ports]
+
+        answered = [reply for reply in replies if isinstance(reply, dict) and 'total_amount' in reply]
+        print(f"{len(answered)}/{len(requests)} requests answered in {elapsed:.2f}s "
+              f"({len(answered) / elapsed:.0f} requests/sec over {len(ports)} shards)")
+        check(len(answered) == len(requests), "every request is answered through its shard")
+
+        per_shard = Counter(redis_conn.shard_of(reply['request_id']) for reply in answered)
+        print("requests per shard: " + ", ".join(f"{port}: {per_shard[shard]}" for shard, port in enumerate(ports)))
+        commands = [b - a for a, b in zip(before, after)]
+        check(all(per_shard[shard] > 0 and commands[shard] > 0 for shard in range(len(ports))),
+              "every shard carries requests and replies")
+
+        # One request at a time: a worker with several shards blocks on one of them at a
+        # time when idle, so a lone request can wait up to SHARD_BLOCK_TIMEOUT
+        latencies = []
+        for request in requests[:args.idle_requests]:
+            start = time.perf_counter()
+            await client.get_prediction(dict(request), timeout=args.timeout)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"idle latency p50 {np.percentile(latencies, 50):.2f} ms  p99 {np.percentile(latencies, 99):.2f} ms")
+
+        for key in redis_conn.client.scan_iter('model_workers:*'):
+            print(f"worker {key.split(':', 1)[1]} consumes {', '.join(json.loads(redis_conn.client.get(key))['shards'])}")
+        await client.stop()
+    finally:
+        await redis_conn.close_async()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check request queues sharded over several Redis instances')
+    parser.add_argument('--shards', type=int, default=3, help='Local Redis instances to start')
+    parser.add_argument('--workers', type=int, default=2, help='Model worker processes (WORKERS)')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests to send')
+    parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight at once')
+    parser.add_argument('--idle-requests', type=int, default=200, help='Requests sent one at a time for idle latency')
+    parser.add_argument('--port', type=int, default=7400, help='Port of the first Redis instance')
+    parser.add_argument('--redis-server', type=str, default='redis-server', help='redis-server binary')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for replies')
+    args = parser.parse_args()
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    check_ring(check, args.shards, 100000)
+
+    ports = [args.port + i for i in range(args.shards)]
+    servers = [start_redis(args.redis_server, port) for port in ports]
+    shards = ','.join(f"localhost:{port}" for port in ports)
+    os.environ['REDIS_SHARDS'] = shards
+    worker = subprocess.Popen([sys.executable, '-W', 'ignore', 'main.py'], cwd=MODEL_DIR,
+                              env=dict(os.environ, WORKERS=str(args.workers)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        logging.disable(logging.ERROR)
+        asyncio.run(run_requests(args, ports, check))
+    finally:
+        worker.terminate()
+        worker.wait(timeout=30)
+        for server in servers:
+            server.terminate()
+            server.wait()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
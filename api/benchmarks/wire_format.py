@@ -0,0 +1,158 @@
+"""
+Size and encode/decode cost of the JSON and binary wire formats.
+
+Builds the request and reply messages the API and the model service exchange
+for a single trip and for batches of several sizes, and reports bytes per
+message and microseconds to encode and decode it in each format (the API
+encodes requests and decodes replies, the worker the reverse). Checks that
+binary messages round-trip exactly, including through a str decoded with
+errors='surrogateescape' as the Redis clients hand them over, that payloads
+the layout cannot carry fall back to JSON, that unknown versions are
+rejected, and that api/ and model/ carry the same wire_format.py. Exits
+non-zero if any check fails. Needs no Redis:
+
+    python -m benchmarks.wire_format --batch-sizes 10 100 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+from wire_format import (WIRE_BINARY, WIRE_JSON, decode_reply, decode_request, encode_reply, encode_request,
+                         version_of)
+
+MODEL_DIR = os.getenv('MODEL_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                '..', 'model'))
+# Zones with a row in taxi_zones.csv (57, 104 and 105 have none)
+ZONES = [zone for zone in range(1, 264) if zone not in (57, 104, 105)]
+
+
+def random_requests(n: int, seed: int) -> List[Dict[str, Any]]:
+    # As in benchmarks.inference_mode, which needs Redis to import
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return [{
+        'PULocationID': rng.choice(ZONES),
+        'DOLocationID': rng.choice(ZONES),
+        'store_and_fwd_flag': 'N',
+        'trip_distance': round(rng.uniform(0.5, 30), 2),
+        'tpep_pickup_datetime': start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+    } for _ in range(n)]
+
+
+def request(trips: List[Dict[str, Any]], batch: bool) -> Dict[str, Any]:
+    data = {'trips': trips} if batch else dict(trips[0])
+    data.update(request_id='2f1c7a52-8a4e-4a43-9d7e-7b1f0f3d5c11',
+                reply_to='prediction_responses:api-2f1c7a52', reply_ttl=60, deadline=1715000000.25)
+    return data
+
+
+def reply(n: int, batch: bool) -> Dict[str, Any]:
+    predictions = [{
+        'trip_duration': 812.5 + i,
+        'fare_amount': 17.3,
+        'tolls_amount': 0.0,
+        'congestion_surcharge': 2.5,
+        'total_amount': 24.81 + i / 100,
+        'model_version': '20240503-1'
+    } for i in range(n)]
+    if not batch:
+        return {'request_id': '2f1c7a52-8a4e-4a43-9d7e-7b1f0f3d5c11', **predictions[0]}
+    predictions[-1] = {'error': 'Unknown pickup zone 57'}
+    return {'request_id': '2f1c7a52-8a4e-4a43-9d7e-7b1f0f3d5c11', 'predictions': predictions}
+
+
+def per_call_us(call: Callable[[], Any], min_time: float) -> float:
+    """Mean microseconds per call, over at least min_time seconds."""
+    calls, start = 0, time.perf_counter()
+    while True:
+        for _ in range(10):
+            call()
+        calls += 10
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls * 1e6
+
+
+def with_iso_pickups(data: Dict[str, Any]) -> Dict[str, Any]:
+    """A request as a JSON reader sees it, with pickup times as ISO strings."""
+    def iso(trip):
+        return dict(trip, tpep_pickup_datetime=trip['tpep_pickup_datetime'].isoformat())
+    return dict(data, trips=[iso(trip) for trip in data['trips']]) if 'trips' in data else iso(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the JSON and binary wire formats')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000], help='Trips per batch request')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Seconds to time each measurement for')
+    args = parser.parse_args()
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    print(f"{'message':<22} {'format':<7} {'bytes':>9} {'encode us':>10} {'decode us':>10}")
+    for n in [1] + args.batch_sizes:
+        batch = n > 1
+        label = f"batch of {n}" if batch else "single trip"
+        messages = (
+            ('request', request(random_requests(n, seed=n), batch), encode_request, decode_request),
+            ('reply', reply(n, batch), encode_reply, decode_reply)
+        )
+        for kind, data, encode, decode in messages:
+            sizes = {}
+            for version, name in ((WIRE_JSON, 'json'), (WIRE_BINARY, 'binary')):
+                raw = encode(data, version)
+                sizes[name] = len(raw)
+                print(f"{label + ' ' + kind:<22} {name:<7} {len(raw):>9} "
+                      f"{per_call_us(lambda: encode(data, version), args.min_time):>10.1f} "
+                      f"{per_call_us(lambda: decode(raw), args.min_time):>10.1f}")
+            check(sizes['binary'] < sizes['json'],
+                  f"binary {label} {kind} is smaller ({sizes['binary']} vs {sizes['json']} bytes, "
+                  f"{sizes['binary'] / sizes['json']:.0%})")
+
+            raw = encode(data, WIRE_BINARY)
+            as_str = raw.decode('utf-8', 'surrogateescape')
+            if kind == 'request':
+                check(decode_request(raw) == (data, WIRE_BINARY) and decode_request(as_str) == (data, WIRE_BINARY),
+                      f"binary {label} request round-trips exactly, as bytes and as str")
+                check(decode_request(encode_request(data)) == (with_iso_pickups(data), WIRE_JSON),
+                      f"JSON {label} request reads as before, pickup times as ISO strings")
+            else:
+                check(decode_reply(raw) == data and decode_reply(as_str) == data,
+                      f"binary {label} reply round-trips exactly, as bytes and as str")
+
+    trip = random_requests(1, seed=0)[0]
+    fallbacks = {
+        'an extra field': dict(request([trip], False), passenger_count=1),
+        'a missing field': {k: v for k, v in request([trip], False).items() if k != 'store_and_fwd_flag'},
+        'a timezone-aware pickup': request([dict(trip, tpep_pickup_datetime=datetime(2024, 5, 3, tzinfo=timezone.utc))],
+                                           True),
+        'a zone out of range': request([dict(trip, PULocationID=70000)], False),
+        'a string distance': request([dict(trip, trip_distance='3.2')], False)
+    }
+    for description, data in fallbacks.items():
+        check(version_of(encode_request(data, WIRE_BINARY)) == WIRE_JSON,
+              f"a request with {description} falls back to JSON")
+    check(version_of(encode_reply({'request_id': None, 'error': 'Invalid request'}, WIRE_BINARY)) == WIRE_JSON,
+          "a reply without a request_id falls back to JSON")
+
+    try:
+        decode_request(b'\x07' + encode_request(request([trip], False), WIRE_BINARY)[1:])
+        check(False, "an unknown wire format version is rejected")
+    except ValueError:
+        check(True, "an unknown wire format version is rejected")
+
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wire_format.py')) as f:
+        api_copy = f.read()
+    with open(os.path.join(MODEL_DIR, 'wire_format.py')) as f:
+        check(f.read() == api_copy, "api/wire_format.py and model/wire_format.py are identical")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Agreement check and benchmark for the raster zone grid.
+
+Builds a ZoneGrid at the requested resolution in a temporary directory and
+checks that grid lookups (with the polygon fallback for boundary cells)
+return the same LocationID as the exact polygon path. It tests random points
+over NYC and jittered points near zone boundaries. Exits non-zero on any
+disagreement. Run from the api directory:
+
+    python -m benchmarks.zone_grid_agreement --resolution 0.0005 --points 20000
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+import shapely
+from services.zone_grid import ZoneGrid
+from services.zone_mapper import ZoneMapper, UNKNOWN_LOCATION_ID
+
+
+def boundary_points(geometries: np.ndarray, n: int, jitter: float, seed: int = 7) -> np.ndarray:
+    """(lat, lon) samples scattered around zone polygon vertices."""
+    rng = np.random.default_rng(seed)
+    coords = shapely.get_coordinates(shapely.boundary(geometries))
+    picked = coords[rng.integers(0, len(coords), n)]
+    picked += rng.uniform(-jitter, jitter, picked.shape)
+    return np.column_stack([picked[:, 1], picked[:, 0]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check raster zone grid against exact polygon lookups')
+    parser.add_argument('--resolution', type=float, default=0.0005, help='Grid cell size in degrees')
+    parser.add_argument('--points', type=int, default=20000, help='Number of points per sample set')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    mapper = ZoneMapper()
+    exact_grid, mapper._grid = mapper._grid, None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        grid = ZoneGrid.load_or_build(
+            Path(tmp) / 'zone_grid.npy', args.resolution, mapper._geometries,
+            mapper._zone_ids, mapper._bounds, UNKNOWN_LOCATION_ID
+        )
+        print(f"built {grid.n_rows}x{grid.n_cols} grid in {time.perf_counter() - start:.1f}s")
+
+        rng = np.random.default_rng(42)
+        minx, miny, maxx, maxy = mapper._bounds
+        sample_sets = {
+            'uniform': np.column_stack([rng.uniform(miny, maxy, args.points), rng.uniform(minx, maxx, args.points)]),
+            'boundary': boundary_points(mapper._geometries, args.points, args.resolution * 2),
+        }
+
+        failed = False
+        for name, points in sample_sets.items():
+            lats, lons = points[:, 0], points[:, 1]
+
+            mapper._grid = None
+            start = time.perf_counter()
+            exact = [(mapper.get_zone_from_coordinates(lat, lon) or {}).get('location_id', UNKNOWN_LOCATION_ID)
+                     for lat, lon in points]
+            exact_time = time.perf_counter() - start
+            exact_bulk = mapper.get_location_ids_bulk(lats, lons)
+
+            mapper._grid = grid
+            start = time.perf_counter()
+            gridded = [(mapper.get_zone_from_coordinates(lat, lon) or {}).get('location_id', UNKNOWN_LOCATION_ID)
+                       for lat, lon in points]
+            grid_time = time.perf_counter() - start
+            gridded_bulk = mapper.get_location_ids_bulk(lats, lons)
+
+            mismatches = int(np.sum(np.asarray(exact) != np.asarray(gridded)))
+            bulk_mismatches = int(np.sum(exact_bulk != gridded_bulk))
+            print(f"{name:<9} exact {len(points) / exact_time:>10,.0f}/s  grid {len(points) / grid_time:>10,.0f}/s  "
+                  f"mismatches {mismatches} (single), {bulk_mismatches} (bulk)")
+            failed = failed or mismatches > 0 or bulk_mismatches > 0
+        mapper._grid = exact_grid
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
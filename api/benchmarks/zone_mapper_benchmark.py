@@ -0,0 +1,68 @@
+"""
+Micro-benchmark for coordinate-to-zone lookups.
+
+Compares the original linear scan over every zone polygon with the indexed
+ZoneMapper.get_zone_from_coordinates and the vectorized
+ZoneMapper.get_location_ids_bulk. Run from the api directory:
+
+    python -m benchmarks.zone_mapper_benchmark --points 2000
+"""
+import argparse
+import logging
+import time
+import numpy as np
+from shapely.geometry import Point
+from services.zone_mapper import ZoneMapper
+
+
+def linear_scan_lookup(zones_gdf, lat: float, lon: float):
+    """Original lookup: test the point against each polygon in turn."""
+    point = Point(lon, lat)
+    for _, zone in zones_gdf.iterrows():
+        if point.within(zone['geometry']):
+            return int(zone['zone_id'])
+    return None
+
+
+def sample_points(bounds, n: int, seed: int = 42) -> np.ndarray:
+    """Uniform (lat, lon) samples over a box slightly larger than NYC."""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    pad_x, pad_y = (maxx - minx) * 0.1, (maxy - miny) * 0.1
+    lats = rng.uniform(miny - pad_y, maxy + pad_y, n)
+    lons = rng.uniform(minx - pad_x, maxx + pad_x, n)
+    return np.column_stack([lats, lons])
+
+
+def run(name: str, lookup, points: np.ndarray) -> list:
+    start = time.perf_counter()
+    results = [lookup(lat, lon) for lat, lon in points]
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14} {len(points) / elapsed:>12,.0f} lookups/s  ({elapsed * 1e6 / len(points):,.1f} us/lookup)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark coordinate-to-zone lookups')
+    parser.add_argument('--points', type=int, default=2000, help='Number of random points to resolve')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    mapper = ZoneMapper()
+    points = sample_points(mapper.zones_gdf.total_bounds, args.points)
+
+    before = run('linear scan', lambda lat, lon: linear_scan_lookup(mapper.zones_gdf, lat, lon), points)
+    after = run('strtree', lambda lat, lon: (mapper.get_zone_from_coordinates(lat, lon) or {}).get('location_id'), points)
+
+    start = time.perf_counter()
+    bulk = mapper.get_location_ids_bulk(points[:, 0], points[:, 1])
+    elapsed = time.perf_counter() - start
+    print(f"{'bulk':<14} {len(points) / elapsed:>12,.0f} lookups/s  ({elapsed * 1e6 / len(points):,.1f} us/lookup)")
+
+    mismatches = sum(b != a for b, a in zip(before, after))
+    bulk_mismatches = sum((a or 265) != b for a, b in zip(after, bulk))
+    print(f"mismatches: {mismatches} (strtree), {bulk_mismatches} (bulk)")
+
+
+if __name__ == "__main__":
+    main()
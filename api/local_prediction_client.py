@@ -0,0 +1,211 @@
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Dict, Any, List, Optional
+from fastapi import HTTPException
+from redis_conn import redis_conn
+from services.admission import DEGRADED, AdmissionControl, degraded_quote
+from prediction_client import LANES, REQUEST_BUDGET, _raise_for_error
+from logger import Logger
+
+logger = Logger.get_logger('LocalPredictionClient')
+
+# Model service directory (its code and artifacts), loaded by each pool process.
+MODEL_DIR = os.getenv('MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+# Processes scoring requests; each holds its own copy of the models.
+LOCAL_INFERENCE_WORKERS = int(os.getenv('LOCAL_INFERENCE_WORKERS', 1))
+# Seconds between checks for replaced model artifacts, as on a worker's heartbeat.
+ARTIFACT_CHECK_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', 5))
+# Same key the model workers publish their version under, read by the quote cache.
+MODEL_VERSION_KEY = 'model_version'
+# Packages the model service needs beyond the API's own requirements
+MODEL_PACKAGES = ('joblib', 'sklearn', 'xgboost')
+
+# Set in each pool process by _init_worker
+_predictor = None
+_next_artifact_check = 0.0
+
+
+def _init_worker(model_dir: str):
+    """Load the model service's Predictor in a pool process."""
+    global _predictor
+    model_dir = os.path.abspath(model_dir)
+    # The model service's modules share names with the API's (main, logger,
+    # wire_format), so they must come first on the path and not be shadowed by the
+    # API's copies this process has already imported
+    shadowed = {os.path.splitext(entry)[0] for entry in os.listdir(model_dir)
+                if entry.endswith('.py') or os.path.isfile(os.path.join(model_dir, entry, '__init__.py'))}
+    for name in list(sys.modules):
+        if name.split('.')[0] in shadowed:
+            del sys.modules[name]
+    # Log like a model worker, through the model service's own handler only
+    logging.getLogger().handlers.clear()
+    sys.path.insert(0, model_dir)
+    # Artifact and zone file paths are relative to the model directory
+    os.chdir(model_dir)
+    from main import Predictor
+    _predictor = Predictor(local=True)
+
+
+def check_model_dir(model_dir: str):
+    """
+    Raise ValueError unless the model service can be loaded from model_dir, so a
+    misconfigured API fails at startup rather than on its first request. The API
+    image ships neither the model code nor its packages.
+    """
+    if not os.path.isfile(os.path.join(model_dir, 'main.py')):
+        raise ValueError(f"INFERENCE_MODE=local loads the model service from MODEL_DIR, but "
+                         f"{os.path.abspath(model_dir)} has no main.py. Point MODEL_DIR at the model "
+                         f"directory or use INFERENCE_MODE=redis")
+    missing = [package for package in MODEL_PACKAGES if importlib.util.find_spec(package) is None]
+    if missing:
+        raise ValueError(f"INFERENCE_MODE=local needs the packages in model/requirements.txt, but "
+                         f"{', '.join(missing)} {'is' if len(missing) == 1 else 'are'} not installed. "
+                         f"Install them or use INFERENCE_MODE=redis")
+
+
+def _handle_request(data: Dict[str, Any]) -> Dict[str, Any]:
+    global _next_artifact_check
+    now = time.monotonic()
+    if now >= _next_artifact_check:
+        _next_artifact_check = now + ARTIFACT_CHECK_INTERVAL
+        _predictor._check_artifacts()
+    return _predictor.handle_request(data)
+
+
+def _model_version() -> str:
+    return _predictor.model_version_id
+
+
+class LocalPredictionClient:
+    """
+    Prediction client that scores in this host's own process pool instead of
+    sending requests through Redis to the model service.
+
+    Selected with INFERENCE_MODE=local. The pool processes load the model service's
+    Predictor from MODEL_DIR, so replies are the same payloads a model worker sends,
+    without the Redis round-trips or the JSON encoding. Redis is still used for the
+    shared quote cache, when it is reachable. The pool has no priority lanes: both
+    lanes share it, and only their admission counters and latencies are kept apart.
+    """
+
+    def __init__(self, workers: int = LOCAL_INFERENCE_WORKERS, model_dir: str = MODEL_DIR):
+        check_model_dir(model_dir)
+        self.workers = max(1, workers)
+        self.model_dir = model_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warm_up_task: Optional[asyncio.Task] = None
+        self._published_version: Optional[str] = None
+        self._in_flight = dict.fromkeys(LANES, 0)
+        # There is no queue to measure; the pool's backlog is this process's in-flight requests
+        self.admission = {lane: AdmissionControl(None, partial(self._in_flight.get, lane)) for lane in LANES}
+
+    def start(self):
+        """Start the process pool and load the models in the background."""
+        if self._executor is not None:
+            return
+        # Spawned, not forked: the API process has an event loop and Redis connections
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(self.model_dir,))
+        self._warm_up_task = asyncio.get_running_loop().create_task(self._warm_up())
+        logger.info(f"Started {self.workers} local inference process(es) from {self.model_dir}")
+
+    async def stop(self):
+        """Shut the process pool down, failing any request still waiting on it."""
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+            self._warm_up_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _warm_up(self):
+        """Load the models in every pool process and publish their version."""
+        loop = asyncio.get_running_loop()
+        try:
+            versions = await asyncio.gather(*(loop.run_in_executor(self._executor, _model_version)
+                                              for _ in range(self.workers)))
+            await self._publish_version(versions[0])
+            logger.info(f"Local inference ready, model version {versions[0]}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Local inference failed to start: {str(e)}")
+
+    async def _publish_version(self, model_version: Optional[str]):
+        """Advertise the loaded model version to the quote cache, as model workers do."""
+        if not model_version or model_version == self._published_version:
+            return
+        try:
+            await redis_conn.async_client.set(MODEL_VERSION_KEY, model_version)
+            self._published_version = model_version
+        except Exception as e:
+            logger.error(f"Could not publish the model version: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-lane admission counters and latencies for /metrics."""
+        return {lane: admission.stats() for lane, admission in self.admission.items()}
+
+    async def get_prediction(self, data: Dict[str, Any], timeout: float = REQUEST_BUDGET,
+                             lane: str = 'interactive') -> Dict[str, Any]:
+        """Score one trip in the process pool."""
+        if self.admission[lane].admit() == DEGRADED:
+            return degraded_quote(data)
+        response_dict = await self._request(data, timeout, lane)
+        await self._publish_version(response_dict.get('model_version'))
+        return response_dict
+
+    async def get_predictions(self, trips: List[Dict[str, Any]], timeout: float = REQUEST_BUDGET,
+                              lane: str = 'interactive') -> List[Dict[str, Any]]:
+        """
+        Score several trips in one call to the process pool, in order. A trip the
+        model could not score comes back as a dict with an 'error' field rather
+        than failing the others.
+        """
+        if self.admission[lane].admit() == DEGRADED:
+            return [degraded_quote(trip) for trip in trips]
+        response_dict = await self._request({'trips': trips}, timeout, lane)
+        versions = [p['model_version'] for p in response_dict['predictions'] if 'model_version' in p]
+        if versions:
+            await self._publish_version(versions[0])
+        return response_dict['predictions']
+
+    async def _request(self, data: Dict[str, Any], timeout: float, lane: str) -> Dict[str, Any]:
+        """Run one request in the process pool and return its reply."""
+        self.start()
+
+        request_id = str(uuid.uuid4())
+        data['request_id'] = request_id
+        # Requests still queued for the pool when the caller gives up are skipped there
+        data['deadline'] = time.time() + timeout
+        logger.debug(f"Scoring prediction request {request_id} locally")
+
+        self._in_flight[lane] += 1
+        start = time.perf_counter()
+        try:
+            response_dict = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(self._executor, _handle_request, data), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Prediction request {request_id} timed out after {timeout} seconds")
+            raise HTTPException(status_code=408, detail="Prediction request timed out")
+        except BrokenProcessPool as e:
+            # A pool process died (or could not load the models); start a fresh pool next time
+            logger.error(f"Local inference pool failed: {str(e)}")
+            await self.stop()
+            raise HTTPException(status_code=503, detail="Service temporarily unavailable")
+        finally:
+            self._in_flight[lane] -= 1
+        self.admission[lane].observe(time.perf_counter() - start)
+
+        _raise_for_error(request_id, response_dict)
+        logger.debug(f"Response data: {response_dict}")
+        return response_dict
@@ -1,15 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 from typing import Dict, Any
-from routers.predictions import router as predictions_router
+from routers.predictions import router as predictions_router, prediction_client, quote_cache
 from redis_conn import redis_conn
 from logger import Logger
 
 # Configure logging
 logger = Logger.get_logger('main')
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the shared response dispatcher before serving requests
+    prediction_client.start()
+    try:
+        await redis_conn.async_client.ping()
+    except Exception as e:
+        # Serve anyway: commands reconnect on their own once Redis is back
+        logger.warning(f"Redis is not reachable yet: {str(e)}")
+    yield
+    await prediction_client.stop()
+    await redis_conn.close_async()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,8 +53,20 @@ async def root():
 async def health_check():
     logger.info("Health check endpoint called")
     try:
-        redis_conn.client.ping()
+        await redis_conn.async_client.ping()
         return {"status": "healthy", "redis": "connected"}
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return {"status": "unhealthy", "redis": str(e)}
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Per-lane admission control (queue depth, in-flight requests, rejections, latency),
+    quote cache counters, and Redis connection pool waits and pipelining per endpoint.
+    """
+    return {
+        "lanes": prediction_client.stats(),
+        "quote_cache": quote_cache.stats(),
+        "redis": redis_conn.stats()
+    }
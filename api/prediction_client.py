@@ -1,62 +1,256 @@
-import json
+import asyncio
 import uuid
-from datetime import datetime
-import logging
-from typing import Dict, Any
+from functools import partial
+from typing import Dict, Any, List, Optional, Union
+import os
 import time
 from fastapi import HTTPException
+from redis.exceptions import ResponseError
 from redis_conn import redis_conn
+from services.admission import DEGRADED, AdmissionControl, degraded_quote
+from wire_format import WIRE_BINARY, WIRE_JSON, decode_reply, encode_request
 from logger import Logger
 
 logger = Logger.get_logger('PredictionClient')
 
-class PredictionClient:
-    def __init__(self):
-        self.redis_client = redis_conn.client
+# Replies are routed to a reply key per API process; the model worker sets this TTL
+# on it so replies nobody is waiting for anymore expire on their own.
+RESPONSE_KEY_PREFIX = 'prediction_responses:'
+RESPONSE_TTL = int(os.getenv('RESPONSE_TTL', 60))
+
+# Seconds a prediction may take end to end. Each request carries a 'deadline' this
+# far ahead (a Unix time), so the model workers drop it unscored once the API has
+# stopped waiting for it.
+REQUEST_BUDGET = float(os.getenv('REQUEST_BUDGET', 30))
+
+# Must match the model service: 'list' pushes requests onto a plain list, 'stream'
+# adds them to a Redis Stream consumed through a group, capped at STREAM_MAXLEN
+# entries (approximately; the oldest entries are trimmed first).
+REQUEST_TRANSPORT = os.getenv('REQUEST_TRANSPORT', 'list')
+REQUEST_QUEUE = os.getenv('REQUEST_QUEUE', 'prediction_requests')
+REQUEST_STREAM = os.getenv('REQUEST_STREAM', 'prediction_stream')
+STREAM_GROUP = os.getenv('STREAM_GROUP', 'predictors')
+STREAM_MAXLEN = int(os.getenv('STREAM_MAXLEN', 100000))
+
+# 'redis' sends requests through Redis to the model service; 'local' scores them in
+# a process pool on this host that loads the model service's code (see
+# local_prediction_client.py). Both return the same replies.
+INFERENCE_MODE = os.getenv('INFERENCE_MODE', 'redis')
+
+# Priority lanes, as in the model service: interactive requests go to REQUEST_QUEUE
+# (or REQUEST_STREAM), bulk ones to the same name suffixed with ':bulk'. Workers
+# serve the interactive lane first but keep a minimum share for bulk.
+LANES = ('interactive', 'bulk')
+
+# Format of the request messages (see wire_format.py): 'json', or 'binary' for the
+# compact fixed-layout encoding. Workers reply in the format each request came in
+# and read both, so switch to 'binary' only once every worker understands it.
+WIRE_FORMAT = os.getenv('WIRE_FORMAT', 'json')
+WIRE_VERSIONS = {'json': WIRE_JSON, 'binary': WIRE_BINARY}
+if WIRE_FORMAT not in WIRE_VERSIONS:
+    raise ValueError(f"Unknown WIRE_FORMAT {WIRE_FORMAT!r}, expected one of {', '.join(WIRE_VERSIONS)}")
+WIRE_VERSION = WIRE_VERSIONS[WIRE_FORMAT]
+
+
+def lane_key(name: str, lane: str) -> str:
+    """Redis key of a lane's list or stream."""
+    return name if lane == 'interactive' else f"{name}:{lane}"
+
+
+def _raise_for_error(request_id: str, response_dict: Dict[str, Any]):
+    """Turn an error reply from the model service into an HTTPException."""
+    if 'error' in response_dict:
+        logger.error(f"Prediction request {request_id} failed: {response_dict['error']}")
+        raise HTTPException(status_code=500, detail=response_dict['error'])
+
+
+def _enqueue(pipe, payload: Union[str, bytes], lane: str = 'interactive'):
+    """Add the command sending a request on the configured transport to a pipeline."""
+    if REQUEST_TRANSPORT == 'stream':
+        return pipe.xadd(lane_key(REQUEST_STREAM, lane), {'data': payload}, maxlen=STREAM_MAXLEN,
+                         approximate=True)
+    return pipe.lpush(lane_key(REQUEST_QUEUE, lane), payload)
+
+
+async def _queue_depth(redis_client, limit: int, lane: str = 'interactive') -> int:
+    """Requests waiting for a model worker in a lane; streams are counted up to limit."""
+    if REQUEST_TRANSPORT != 'stream':
+        return await redis_client.llen(lane_key(REQUEST_QUEUE, lane))
+    stream = lane_key(REQUEST_STREAM, lane)
+    try:
+        groups = await redis_client.xinfo_groups(stream)
+    except ResponseError:
+        return 0  # no stream yet
+    for group in groups:
+        if group['name'] != STREAM_GROUP:
+            continue
+        if group.get('lag') is not None:
+            return group['lag']
+        # Redis before 7 reports no lag; count the entries after the group's last delivery
+        undelivered = await redis_client.xrange(stream, min=f"({group['last-delivered-id']}", max='+',
+                                                count=limit)
+        return len(undelivered)
+    return 0
+
+
+class AsyncPredictionClient:
+    """
+    Non-blocking prediction client for the FastAPI event loop.
+
+    All requests from this process share one reply key. A single background
+    dispatcher task reads completions from it and resolves the pending future
+    registered under each request_id. With several Redis shards, each request goes
+    to the shard its request_id hashes to and its reply comes back there, so there
+    is one dispatcher per shard. Requests enqueued together are sent to their shard
+    in one pipeline. Each priority lane has its own admission control, against its
+    own queue depth (summed over shards) and in-flight count.
+    """
+
+    def __init__(self, response_batch: int = 100):
+        self.instance_id = uuid.uuid4().hex
+        self.reply_key = f"{RESPONSE_KEY_PREFIX}api:{self.instance_id}"
+        self.response_batch = response_batch
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._dispatchers: List[asyncio.Task] = []
+        self._in_flight = dict.fromkeys(LANES, 0)
+        self.admission = {lane: AdmissionControl(partial(self._queue_depth, lane), partial(self._in_flight.get, lane))
+                          for lane in LANES}
+
+    @property
+    def redis_client(self):
+        return redis_conn.async_client
+
+    async def _queue_depth(self, lane: str) -> int:
+        admission = self.admission[lane]
+        limit = max(admission.max_queue_depth, admission.degrade_queue_depth) + 1
+        if redis_conn.shards == 1:
+            return await _queue_depth(self.redis_client, limit, lane)
+        depths = await asyncio.gather(*(_queue_depth(redis_conn.async_shard_client(shard), limit, lane)
+                                        for shard in range(redis_conn.shards)))
+        return sum(depths)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-lane admission counters and latencies for /metrics."""
+        return {lane: admission.stats() for lane, admission in self.admission.items()}
+
+    def start(self):
+        """Start the response dispatchers on the running event loop."""
+        if not self._dispatchers or any(dispatcher.done() for dispatcher in self._dispatchers):
+            for dispatcher in self._dispatchers:
+                dispatcher.cancel()
+            loop = asyncio.get_running_loop()
+            self._dispatchers = [loop.create_task(self._dispatch_responses(redis_conn.async_shard_client(shard)))
+                                 for shard in range(redis_conn.shards)]
+            logger.info(f"Started response dispatcher on {self.reply_key}")
+
+    async def stop(self):
+        """Stop the dispatchers and fail any request still waiting for a reply."""
+        if self._dispatchers:
+            for dispatcher in self._dispatchers:
+                dispatcher.cancel()
+            # Don't let an in-flight blocking read hold up shutdown
+            await asyncio.wait(set(self._dispatchers), timeout=2)
+            self._dispatchers = []
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(HTTPException(status_code=503, detail="Service shutting down"))
+        self._pending.clear()
+
+    def _resolve(self, response_data: Union[str, bytes]):
+        """Hand a reply to the request waiting for it, if any."""
+        response_dict = decode_reply(response_data)
+        future = self._pending.get(response_dict.get('request_id'))
+        if future is None or future.done():
+            logger.debug(f"Discarding reply for unknown request {response_dict.get('request_id')}")
+            return
+        future.set_result(response_dict)
+
+    async def _dispatch_responses(self, redis_client):
+        """Read completions from this process's reply key on one shard and resolve their futures."""
+        while True:
+            try:
+                response = await redis_client.brpop(self.reply_key, timeout=1)
+                if response is None:
+                    continue
+                self._resolve(response[1])
+                # Drain whatever else has already arrived in one round-trip
+                queued = await redis_client.rpop(self.reply_key, self.response_batch)
+                for response_data in queued or []:
+                    self._resolve(response_data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error while dispatching responses: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def get_prediction(self, data: Dict[str, Any], timeout: float = REQUEST_BUDGET,
+                             lane: str = 'interactive') -> Dict[str, Any]:
+        """Send prediction request to model service and await its response."""
+        if self.admission[lane].admit() == DEGRADED:
+            return degraded_quote(data)
+        return await self._request(data, timeout, lane)
+
+    async def get_predictions(self, trips: List[Dict[str, Any]], timeout: float = REQUEST_BUDGET,
+                              lane: str = 'interactive') -> List[Dict[str, Any]]:
+        """
+        Send several trips to the model service as one batch request and await their
+        predictions, in order. A trip the model could not score comes back as a dict
+        with an 'error' field rather than failing the others.
+        """
+        if self.admission[lane].admit() == DEGRADED:
+            return [degraded_quote(trip) for trip in trips]
+        response_dict = await self._request({'trips': list(trips)}, timeout, lane)
+        return response_dict['predictions']
+
+    async def _request(self, data: Dict[str, Any], timeout: float, lane: str) -> Dict[str, Any]:
+        """Enqueue one request message on a lane and await its reply."""
+        self.start()
 
-    def get_prediction(self, data: Dict[str, Any], timeout: int = 30) -> Dict[str, Any]:
-        """Send prediction request to model service and wait for response."""
-        # Add request ID and convert datetime
         request_id = str(uuid.uuid4())
         data['request_id'] = request_id
-        
-        if isinstance(data.get('tpep_pickup_datetime'), datetime):
-            data['tpep_pickup_datetime'] = data['tpep_pickup_datetime'].isoformat()
+        data['reply_to'] = self.reply_key
+        data['reply_ttl'] = RESPONSE_TTL
+        data['deadline'] = time.time() + timeout
 
         logger.info(f"Sending prediction request {request_id}")
         logger.debug(f"Request data: {data}")
 
-        # Send request to model service
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._in_flight[lane] += 1
+        start = time.perf_counter()
         try:
-            self.redis_client.lpush('prediction_requests', json.dumps(data))
-            logger.info(f"Prediction request {request_id} sent successfully")
-        except Exception as e:
-            logger.error(f"Failed to send prediction request: {str(e)}")
-            raise HTTPException(status_code=503, detail="Service temporarily unavailable")
-
-        # Wait for response with timeout
-        start_time = time.time()
-        while time.time() - start_time < timeout:
             try:
-                response = self.redis_client.brpop('prediction_responses', timeout=1)
-                if response is None:
-                    continue
+                # Pipelined with the other commands for this shard in the same loop iteration
+                payload = encode_request(data, WIRE_VERSION)
+                await redis_conn.batcher(redis_conn.shard_of(request_id)).submit(
+                    lambda pipe: _enqueue(pipe, payload, lane))
+                logger.info(f"Prediction request {request_id} sent successfully")
+            except Exception as e:
+                logger.error(f"Failed to send prediction request: {str(e)}")
+                raise HTTPException(status_code=503, detail="Service temporarily unavailable")
 
-                _, response_data = response
-                response_dict = json.loads(response_data)
+            try:
+                response_dict = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Prediction request {request_id} timed out after {timeout} seconds")
+                raise HTTPException(status_code=408, detail="Prediction request timed out")
+            self.admission[lane].observe(time.perf_counter() - start)
+        finally:
+            self._pending.pop(request_id, None)
+            self._in_flight[lane] -= 1
 
-                if response_dict.get('request_id') == request_id:
-                    if 'error' in response_dict:
-                        logger.error(f"Prediction request {request_id} failed: {response_dict['error']}")
-                        raise HTTPException(status_code=500, detail=response_dict['error'])
-                    
-                    logger.info(f"Received prediction response for request {request_id}")
-                    logger.debug(f"Response data: {response_dict}")
-                    return response_dict
+        _raise_for_error(request_id, response_dict)
+        logger.info(f"Received prediction response for request {request_id}")
+        logger.debug(f"Response data: {response_dict}")
+        return response_dict
 
-            except Exception as e:
-                logger.error(f"Error while waiting for response: {str(e)}")
-                raise HTTPException(status_code=503, detail="Service temporarily unavailable")
 
-        logger.error(f"Prediction request {request_id} timed out after {timeout} seconds")
-        raise HTTPException(status_code=408, detail="Prediction request timed out")
\ No newline at end of file
+def create_prediction_client(mode: str = INFERENCE_MODE):
+    """Prediction client for the INFERENCE_MODE setting."""
+    if mode == 'local':
+        from local_prediction_client import LocalPredictionClient
+        return LocalPredictionClient()
+    if mode == 'redis':
+        return AsyncPredictionClient()
+    raise ValueError(f"Unknown INFERENCE_MODE {mode!r}, expected 'redis' or 'local'")
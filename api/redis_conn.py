@@ -1,16 +1,168 @@
+import asyncio
 import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.retry import Retry
 from logger import Logger
-import sys
 import os
 import time
-from typing import Optional
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from shard_ring import ShardRing
 
 # Configure logging
 logger = Logger.get_logger('redis')
 
+# Requests one API process handles at once (match uvicorn's --limit-concurrency if
+# it is set). A request holds at most one Redis connection at a time, so each
+# endpoint's asyncio pool gets API_CONCURRENCY connections, plus
+# REDIS_RESERVED_CONNECTIONS for the reply dispatcher, queue depth reads and health
+# checks, unless REDIS_MAX_CONNECTIONS sets its size. A caller finding every
+# connection in use waits up to REDIS_POOL_TIMEOUT seconds for one.
+API_CONCURRENCY = int(os.getenv('API_CONCURRENCY', 64))
+REDIS_RESERVED_CONNECTIONS = 4
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', API_CONCURRENCY + REDIS_RESERVED_CONNECTIONS))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+# Connections idle for longer than this many seconds are pinged before reuse, so one
+# Redis (or a proxy) has dropped is replaced instead of failing a request.
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+# Commands that cannot reach Redis are retried on a new connection REDIS_RETRIES
+# times, backing off exponentially up to REDIS_RETRY_BACKOFF seconds. asyncio
+# clients back off with asyncio.sleep, so the event loop keeps serving meanwhile.
+REDIS_RETRIES = int(os.getenv('REDIS_RETRIES', 3))
+REDIS_RETRY_BACKOFF = float(os.getenv('REDIS_RETRY_BACKOFF', 1))
+# Connection acquisitions kept for the wait time percentiles in /metrics
+POOL_WAIT_WINDOW = 1000
+
+# Redis endpoints the request queues are spread over, as 'host:port,host:port'. Each
+# request goes to one of them by consistent hashing on its request_id; the quote
+# cache and model version stay on the first. Must list the same endpoints, in the
+# same order, as the model service. Unset, the only endpoint is REDIS_HOST:REDIS_PORT.
+REDIS_SHARDS = os.getenv('REDIS_SHARDS', '')
+
+
+def redis_endpoints(shards: str = REDIS_SHARDS) -> List[Tuple[str, int]]:
+    """(host, port) of every Redis shard, in REDIS_SHARDS order."""
+    if not shards.strip():
+        return [(os.getenv('REDIS_HOST', 'localhost'), int(os.getenv('REDIS_PORT', 6379)))]
+    endpoints = []
+    for endpoint in shards.split(','):
+        host, _, port = endpoint.strip().rpartition(':')
+        endpoints.append((host or 'localhost', int(port)))
+    return endpoints
+
+
+class MeteredConnectionPool(aioredis.BlockingConnectionPool):
+    """
+    Blocking connection pool that records how long callers wait for a connection,
+    including connecting and health checking it, and how often every connection
+    was already in use.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.acquired = 0
+        self.exhausted = 0
+        self._checked_out = set()
+        self._waits = deque(maxlen=POOL_WAIT_WINDOW)
+
+    async def get_connection(self, *args, **kwargs):
+        if len(self._checked_out) >= self.max_connections:
+            self.exhausted += 1
+        start = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        self._waits.append(time.perf_counter() - start)
+        self.acquired += 1
+        self._checked_out.add(connection)
+        return connection
+
+    async def release(self, connection):
+        self._checked_out.discard(connection)
+        await super().release(connection)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            'max_connections': self.max_connections,
+            'in_use': len(self._checked_out),
+            'acquired': self.acquired,
+            'exhausted': self.exhausted,
+            'wait_ms': {
+                'p50': round(waits[int(len(waits) * 0.5)] * 1000, 3) if waits else None,
+                'p99': round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else None,
+                'max': round(waits[-1] * 1000, 3) if waits else None
+            }
+        }
+
+
+class CommandBatcher:
+    """
+    Sends the commands submitted to one Redis endpoint during an event loop
+    iteration in a single pipeline, on one pooled connection. Commands submitted
+    while a pipeline is in flight go out in the next one, so under load a request
+    waits at most one extra round-trip and Redis sees far fewer of them.
+    """
+
+    def __init__(self, client: aioredis.Redis):
+        self.client = client
+        self.pipelines = 0
+        self.commands = 0
+        self._queued: List[Tuple[Callable[[Any], Any], asyncio.Future]] = []
+        self._sender: Optional[asyncio.Task] = None
+
+    def submit(self, command: Callable[[Any], Any]) -> asyncio.Future:
+        """
+        Queue command, called with the pipeline to add one command to it. The returned
+        future resolves to that command's reply, or raises its error.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queued.append((command, future))
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.ensure_future(self._send())
+        return future
+
+    async def _send(self):
+        while self._queued:
+            batch, self._queued = self._queued, []
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                for command, _ in batch:
+                    command(pipe)
+                results = await pipe.execute(raise_on_error=False)
+            except Exception as e:
+                results = [e] * len(batch)
+            self.pipelines += 1
+            self.commands += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue  # the caller gave up waiting
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pipelines': self.pipelines,
+            'commands': self.commands,
+            'commands_per_pipeline': round(self.commands / self.pipelines, 2) if self.pipelines else None
+        }
+
+
 class RedisConnection:
+    """
+    Redis clients for the API, one per shard, created on first use. No connection is
+    made at import: a Redis that is down or restarting fails (or delays, while
+    retries back off) only the commands sent meanwhile.
+    """
     _instance: Optional['RedisConnection'] = None
     _client: Optional[redis.Redis] = None
+    _async_client: Optional[aioredis.Redis] = None
+    _shard_clients: Dict[int, redis.Redis] = {}
+    _async_shard_clients: Dict[int, aioredis.Redis] = {}
+    _batchers: Dict[int, CommandBatcher] = {}
 
     def __new__(cls):
         if cls._instance is None:
@@ -18,40 +170,118 @@ class RedisConnection:
         return cls._instance
 
     def __init__(self):
-        if self._client is None:
-            self._connect()
+        if not hasattr(self, 'endpoints'):
+            self.endpoints = redis_endpoints()
+            self.ring = ShardRing([f"{host}:{port}" for host, port in self.endpoints])
 
-    def _connect(self, max_retries: int = 5, retry_delay: int = 5):
-        """Establish Redis connection with retry logic."""
-        host = os.getenv('REDIS_HOST', 'localhost')
-        port = int(os.getenv('REDIS_PORT', 6379))
-
-        for attempt in range(max_retries):
-            try:
-                self._client = redis.Redis(
-                    host=host,
-                    port=port,
-                    db=0,
-                    decode_responses=True,
-                    socket_timeout=5
-                )
-                # Test the connection
-                self._client.ping()
-                logger.info(f"Successfully connected to Redis at {host}:{port}")
-                return
-            except redis.ConnectionError as e:
-                if attempt == max_retries - 1:
-                    logger.error(f"Could not connect to Redis after {max_retries} attempts: {str(e)}")
-                    raise Exception(f"Could not connect to Redis after {max_retries} attempts: {str(e)}")
-                logger.warning(f"Failed to connect to Redis (attempt {attempt + 1}/{max_retries}). Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+    def _create_client(self, host: str, port: int) -> redis.Redis:
+        # Sync clients back off with time.sleep, so keep them off the event loop
+        pool = redis.BlockingConnectionPool(
+            host=host,
+            port=port,
+            db=0,
+            decode_responses=True,
+            encoding_errors='surrogateescape',  # binary messages survive the round trip through str
+            socket_timeout=5,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            retry=Retry(ExponentialBackoff(cap=REDIS_RETRY_BACKOFF), REDIS_RETRIES,
+                        supported_errors=(RedisConnectionError,)),
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT
+        )
+        return redis.Redis(connection_pool=pool)
 
     @property
     def client(self) -> redis.Redis:
         """Get Redis client instance."""
         if self._client is None:
-            self._connect()
+            self._client = self._create_client(*self.endpoints[0])
         return self._client
 
+    @property
+    def async_client(self) -> aioredis.Redis:
+        """Get asyncio Redis client backed by a shared connection pool."""
+        if self._async_client is None:
+            self._async_client = self._create_async_client(*self.endpoints[0])
+        return self._async_client
+
+    def _create_async_client(self, host: str, port: int) -> aioredis.Redis:
+        # Blocking pool: callers wait for a free connection instead of failing.
+        # Connection errors are retried, not timeouts: a command that timed out may
+        # have run, and an enqueue must not run twice.
+        pool = MeteredConnectionPool(
+            host=host,
+            port=port,
+            db=0,
+            decode_responses=True,
+            encoding_errors='surrogateescape',
+            socket_timeout=5,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            retry=AsyncRetry(ExponentialBackoff(cap=REDIS_RETRY_BACKOFF), REDIS_RETRIES,
+                             supported_errors=(RedisConnectionError,)),
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT
+        )
+        logger.info(f"Created async Redis connection pool for {host}:{port} "
+                    f"({REDIS_MAX_CONNECTIONS} connections)")
+        return aioredis.Redis(connection_pool=pool)
+
+    @property
+    def shards(self) -> int:
+        """Number of Redis shards the request queues are spread over."""
+        return len(self.endpoints)
+
+    def shard_of(self, request_id: str) -> int:
+        """Shard whose queues carry a request, by consistent hashing on its request_id."""
+        return self.ring.shard(request_id)
+
+    def shard_client(self, shard: int) -> redis.Redis:
+        """Redis client for a shard; shard 0 is the main client."""
+        if shard == 0:
+            return self.client
+        if shard not in self._shard_clients:
+            self._shard_clients[shard] = self._create_client(*self.endpoints[shard])
+        return self._shard_clients[shard]
+
+    def async_shard_client(self, shard: int) -> aioredis.Redis:
+        """Asyncio Redis client for a shard, each with its own connection pool; shard 0 is async_client."""
+        if shard == 0:
+            return self.async_client
+        if shard not in self._async_shard_clients:
+            self._async_shard_clients[shard] = self._create_async_client(*self.endpoints[shard])
+        return self._async_shard_clients[shard]
+
+    def batcher(self, shard: int = 0) -> CommandBatcher:
+        """Pipelines the commands submitted to a shard's asyncio client in the same event loop iteration."""
+        if shard not in self._batchers:
+            self._batchers[shard] = CommandBatcher(self.async_shard_client(shard))
+        return self._batchers[shard]
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection pool and pipelining counters of every endpoint's asyncio client, for /metrics."""
+        clients = {0: self._async_client, **self._async_shard_clients}
+        stats = {}
+        for shard, client in sorted(clients.items()):
+            if client is None:
+                continue
+            host, port = self.endpoints[shard]
+            stats[f"{host}:{port}"] = {
+                'pool': client.connection_pool.stats(),
+                'pipelining': self._batchers[shard].stats() if shard in self._batchers else None
+            }
+        return stats
+
+    async def close_async(self):
+        """Close the asyncio clients and disconnect their pools."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        for client in self._async_shard_clients.values():
+            await client.aclose()
+        self._async_shard_clients.clear()
+        # Batchers hold the closed clients
+        self._batchers.clear()
+
+
 # Global Redis connection instance
 redis_conn = RedisConnection()
\ No newline at end of file
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from datetime import datetime
-from typing import Dict, Any
-from prediction_client import PredictionClient
-from schemas.prediction import TripRequest, TripPrediction
+from typing import Dict, Any, Optional
+from functools import partial
+import asyncio
+import numpy as np
+from prediction_client import create_prediction_client
+from schemas.prediction import (TripRequest, TripPrediction, BatchTripRequest,
+                                BatchPredictionItem, BatchPredictionResponse, Lane)
 from services.zone_mapper import ZoneMapper
+from services.quote_cache import QuoteCache
+from services.file_scoring import (MEDIA_TYPES, ChunkWriter, FileFormatError, check_columns, detect_format,
+                                   file_schema, output_schema, read_chunks, score_chunk, spool)
 from logger import Logger
 
 # Initialize logger
@@ -16,14 +25,16 @@ router = APIRouter(
 )
 
 # Initialize prediction client
-prediction_client = PredictionClient()
+prediction_client = create_prediction_client()
+quote_cache = QuoteCache()
 zone_mapper = ZoneMapper()
 @router.post("", response_model=TripPrediction)
-async def create_prediction(data: TripRequest):
+async def create_prediction(data: TripRequest, priority: Optional[Lane] = Header(None, alias="X-Priority")):
     """
     Create a new prediction for taxi trip details.
     
-    Returns predicted trip duration, fare amount, and other costs.
+    Returns predicted trip duration, fare amount, and other costs. Queued on the
+    interactive lane unless X-Priority says otherwise.
     """
     logger.info("Prediction endpoint called")
     logger.debug(f"Received request data: {data}")
@@ -50,8 +61,9 @@ async def create_prediction(data: TripRequest):
             "tpep_pickup_datetime": data.pickup_datetime
         }
 
-        # Get prediction from model service
-        prediction = prediction_client.get_prediction(model_request)
+        # Get prediction from the shared quote cache, or the model service on a miss
+        prediction = await quote_cache.get_quote(
+            model_request, partial(prediction_client.get_prediction, lane=priority or 'interactive'))
         
         logger.info("Successfully processed prediction request")
         logger.debug(f"Prediction result: {prediction}")
@@ -63,4 +75,153 @@ async def create_prediction(data: TripRequest):
         raise e
     except Exception as e:
         logger.error(f"Unexpected error during prediction: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/batch", response_model=BatchPredictionResponse)
+async def create_batch_prediction(data: BatchTripRequest, priority: Optional[Lane] = Header(None, alias="X-Priority")):
+    """
+    Create predictions for many trips in one call.
+
+    Returns one entry per trip, in request order, holding either its prediction
+    or the error that kept that trip from being priced. Queued on the bulk lane
+    unless X-Priority says otherwise.
+    """
+    logger.info(f"Batch prediction endpoint called with {len(data.trips)} trips")
+
+    try:
+        items = [None] * len(data.trips)
+        trips, positions = [], []
+        for i, trip in enumerate(data.trips):
+            if isinstance(trip, TripRequest):
+                trips.append(trip)
+                positions.append(i)
+                continue
+            try:
+                TripRequest.model_validate(trip)
+            except ValidationError as e:
+                items[i] = BatchPredictionItem(error="; ".join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+
+        if trips:
+            # Pickups and dropoffs resolved together in one vectorized pass
+            lats = np.array([trip.pickup_location.latitude for trip in trips]
+                            + [trip.dropoff_location.latitude for trip in trips])
+            lons = np.array([trip.pickup_location.longitude for trip in trips]
+                            + [trip.dropoff_location.longitude for trip in trips])
+            location_ids = zone_mapper.get_location_ids_bulk(lats, lons)
+
+            model_requests = [
+                {
+                    "PULocationID": int(location_ids[j]),
+                    "DOLocationID": int(location_ids[len(trips) + j]),
+                    "store_and_fwd_flag": "N",
+                    "trip_distance": trip.trip_distance,
+                    "tpep_pickup_datetime": trip.pickup_datetime
+                }
+                for j, trip in enumerate(trips)
+            ]
+
+            # Cached quotes are answered directly; the rest go to the model service as one request
+            quotes = await quote_cache.get_quotes(
+                model_requests, partial(prediction_client.get_predictions, lane=priority or 'bulk'))
+
+            for i, quote in zip(positions, quotes):
+                if isinstance(quote, Exception):
+                    items[i] = BatchPredictionItem(error=getattr(quote, 'detail', None) or str(quote))
+                    continue
+                try:
+                    items[i] = BatchPredictionItem(prediction=TripPrediction(**quote))
+                except Exception as e:
+                    items[i] = BatchPredictionItem(error=str(e))
+
+        logger.info(f"Processed batch of {len(items)} trips, {sum(item.error is not None for item in items)} failed")
+        return BatchPredictionResponse(predictions=items)
+
+    except HTTPException as e:
+        logger.error(f"HTTP error during batch prediction: {str(e)}")
+        raise e
+    except Exception as e:
+        logger.error(f"Unexpected error during batch prediction: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/file")
+async def score_file(request: Request, file_format: Optional[str] = Query(None, alias="format"),
+                     priority: Optional[Lane] = Header(None, alias="X-Priority")):
+    """
+    Score a file of trips, streaming the results back chunk by chunk.
+
+    The request body is NDJSON, CSV, Parquet or Arrow IPC (chosen by Content-Type
+    or ?format=) with pickup_latitude, pickup_longitude, dropoff_latitude,
+    dropoff_longitude, trip_distance and optionally pickup_datetime columns. The
+    response is in the same format: every input row with PULocationID,
+    DOLocationID, the predicted amounts, degraded and error columns appended.
+    If the rest of the file cannot be read or scored once the response has
+    started, the output ends with a row whose only value is that error.
+    Queued on the bulk lane unless X-Priority says otherwise.
+    """
+    try:
+        file_format = detect_format(request.headers.get('content-type'), file_format)
+    except FileFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    upload = await spool(request.stream())
+    chunks = read_chunks(upload, file_format)
+    loop = asyncio.get_running_loop()
+
+    def next_chunk():
+        # Parsed on a worker thread, so the event loop keeps serving while it runs
+        return loop.run_in_executor(None, next, chunks, None)
+
+    # Read the schema and first chunk up front, so a malformed file still gets an error status
+    try:
+        declared = file_schema(upload, file_format)
+        first = await next_chunk()
+        if first is None:
+            raise FileFormatError("The file has no rows")
+        check_columns(first)
+    except Exception as e:
+        upload.close()
+        raise HTTPException(status_code=400, detail=f"Could not read the file: {str(e)}")
+    logger.info(f"Scoring a {file_format} file")
+    get_predictions = partial(prediction_client.get_predictions, lane=priority or 'bulk')
+
+    def score(table):
+        return asyncio.ensure_future(score_chunk(
+            table, zone_mapper.get_location_ids_bulk,
+            lambda model_requests: quote_cache.get_quotes(model_requests, get_predictions)))
+
+    # Text formats only declare their column names (the CSV header); those come from the first chunk
+    schema = output_schema(declared or first.schema)
+
+    async def scored_chunks():
+        writer = ChunkWriter(file_format, schema)
+        rows = 0
+        failure = None
+        scoring = score(first)
+        try:
+            while scoring is not None:
+                # Read the next chunk while the current one is being scored
+                try:
+                    table = await next_chunk()
+                except Exception as e:
+                    table, failure = None, f"Could not read the rest of the file: {str(e)}"
+                try:
+                    result = await scoring
+                except Exception as e:
+                    scoring, failure = None, f"Could not score the rows after row {rows}: {str(e)}"
+                    break
+                scoring = score(table) if table is not None else None
+                rows += result.num_rows
+                yield writer.write(result)
+            if failure is not None:
+                # The 200 has already gone out, so the file itself has to say it stops short
+                logger.error(f"Stopped scoring a {file_format} file after {rows} rows: {failure}")
+                yield writer.error(failure)
+            yield writer.close()
+            logger.info(f"Scored {rows} rows from a {file_format} file")
+        finally:
+            if scoring is not None:
+                scoring.cancel()
+            upload.close()
+
+    return StreamingResponse(scored_chunks(), media_type=MEDIA_TYPES[file_format])
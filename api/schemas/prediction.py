@@ -1,6 +1,14 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional, Union
+from typing_extensions import Annotated, Literal
+import os
+
+# Most trips accepted by one call to the batch endpoint
+MAX_BATCH_TRIPS = int(os.getenv('MAX_BATCH_TRIPS', 1000))
+
+# Priority lane a request is queued on, set with the X-Priority header
+Lane = Literal['interactive', 'bulk']
 
 class LocationCoordinates(BaseModel):
     latitude: float = Field(..., ge=-90, le=90, description="Latitude coordinate")
@@ -24,6 +32,7 @@ class TripPrediction(BaseModel):
     tolls_amount: float = Field(ge=0, description="Predicted tolls amount in USD")
     congestion_surcharge: float = Field(ge=0, description="Predicted congestion surcharge in USD")
     total_amount: float = Field(ge=0, description="Predicted total amount in USD")
+    degraded: bool = Field(default=False, description="Estimated from the rate card while the model service is overloaded")
 
     class Config:
         json_schema_extra = {
@@ -32,6 +41,20 @@ class TripPrediction(BaseModel):
                 "fare_amount": 32.50,
                 "tolls_amount": 0.0,
                 "congestion_surcharge": 2.50,
-                "total_amount": 35.00
+                "total_amount": 35.00,
+                "degraded": False
             }
-        }
\ No newline at end of file
+        }
+
+class BatchTripRequest(BaseModel):
+    # A trip that is not a valid TripRequest is kept as a plain dict, so it fails on
+    # its own instead of rejecting the whole batch
+    trips: List[Annotated[Union[TripRequest, Dict[str, Any]], Field(union_mode='left_to_right')]] = Field(
+        ..., min_length=1, max_length=MAX_BATCH_TRIPS, description=f"Trips to price, at most {MAX_BATCH_TRIPS}")
+
+class BatchPredictionItem(BaseModel):
+    prediction: Optional[TripPrediction] = Field(default=None, description="Prediction, if the trip could be priced")
+    error: Optional[str] = Field(default=None, description="Why the trip could not be priced")
+
+class BatchPredictionResponse(BaseModel):
+    predictions: List[BatchPredictionItem] = Field(..., description="One entry per trip, in request order")
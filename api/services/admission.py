@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException
+from logger import Logger
+
+logger = Logger.get_logger('services.admission')
+
+# Admission control for requests to the model service. Past MAX_QUEUE_DEPTH requests
+# waiting for a model worker, new ones are refused with 503; past MAX_IN_FLIGHT
+# requests awaiting replies in this API process, with 429. Both carry a Retry-After
+# of RETRY_AFTER seconds. Past DEGRADE_QUEUE_DEPTH, quotes that miss the cache are
+# estimated from the rate card instead of queued. 0 disables a threshold.
+MAX_QUEUE_DEPTH = int(os.getenv('MAX_QUEUE_DEPTH', 2000))
+DEGRADE_QUEUE_DEPTH = int(os.getenv('DEGRADE_QUEUE_DEPTH', 500))
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 1000))
+RETRY_AFTER = int(os.getenv('RETRY_AFTER', 1))
+# Seconds between queue depth reads; requests are admitted against the last reading
+# and never wait for a read.
+QUEUE_DEPTH_REFRESH = float(os.getenv('QUEUE_DEPTH_REFRESH', 0.05))
+# Answered requests kept for the latency percentiles in /metrics
+LATENCY_WINDOW = 1000
+# Outcomes of AdmissionControl.admit() for a request that is not refused
+ADMITTED = 'admitted'
+DEGRADED = 'degraded'
+
+# NYC yellow cab rate card for degraded quotes: the initial charge plus $0.70 per
+# fifth of a mile, at an assumed average speed.
+RATE_INITIAL_CHARGE = 3.00
+RATE_PER_MILE = 3.50
+DEGRADED_SPEED_MPH = 12.0
+
+
+def degraded_quote(model_request: Dict[str, Any]) -> Dict[str, Any]:
+    """Rate card estimate for a model request, shaped like a model service reply."""
+    distance = float(model_request['trip_distance'])
+    fare = round(RATE_INITIAL_CHARGE + RATE_PER_MILE * distance, 2)
+    return {
+        'model_version': 'degraded',
+        'degraded': True,
+        'trip_duration': round(distance / DEGRADED_SPEED_MPH * 60, 2),
+        'fare_amount': fare,
+        'tolls_amount': 0.0,
+        'congestion_surcharge': 0.0,
+        'total_amount': fare
+    }
+
+
+class AdmissionControl:
+    """
+    Decides whether a request may be sent to the model service.
+
+    Compares the model service's queue depth, read in the background at most every
+    QUEUE_DEPTH_REFRESH seconds, and this process's in-flight requests against the
+    thresholds. Counts admissions, degraded answers and rejections, and keeps the
+    latencies of recent answered requests, for /metrics.
+    """
+
+    def __init__(self, queue_depth: Optional[Callable[[], Awaitable[int]]], in_flight: Callable[[], int],
+                 max_queue_depth: int = MAX_QUEUE_DEPTH, degrade_queue_depth: int = DEGRADE_QUEUE_DEPTH,
+                 max_in_flight: int = MAX_IN_FLIGHT, retry_after: int = RETRY_AFTER):
+        self._read_queue_depth = queue_depth
+        self._in_flight = in_flight
+        self.max_queue_depth = max_queue_depth
+        self.degrade_queue_depth = degrade_queue_depth
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.queue_depth = 0
+        self.admitted = 0
+        self.degraded = 0
+        self.rejected = {'queue_depth': 0, 'in_flight': 0}
+        self._queue_depth_checked = 0.0
+        self._queue_depth_refresh: Optional[asyncio.Future] = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _refresh_queue_depth(self):
+        if self._read_queue_depth is None or self._queue_depth_refresh is not None \
+                or time.monotonic() - self._queue_depth_checked < QUEUE_DEPTH_REFRESH:
+            return
+        self._queue_depth_refresh = asyncio.ensure_future(self._update_queue_depth())
+
+    async def _update_queue_depth(self):
+        try:
+            self.queue_depth = await self._read_queue_depth()
+        except Exception as e:
+            logger.error(f"Could not read the queue depth: {str(e)}")
+        finally:
+            self._queue_depth_checked = time.monotonic()
+            self._queue_depth_refresh = None
+
+    def _reject(self, reason: str, status_code: int, detail: str):
+        self.rejected[reason] += 1
+        logger.info(f"Rejected a prediction request: {detail}")
+        raise HTTPException(status_code=status_code, detail=detail,
+                            headers={'Retry-After': str(self.retry_after)})
+
+    def admit(self) -> str:
+        """
+        Admit a request: ADMITTED if it may go to the model service, DEGRADED if it
+        should get a rate card quote instead. Raises a 503 or 429 HTTPException with
+        Retry-After if it is refused.
+        """
+        self._refresh_queue_depth()
+        if self.max_queue_depth and self.queue_depth >= self.max_queue_depth:
+            self._reject('queue_depth', 503, "Prediction service overloaded, retry later")
+        if self.max_in_flight and self._in_flight() >= self.max_in_flight:
+            self._reject('in_flight', 429, "Too many prediction requests in flight, retry later")
+        if self.degrade_queue_depth and self.queue_depth >= self.degrade_queue_depth:
+            self.degraded += 1
+            return DEGRADED
+        self.admitted += 1
+        return ADMITTED
+
+    def observe(self, seconds: float):
+        """Record the time an admitted request took to be answered."""
+        self._latencies.append(seconds)
+
+    def _latency_ms(self) -> Dict[str, Optional[float]]:
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {'p50': None, 'p99': None}
+        return {
+            'p50': round(latencies[int(len(latencies) * 0.5)] * 1000, 2),
+            'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': self._in_flight(),
+            'admitted': self.admitted,
+            'degraded': self.degraded,
+            'rejected': dict(self.rejected),
+            'latency_ms': self._latency_ms(),
+            'thresholds': {
+                'max_queue_depth': self.max_queue_depth,
+                'degrade_queue_depth': self.degrade_queue_depth,
+                'max_in_flight': self.max_in_flight
+            }
+        }
@@ -0,0 +1,377 @@
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from logger import Logger
+
+logger = Logger.get_logger('services.file_scoring')
+
+# Rows zone-mapped and sent to the model service at a time. Uploads are spooled to a
+# temporary file (a streaming response cannot read the request body, and Parquet
+# keeps its metadata at the end) and read back a chunk at a time, so memory use is
+# bounded by a few chunks whatever the size of the file.
+FILE_CHUNK_ROWS = int(os.getenv('FILE_CHUNK_ROWS', 5000))
+
+INPUT_COLUMNS = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude', 'trip_distance']
+# Optional; rows without it are priced at the current time, like the single-trip endpoint
+PICKUP_COLUMN = 'pickup_datetime'
+
+PREDICTION_FIELDS = ['trip_duration', 'fare_amount', 'tolls_amount', 'congestion_surcharge', 'total_amount']
+OUTPUT_SCHEMA = pa.schema(
+    [('PULocationID', pa.int32()), ('DOLocationID', pa.int32())]
+    + [(field, pa.float64()) for field in PREDICTION_FIELDS]
+    + [('degraded', pa.bool_()), ('error', pa.string())]
+)
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+# Request content types recognized as each format
+_CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/json-seq': 'ndjson',
+    'text/csv': 'csv',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.arrow.file': 'arrow'
+}
+
+
+class FileFormatError(ValueError):
+    """The uploaded file is not in a supported format or lacks required columns."""
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> str:
+    """File format from an explicit ?format= value or the request's Content-Type."""
+    if requested:
+        if requested not in MEDIA_TYPES:
+            raise FileFormatError(f"Unsupported format {requested!r}, expected one of {', '.join(MEDIA_TYPES)}")
+        return requested
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type not in _CONTENT_TYPES:
+        raise FileFormatError(f"Unsupported content type {media_type!r}; set Content-Type or ?format= "
+                              f"to one of {', '.join(MEDIA_TYPES)}")
+    return _CONTENT_TYPES[media_type]
+
+
+async def spool(body: AsyncIterator[bytes]):
+    """The request body in a temporary file, rewound; the file is deleted when closed."""
+    spool_file = tempfile.TemporaryFile()
+    try:
+        async for data in body:
+            spool_file.write(data)
+    except BaseException:
+        spool_file.close()
+        raise
+    spool_file.seek(0)
+    return spool_file
+
+
+def _line_chunks(source, chunk_rows: int) -> Iterator[List[bytes]]:
+    lines: List[bytes] = []
+    for line in source:
+        if line.strip():
+            lines.append(line)
+            if len(lines) == chunk_rows:
+                yield lines
+                lines = []
+    if lines:
+        yield lines
+
+
+def read_chunks(source, file_format: str, chunk_rows: int = FILE_CHUNK_ROWS) -> Iterator[pa.Table]:
+    """Input rows from a spooled file as Arrow tables of at most chunk_rows rows."""
+    if file_format == 'ndjson':
+        for lines in _line_chunks(source, chunk_rows):
+            records = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                # An unreadable line still gets an output row, with every input column null
+                records.append(record if isinstance(record, dict) else {})
+            yield _frame_to_table(pd.DataFrame.from_records(records))
+    elif file_format == 'csv':
+        for frame in pd.read_csv(source, chunksize=chunk_rows, dtype={PICKUP_COLUMN: str}):
+            yield _frame_to_table(frame)
+    elif file_format == 'parquet':
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+            yield pa.Table.from_batches([batch])
+    elif file_format == 'arrow':
+        for batch in _arrow_batches(source):
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield pa.Table.from_batches([batch.slice(offset, chunk_rows)])
+    else:
+        raise FileFormatError(f"Unsupported format {file_format!r}")
+
+
+def _frame_to_table(frame: pd.DataFrame) -> pa.Table:
+    """Arrow table for a parsed chunk, turning columns of mixed JSON types into strings."""
+    try:
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        for name in frame.columns:
+            if frame[name].dtype == object:
+                frame[name] = frame[name].map(lambda value: value if value is None else str(value))
+        return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def _arrow_batches(source) -> Iterator[pa.RecordBatch]:
+    """Record batches from an Arrow IPC stream or file."""
+    try:
+        reader = ipc.open_stream(source)
+    except pa.ArrowInvalid:
+        source.seek(0)
+        reader = ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+        return
+    yield from reader
+
+
+def file_schema(source, file_format: str) -> Optional[pa.Schema]:
+    """
+    The schema a Parquet or Arrow file declares for all of its rows, or None for the
+    text formats, whose types are only guessed chunk by chunk. Leaves source rewound.
+    """
+    try:
+        if file_format == 'parquet':
+            return pq.ParquetFile(source).schema_arrow
+        if file_format == 'arrow':
+            try:
+                return ipc.open_stream(source).schema
+            except pa.ArrowInvalid:
+                source.seek(0)
+                return ipc.open_file(source).schema
+        return None
+    finally:
+        source.seek(0)
+
+
+def output_schema(input_schema: pa.Schema) -> pa.Schema:
+    """
+    Schema of the scored output: the input columns, less any the scored columns
+    replace, then OUTPUT_SCHEMA. Every field is nullable, since rows that fail
+    keep null predictions and the trailing error row has only an error.
+    """
+    fields = [field for field in input_schema if field.name not in OUTPUT_SCHEMA.names] + list(OUTPUT_SCHEMA)
+    return pa.schema([field.with_nullable(True) for field in fields])
+
+
+def check_columns(table: pa.Table):
+    """Raise FileFormatError if a table lacks any required input column."""
+    missing = [column for column in INPUT_COLUMNS if column not in table.column_names]
+    if missing:
+        raise FileFormatError(f"Missing required columns: {', '.join(missing)}")
+
+
+def _float_column(table: pa.Table, name: str) -> np.ndarray:
+    if name not in table.column_names:
+        return np.full(table.num_rows, np.nan)
+    return pd.to_numeric(table.column(name).to_pandas(), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _pickup_times(table: pa.Table) -> List[Optional[datetime]]:
+    """Pickup datetimes, the current time where missing and None where unparseable."""
+    now = datetime.now()
+    if PICKUP_COLUMN not in table.column_names:
+        return [now] * table.num_rows
+    values = table.column(PICKUP_COLUMN).to_pandas()
+    missing = values.isna().to_numpy()
+    try:
+        parsed = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    except (ValueError, TypeError):
+        # Mixed time zones; parse row by row
+        parsed = pd.Series([pd.to_datetime(value, errors='coerce') for value in values], dtype=object)
+    times = []
+    for value, is_missing in zip(parsed, missing):
+        if is_missing:
+            times.append(now)
+        elif value is pd.NaT or value is None:
+            times.append(None)
+        else:
+            times.append(value.to_pydatetime())
+    return times
+
+
+async def score_chunk(table: pa.Table, map_location_ids: Callable[[np.ndarray, np.ndarray], np.ndarray],
+                      get_quotes: Callable[[List[Dict[str, Any]]], Awaitable[List[Any]]]) -> pa.Table:
+    """
+    The input table with PULocationID, DOLocationID, the prediction fields, degraded
+    and error columns appended. Rows that fail validation or scoring keep null
+    predictions and say why in 'error'; they never fail the chunk.
+    """
+    n = table.num_rows
+    pickup_lat, pickup_lon = _float_column(table, 'pickup_latitude'), _float_column(table, 'pickup_longitude')
+    dropoff_lat, dropoff_lon = _float_column(table, 'dropoff_latitude'), _float_column(table, 'dropoff_longitude')
+    distance = _float_column(table, 'trip_distance')
+    pickup_times = _pickup_times(table)
+
+    # Same bounds as TripRequest and LocationCoordinates
+    errors = np.full(n, None, dtype=object)
+    checks = [
+        (~((pickup_lat >= -90) & (pickup_lat <= 90) & (pickup_lon >= -180) & (pickup_lon <= 180)),
+         "invalid pickup coordinates"),
+        (~((dropoff_lat >= -90) & (dropoff_lat <= 90) & (dropoff_lon >= -180) & (dropoff_lon <= 180)),
+         "invalid dropoff coordinates"),
+        (~((distance >= 0) & (distance < 100)), "trip_distance must be at least 0 and below 100"),
+        (np.array([pickup is None for pickup in pickup_times], dtype=bool), "invalid pickup_datetime")
+    ]
+    for failed, message in reversed(checks):  # the first failing check wins
+        errors[failed] = message
+    valid = np.flatnonzero(errors == None)  # noqa: E711 (element-wise comparison)
+
+    location_ids = np.zeros((2, n), dtype=np.int32)
+    predictions = np.full((len(PREDICTION_FIELDS), n), np.nan)
+    degraded = np.full(n, None, dtype=object)
+    if valid.size:
+        ids = map_location_ids(np.concatenate([pickup_lat[valid], dropoff_lat[valid]]),
+                               np.concatenate([pickup_lon[valid], dropoff_lon[valid]]))
+        location_ids[0, valid] = ids[:valid.size]
+        location_ids[1, valid] = ids[valid.size:]
+        model_requests = [
+            {
+                "PULocationID": int(location_ids[0, i]),
+                "DOLocationID": int(location_ids[1, i]),
+                "store_and_fwd_flag": "N",
+                "trip_distance": float(distance[i]),
+                "tpep_pickup_datetime": pickup_times[i]
+            }
+            for i in valid
+        ]
+        try:
+            quotes = await get_quotes(model_requests)
+        except Exception as e:
+            # The model service was unreachable for this chunk; later chunks may still go through
+            detail = getattr(e, 'detail', None) or str(e)
+            logger.error(f"Scoring a chunk of {valid.size} rows failed: {detail}")
+            quotes = [e] * valid.size
+        for i, quote in zip(valid, quotes):
+            if isinstance(quote, Exception):
+                errors[i] = getattr(quote, 'detail', None) or str(quote)
+                continue
+            for f, field in enumerate(PREDICTION_FIELDS):
+                predictions[f, i] = quote[field]
+            degraded[i] = bool(quote.get('degraded', False))
+
+    has_id = errors == None  # noqa: E711
+    columns = [
+        pa.array(location_ids[0], type=pa.int32(), mask=~has_id),
+        pa.array(location_ids[1], type=pa.int32(), mask=~has_id)
+    ]
+    columns += [pa.array(values, type=pa.float64(), from_pandas=True) for values in predictions]
+    columns.append(pa.array(degraded, type=pa.bool_()))
+    columns.append(pa.array(errors, type=pa.string()))
+    # Scored columns replace any input columns of the same name
+    table = table.select([name for name in table.column_names if name not in OUTPUT_SCHEMA.names])
+    for field, column in zip(OUTPUT_SCHEMA, columns):
+        table = table.append_column(field, column)
+    return table
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that collects what Arrow writes until it is taken."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+class ChunkWriter:
+    """
+    Encodes scored tables in the output format, one piece of the response per chunk.
+
+    The output schema is fixed before the first chunk is written. A chunk whose
+    columns do not match it is conformed rather than failing the response halfway:
+    missing columns are null, and a column that cannot be cast to its type is null
+    for that chunk, with the error of each row that had a value saying so.
+    """
+
+    def __init__(self, file_format: str, schema: pa.Schema):
+        self.file_format = file_format
+        self.schema = schema
+        self._sink = _ChunkSink()
+        self._writer = None
+        self._header = True
+
+    def write(self, table: pa.Table) -> bytes:
+        if self.file_format == 'ndjson':
+            # Keeps the zone IDs integers where some rows have none
+            frame = table.to_pandas(integer_object_nulls=True)
+            # Older pandas versions leave off the final newline
+            return frame.to_json(orient='records', lines=True, date_format='iso').rstrip('\n').encode() + b'\n'
+        if self.file_format == 'csv':
+            # Text has no types to conform; only the columns have to line up with the header
+            frame = table.to_pandas(integer_object_nulls=True).reindex(columns=self.schema.names)
+            header, self._header = self._header, False
+            return frame.to_csv(index=False, header=header).encode()
+
+        if self._writer is None:
+            self._writer = ipc.new_stream(self._sink, self.schema) if self.file_format == 'arrow' \
+                else pq.ParquetWriter(self._sink, self.schema)
+        self._writer.write_table(self._conform(table))
+        return self._sink.take()
+
+    def error(self, message: str) -> bytes:
+        """A last row, null but for its error, for output that stops short of the input."""
+        row = pa.Table.from_arrays(
+            [pa.array([message], type=field.type) if field.name == 'error' else pa.nulls(1, field.type)
+             for field in self.schema],
+            schema=self.schema)
+        return self.write(row)
+
+    def _conform(self, table: pa.Table) -> pa.Table:
+        errors = table.column('error').to_pylist()
+        columns = []
+        for field in self.schema:
+            if field.name not in table.column_names:
+                columns.append(pa.nulls(table.num_rows, field.type))
+                continue
+            column = table.column(field.name)
+            if column.type != field.type:
+                try:
+                    column = column.cast(field.type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                    for i, present in enumerate(column.is_valid().to_pylist()):
+                        if present and errors[i] is None:
+                            errors[i] = f"{field.name} could not be written as {field.type}"
+                    column = pa.nulls(table.num_rows, field.type)
+            columns.append(column)
+        columns[self.schema.get_field_index('error')] = pa.array(errors, type=pa.string())
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def close(self) -> bytes:
+        """Trailing bytes of the output (the Parquet footer, the end of the Arrow stream)."""
+        if self._writer is None:
+            return b''
+        self._writer.close()
+        return self._sink.take()
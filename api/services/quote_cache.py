@@ -0,0 +1,262 @@
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from fastapi import HTTPException
+from redis_conn import redis_conn
+from logger import Logger
+
+logger = Logger.get_logger('services.quote_cache')
+
+# Seconds a quote stays in the shared cache; 0 disables the cache (concurrent
+# identical requests are still coalesced).
+QUOTE_CACHE_TTL = int(os.getenv('QUOTE_CACHE_TTL', 300))
+# Opt-in: with the cache enabled, trip distances are rounded down to a multiple of
+# this many miles, and the model is asked for the rounded distance, so every request
+# in a bucket gets one quote. 0 (the default) prices the exact distance.
+QUOTE_CACHE_DISTANCE_RESOLUTION = float(os.getenv('QUOTE_CACHE_DISTANCE_RESOLUTION', 0))
+QUOTE_CACHE_PREFIX = 'quotes:'
+
+# Published by the model workers: a hash of the artifacts they have loaded. Read
+# at most every MODEL_VERSION_REFRESH seconds.
+MODEL_VERSION_KEY = 'model_version'
+MODEL_VERSION_REFRESH = float(os.getenv('MODEL_VERSION_REFRESH', 5))
+
+# Reply fields that describe one model call rather than the quote
+_PER_REQUEST_FIELDS = ('request_id',)
+
+
+class QuoteCache:
+    """
+    Quote cache in Redis, shared by every API replica, with single-flight misses.
+
+    Quotes are keyed on what the models see of an API request: the zone pair,
+    pickup hour and weekday, the distance (or its bucket), and the model version
+    the workers publish. A miss is sent to the model once per process: identical
+    requests arriving while it is in flight await the same call instead of
+    queueing their own.
+    """
+
+    def __init__(self, ttl: int = QUOTE_CACHE_TTL,
+                 distance_resolution: float = QUOTE_CACHE_DISTANCE_RESOLUTION):
+        self.ttl = ttl
+        self.distance_resolution = distance_resolution
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._model_version: Optional[str] = None
+        self._model_version_checked = 0.0
+        self._model_version_refresh: Optional[asyncio.Future] = None
+
+    @property
+    def redis_client(self):
+        return redis_conn.async_client
+
+    def normalize(self, model_request: Dict[str, Any]) -> Dict[str, Any]:
+        """Model request with the trip distance rounded down to its bucket, if bucketing is on."""
+        if self.distance_resolution <= 0 or self.ttl <= 0:
+            # Without a cache to share them, buckets would only make quotes less precise
+            return model_request
+        # The epsilon absorbs float error such as 0.29 / 0.01 = 28.999...
+        steps = math.floor(model_request['trip_distance'] / self.distance_resolution + 1e-9)
+        return dict(model_request, trip_distance=round(steps * self.distance_resolution, 9))
+
+    def key(self, model_request: Dict[str, Any], model_version: str) -> str:
+        """Cache key for a normalized model request under a model version."""
+        pickup = model_request['tpep_pickup_datetime']
+        return (f"{QUOTE_CACHE_PREFIX}{model_version}:{model_request['PULocationID']}:"
+                f"{model_request['DOLocationID']}:{model_request['store_and_fwd_flag']}:"
+                f"{pickup.hour}:{pickup.weekday()}:{model_request['trip_distance']}")
+
+    async def model_version(self) -> Optional[str]:
+        """Model version published by the workers, or None if none has been published yet."""
+        if self._model_version_refresh is None \
+                and time.monotonic() - self._model_version_checked >= MODEL_VERSION_REFRESH:
+            self._model_version_refresh = asyncio.ensure_future(self._refresh_model_version())
+        if self._model_version_refresh is not None:
+            # Every caller waits for the same read rather than using a stale or missing version
+            await asyncio.shield(self._model_version_refresh)
+        return self._model_version
+
+    async def _refresh_model_version(self):
+        try:
+            self._model_version = await self.redis_client.get(MODEL_VERSION_KEY)
+        except Exception as e:
+            logger.error(f"Could not read the model version: {str(e)}")
+        finally:
+            self._model_version_checked = time.monotonic()
+            self._model_version_refresh = None
+
+    async def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            # Pipelined with the other commands sent in the same loop iteration
+            cached = await redis_conn.batcher().submit(lambda pipe: pipe.get(key))
+        except Exception as e:
+            logger.error(f"Quote cache lookup failed: {str(e)}")
+            return None
+        return json.loads(cached) if cached else None
+
+    async def _lookup_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        try:
+            cached = await self.redis_client.mget(keys)
+        except Exception as e:
+            logger.error(f"Quote cache lookup failed: {str(e)}")
+            return [None] * len(keys)
+        return [json.loads(value) if value else None for value in cached]
+
+    def _quote(self, prediction: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: value for field, value in prediction.items() if field not in _PER_REQUEST_FIELDS}
+
+    async def _store_many(self, entries: Dict[str, Dict[str, Any]]):
+        """Cache several quotes in one round-trip, shared with other commands sent meanwhile."""
+        if self.ttl <= 0 or not entries:
+            return
+        try:
+            batcher = redis_conn.batcher()
+            await asyncio.gather(*(
+                batcher.submit(lambda pipe, key=key, value=json.dumps(quote): pipe.set(key, value, ex=self.ttl))
+                for key, quote in entries.items()
+            ))
+        except Exception as e:
+            logger.error(f"Quote cache store failed: {str(e)}")
+
+    async def _fetch_and_store(self, model_request: Dict[str, Any], model_version: str,
+                               fetch: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        quote = self._quote(await fetch(dict(model_request)))
+        # Rate card quotes, given while the model service is overloaded, are not cached
+        if not quote.get('degraded'):
+            # Store under the version that produced the quote, which may be newer than
+            # the one looked up while workers reload
+            await self._store_many({self.key(model_request, quote.get('model_version') or model_version): quote})
+        return quote
+
+    async def _fetch_many_and_resolve(self, pending: Dict[str, Dict[str, Any]], futures: Dict[str, asyncio.Future],
+                                      model_version: str,
+                                      fetch_many: Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]):
+        """Fetch the pending requests in one call and settle the future of each one's key."""
+        failure: Exception = HTTPException(status_code=500, detail="No prediction returned")
+        try:
+            predictions = await fetch_many([dict(request) for request in pending.values()])
+            entries = {}
+            for (key, request), prediction in zip(pending.items(), predictions):
+                if 'error' in prediction:
+                    futures[key].set_exception(HTTPException(status_code=500, detail=prediction['error']))
+                    continue
+                quote = self._quote(prediction)
+                if not quote.get('degraded'):
+                    entries[self.key(request, quote.get('model_version') or model_version)] = quote
+                futures[key].set_result(quote)
+            await self._store_many(entries)
+        except Exception as e:
+            failure = e
+            raise
+        finally:
+            # Never leave a waiter hanging, whatever happened to the call
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(failure)
+
+    async def get_quote(self, model_request: Dict[str, Any],
+                        fetch: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Quote for a model request from the shared cache, or from fetch(model_request)
+        on a miss, sharing one in-flight fetch between identical concurrent requests.
+        """
+        model_request = self.normalize(model_request)
+        model_version = await self.model_version() if self.ttl > 0 else 'uncached'
+        if model_version is None:
+            # No worker has published a version yet, so nothing can be cached safely
+            return await fetch(dict(model_request))
+        key = self.key(model_request, model_version)
+
+        inflight = self._inflight.get(key)
+        if inflight is None and self.ttl > 0:
+            quote = await self._lookup(key)
+            if quote is not None:
+                self.hits += 1
+                return quote
+            # Another request may have started the same fetch during the lookup
+            inflight = self._inflight.get(key)
+
+        if inflight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            inflight = asyncio.ensure_future(self._fetch_and_store(model_request, model_version, fetch))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda future: self._finish(key, future))
+        # A waiter that is cancelled (client gone) must not cancel the shared fetch
+        return await asyncio.shield(inflight)
+
+    async def get_quotes(self, model_requests: List[Dict[str, Any]],
+                         fetch_many: Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+                         ) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Quotes for several model requests, in order, with one cache lookup for all of
+        them and one fetch_many call for the misses.
+
+        Each entry is a quote or the exception for that request alone. Misses share
+        in-flight fetches with concurrent get_quote and get_quotes calls. A failure of
+        this call's own fetch_many (the model service being unreachable, say) is
+        raised instead.
+        """
+        model_requests = [self.normalize(request) for request in model_requests]
+        model_version = await self.model_version() if self.ttl > 0 else 'uncached'
+        if model_version is None:
+            predictions = await fetch_many([dict(request) for request in model_requests])
+            return [HTTPException(status_code=500, detail=prediction['error']) if 'error' in prediction
+                    else self._quote(prediction) for prediction in predictions]
+
+        keys = [self.key(request, model_version) for request in model_requests]
+        quotes: List[Any] = await self._lookup_many(keys) if self.ttl > 0 else [None] * len(keys)
+        waiting: Dict[str, asyncio.Future] = {}
+        pending: Dict[str, Dict[str, Any]] = {}
+        for key, request, quote in zip(keys, model_requests, quotes):
+            if quote is not None:
+                self.hits += 1
+            elif key in waiting:
+                self.coalesced += 1
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[key] = self._inflight[key]
+            else:
+                self.misses += 1
+                future = asyncio.get_running_loop().create_future()
+                future.add_done_callback(lambda done, key=key: self._finish(key, done))
+                self._inflight[key] = future
+                waiting[key] = future
+                pending[key] = request
+
+        if pending:
+            # A separate task settles the futures even if this request is cancelled
+            fetch = asyncio.ensure_future(self._fetch_many_and_resolve(
+                pending, {key: waiting[key] for key in pending}, model_version, fetch_many))
+            fetch.add_done_callback(lambda done: done.cancelled() or done.exception())
+            await asyncio.shield(fetch)
+
+        if waiting:
+            settled = await asyncio.gather(*(asyncio.shield(future) for future in waiting.values()),
+                                           return_exceptions=True)
+            outcomes = dict(zip(waiting, settled))
+            quotes = [quote if quote is not None else outcomes[key] for key, quote in zip(keys, quotes)]
+        return quotes
+
+    def _finish(self, key: str, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Mark a failure as retrieved even if every waiter has gone away
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._inflight),
+            'hit_rate': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0
+        }
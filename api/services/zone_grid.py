@@ -0,0 +1,138 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import shapely
+from shapely import STRtree
+from logger import Logger
+
+logger = Logger.get_logger('services.zone_grid')
+
+GRID_FORMAT_VERSION = 1
+
+# Cell values: a LocationID for cells entirely inside one zone, BOUNDARY_CELL for
+# cells that straddle a zone boundary and need the exact polygon test.
+BOUNDARY_CELL = 0
+
+
+class ZoneGrid:
+    """
+    Raster of LocationIDs over the NYC bounding box.
+
+    Each cell stores the LocationID of the zone that fully contains it, the
+    unknown LocationID for cells that touch no zone at all, or BOUNDARY_CELL
+    when the exact polygon test is still needed.
+    """
+
+    def __init__(self, cells: np.ndarray, minx: float, miny: float, resolution: float):
+        self.cells = cells
+        self.minx = minx
+        self.miny = miny
+        self.resolution = resolution
+        self.n_rows, self.n_cols = cells.shape
+
+    @staticmethod
+    def geometry_hash(geometries: np.ndarray, zone_ids: np.ndarray) -> str:
+        """Fingerprint of the zone geometry a grid was built from."""
+        digest = hashlib.sha1()
+        digest.update(np.asarray(zone_ids, dtype=np.int64).tobytes())
+        for wkb in shapely.to_wkb(geometries):
+            digest.update(wkb)
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, geometries: np.ndarray, zone_ids: np.ndarray, bounds: np.ndarray,
+              resolution: float, unknown_id: int) -> 'ZoneGrid':
+        """Rasterize zone geometries at the given resolution (in degrees)."""
+        minx, miny, maxx, maxy = bounds
+        n_cols = int(np.ceil((maxx - minx) / resolution))
+        n_rows = int(np.ceil((maxy - miny) / resolution))
+        cells = np.full((n_rows, n_cols), BOUNDARY_CELL, dtype=np.uint16)
+        tree = STRtree(geometries)
+        xs = minx + np.arange(n_cols) * resolution
+        # Grow boxes slightly so 'within' also excludes cells whose edge lies on a zone boundary
+        eps = resolution * 1e-6
+
+        for row in range(n_rows):
+            y = miny + row * resolution
+            boxes = shapely.box(xs - eps, y - eps, xs + resolution + eps, y + resolution + eps)
+
+            # Cells that touch no zone resolve to the unknown zone
+            touching, _ = tree.query(boxes, predicate='intersects')
+            outside = np.ones(n_cols, dtype=bool)
+            outside[touching] = False
+            cells[row, outside] = unknown_id
+
+            # Cells entirely inside a zone; lowest zone index wins as in the exact lookup
+            cell_idx, zone_idx = tree.query(boxes, predicate='within')
+            if cell_idx.size:
+                first_zone = np.full(n_cols, np.iinfo(np.int64).max, dtype=np.int64)
+                np.minimum.at(first_zone, cell_idx, zone_idx)
+                inside = first_zone != np.iinfo(np.int64).max
+                cells[row, inside] = zone_ids[first_zone[inside]]
+
+        logger.info(f"Built {n_rows}x{n_cols} zone grid at resolution {resolution}, "
+                    f"{(cells == BOUNDARY_CELL).mean():.1%} boundary cells")
+        return cls(cells, minx, miny, resolution)
+
+    def save(self, path: Path, source_hash: str):
+        """Save the grid as a .npy file plus a JSON metadata sidecar."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, self.cells)
+        meta = {
+            'version': GRID_FORMAT_VERSION,
+            'minx': self.minx,
+            'miny': self.miny,
+            'resolution': self.resolution,
+            'source_hash': source_hash
+        }
+        path.with_suffix('.json').write_text(json.dumps(meta))
+        logger.info(f"Saved zone grid to {path}")
+
+    @classmethod
+    def load(cls, path: Path, resolution: float, source_hash: str) -> Optional['ZoneGrid']:
+        """Memory-map a saved grid, or return None if it is missing or stale."""
+        meta_path = path.with_suffix('.json')
+        if not path.exists() or not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        if (meta.get('version') != GRID_FORMAT_VERSION
+                or meta.get('resolution') != resolution
+                or meta.get('source_hash') != source_hash):
+            logger.info(f"Zone grid at {path} is stale, rebuilding")
+            return None
+        cells = np.load(path, mmap_mode='r')
+        return cls(cells, meta['minx'], meta['miny'], meta['resolution'])
+
+    @classmethod
+    def load_or_build(cls, path: Path, resolution: float, geometries: np.ndarray,
+                      zone_ids: np.ndarray, bounds: np.ndarray, unknown_id: int) -> 'ZoneGrid':
+        """Load the grid from disk, building and saving it first if needed."""
+        source_hash = cls.geometry_hash(geometries, zone_ids)
+        grid = cls.load(path, resolution, source_hash)
+        if grid is None:
+            cls.build(geometries, zone_ids, bounds, resolution, unknown_id).save(path, source_hash)
+            grid = cls.load(path, resolution, source_hash)
+        logger.info(f"Loaded {grid.n_rows}x{grid.n_cols} zone grid from {path}")
+        return grid
+
+    def lookup(self, lat: float, lon: float) -> Optional[int]:
+        """Cell value for a coordinate, or None if it falls outside the grid."""
+        if not (lon >= self.minx and lat >= self.miny):  # also rejects NaN
+            return None
+        col = int((lon - self.minx) / self.resolution)
+        row = int((lat - self.miny) / self.resolution)
+        if row >= self.n_rows or col >= self.n_cols:
+            return None
+        return int(self.cells[row, col])
+
+    def lookup_bulk(self, lats: np.ndarray, lons: np.ndarray, outside_id: int) -> np.ndarray:
+        """Cell values for many coordinates; points outside the grid get outside_id."""
+        cols = np.floor((lons - self.minx) / self.resolution)
+        rows = np.floor((lats - self.miny) / self.resolution)
+        # NaN coordinates fail these comparisons and land outside the grid
+        valid = (rows >= 0) & (rows < self.n_rows) & (cols >= 0) & (cols < self.n_cols)
+        values = np.full(lats.shape, outside_id, dtype=np.int32)
+        values[valid] = self.cells[rows[valid].astype(np.intp), cols[valid].astype(np.intp)]
+        return values
@@ -1,12 +1,26 @@
 from typing import Tuple, Optional, Dict, Any
 import geopandas as gpd
+import numpy as np
+import shapely
+from shapely import STRtree
 from shapely.geometry import Point
 import pandas as pd
+import os
 from pathlib import Path
 from logger import Logger
+from services.zone_grid import ZoneGrid, BOUNDARY_CELL
+from services.zone_registry import ZoneRegistry
 
 logger = Logger.get_logger('services.zone_mapper')
 
+# LocationID used for coordinates that fall outside every taxi zone
+UNKNOWN_LOCATION_ID = 265
+
+# Optional raster mode: grid cell size in degrees (e.g. 0.0005, roughly 50 m).
+# Unset or 0 disables the grid and every lookup uses the polygon index.
+ZONE_GRID_RESOLUTION = float(os.getenv('ZONE_GRID_RESOLUTION', 0) or 0)
+ZONE_GRID_DIR = Path(os.getenv('ZONE_GRID_DIR', Path(__file__).parent.parent / 'data'))
+
 class ZoneMapper:
     _instance = None
     
@@ -21,21 +35,73 @@ class ZoneMapper:
             self._load_data()
 
     def _load_data(self):
-        """Load GeoJSON and taxi zone data."""
+        """Load zone geometry, preferring the compiled zone registry over GeoJSON."""
         try:
-            # Load GeoJSON data
-            geojson_path = Path(__file__).parent.parent / 'data' / 'nycneighborhoods_converted.geo.json'
-            self.zones_gdf = gpd.read_file(str(geojson_path))
-            
-            # Load taxi zones mapping
-            zones_path = Path(__file__).parent.parent / 'data' / 'taxi_zones.csv'
-            self.taxi_zones = pd.read_csv(str(zones_path))
+            self._registry = ZoneRegistry.open()
+            self._taxi_zones = None
+            if self._registry is not None:
+                self.zones_gdf = self._registry.zones_gdf()
+                logger.info(f"Loaded zones from registry {self._registry.path}")
+            else:
+                # Load GeoJSON data
+                geojson_path = Path(__file__).parent.parent / 'data' / 'nycneighborhoods_converted.geo.json'
+                self.zones_gdf = gpd.read_file(str(geojson_path))
+
+            self._build_index()
+            self._load_grid()
             
             logger.info("Successfully loaded zone mapping data")
         except Exception as e:
             logger.error(f"Failed to load zone mapping data: {str(e)}")
             raise
 
+    @property
+    def taxi_zones(self) -> pd.DataFrame:
+        """Taxi zone attributes, loaded on first access."""
+        if self._taxi_zones is None:
+            if self._registry is not None:
+                self._taxi_zones = self._registry.taxi_zones()
+            else:
+                zones_path = Path(__file__).parent.parent / 'data' / 'taxi_zones.csv'
+                self._taxi_zones = pd.read_csv(str(zones_path))
+        return self._taxi_zones
+
+    def _build_index(self):
+        """Build an STRtree over prepared zone geometries plus a NYC bounding box prefilter."""
+        self._geometries = np.asarray(self.zones_gdf.geometry.values)
+        shapely.prepare(self._geometries)
+        self._tree = STRtree(self._geometries)
+        self._bounds = self.zones_gdf.total_bounds  # (minx, miny, maxx, maxy)
+        self._zone_ids = self.zones_gdf['zone_id'].astype(np.int32).to_numpy()
+        self._zone_records = [
+            {
+                'location_id': int(zone['zone_id']),
+                'borough': zone['borough'],
+                'zone': zone['zone_name'],
+                'service_zone': zone['service_zone']
+            }
+            for _, zone in self.zones_gdf.iterrows()
+        ]
+        # First record per LocationID, matching the lowest-index rule of the lookups
+        self._records_by_id = {}
+        for record in self._zone_records:
+            self._records_by_id.setdefault(record['location_id'], record)
+
+    def _load_grid(self):
+        """Memory-map the precomputed zone grid, building it on first use."""
+        self._grid = None
+        if ZONE_GRID_RESOLUTION > 0:
+            grid_path = ZONE_GRID_DIR / f"zone_grid_{ZONE_GRID_RESOLUTION:g}.npy"
+            self._grid = ZoneGrid.load_or_build(
+                grid_path, ZONE_GRID_RESOLUTION, self._geometries,
+                self._zone_ids, self._bounds, UNKNOWN_LOCATION_ID
+            )
+
+    def _in_bounds(self, lat: float, lon: float) -> bool:
+        """Cheap bounding box check that rejects points outside NYC."""
+        minx, miny, maxx, maxy = self._bounds
+        return minx <= lon <= maxx and miny <= lat <= maxy
+
     def get_zone_from_coordinates(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
         """
         Get taxi zone information for given coordinates.
@@ -48,32 +114,34 @@ class ZoneMapper:
             Dictionary containing zone information or None if not found
         """
         try:
-            # Create point from coordinates
-            point = Point(lon, lat)
-            
-            # Find the zone containing the point
-            for _, zone in self.zones_gdf.iterrows():
-                if point.within(zone['geometry']):
-                    # Get corresponding taxi zone info
-                    zone_name = zone['zone_name']
-                    borough = zone['borough']
-                    location_id = zone['zone_id']
-                    service_zone = zone['service_zone']
-                    logger.info(f"Zone: {zone}")                  
-                    return {
-                        'location_id': int(location_id),
-                        'borough': borough,
-                        'zone': zone_name,
-                        'service_zone': service_zone
-                    }
+            if not self._in_bounds(lat, lon):
+                logger.warning(f"Coordinates outside NYC bounds: {lat}, {lon}")
+                return None
+
+            if self._grid is not None:
+                # Interior cells resolve with a single array index
+                cell = self._grid.lookup(lat, lon)
+                if cell == UNKNOWN_LOCATION_ID:
+                    logger.warning(f"No zone found for coordinates: {lat}, {lon}")
+                    return None
+                if cell is not None and cell != BOUNDARY_CELL:
+                    return dict(self._records_by_id[cell])
+
+            # Find the zone containing the point via the spatial index
+            matches = self._tree.query(Point(lon, lat), predicate='within')
+            if len(matches):
+                # Lowest index keeps the first-match order of the zone file
+                zone = dict(self._zone_records[int(matches.min())])
+                logger.debug(f"Zone: {zone}")
+                return zone
             
             logger.warning(f"No zone found for coordinates: {lat}, {lon}")
             return None
 
         except Exception as e:
-            logger.error(f"Error getting taxi_zone for coordinates {lat}, {lon}: {str(e)}, using default unknown zone 265")
+            logger.error(f"Error getting taxi_zone for coordinates {lat}, {lon}: {str(e)}, using default unknown zone {UNKNOWN_LOCATION_ID}")
             return {
-                    'location_id': 265,
+                    'location_id': UNKNOWN_LOCATION_ID,
                     'borough': 'Unknown',
                     'zone': 'N/A',
                     'service_zone': 'N/A'
@@ -94,7 +162,61 @@ class ZoneMapper:
         pickup_zone = self.get_zone_from_coordinates(pickup_coords[0], pickup_coords[1])
         dropoff_zone = self.get_zone_from_coordinates(dropoff_coords[0], dropoff_coords[1])
 
-        pickup_id = pickup_zone['location_id'] if pickup_zone else 265
-        dropoff_id = dropoff_zone['location_id'] if dropoff_zone else 265
+        pickup_id = pickup_zone['location_id'] if pickup_zone else UNKNOWN_LOCATION_ID
+        dropoff_id = dropoff_zone['location_id'] if dropoff_zone else UNKNOWN_LOCATION_ID
+
+        return pickup_id, dropoff_id
+
+    def get_location_ids_bulk(self, lats: np.ndarray, lons: np.ndarray,
+                              chunk_size: int = 1_000_000) -> np.ndarray:
+        """
+        Resolve many coordinates to location IDs in one vectorized pass.
+        
+        Args:
+            lats: Array of latitudes
+            lons: Array of longitudes, same shape as lats
+            chunk_size: Maximum number of points joined at once, to bound memory
+            
+        Returns:
+            int32 array of location IDs, UNKNOWN_LOCATION_ID (265) where no zone matches
+        """
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        if lats.shape != lons.shape:
+            raise ValueError(f"lats and lons must have the same length, got {lats.size} and {lons.size}")
+
+        if self._grid is None:
+            return self._join_bulk(lats, lons, chunk_size)
+
+        # Grid first; only boundary cells go through the exact spatial join
+        location_ids = self._grid.lookup_bulk(lats, lons, UNKNOWN_LOCATION_ID)
+        boundary = np.flatnonzero(location_ids == BOUNDARY_CELL)
+        if boundary.size:
+            location_ids[boundary] = self._join_bulk(lats[boundary], lons[boundary], chunk_size)
+        return location_ids
+
+    def _join_bulk(self, lats: np.ndarray, lons: np.ndarray, chunk_size: int) -> np.ndarray:
+        """Exact vectorized spatial join of points against the zone polygons."""
+        location_ids = np.full(lats.size, UNKNOWN_LOCATION_ID, dtype=np.int32)
+        minx, miny, maxx, maxy = self._bounds
+        for start in range(0, lats.size, chunk_size):
+            chunk_lats = lats[start:start + chunk_size]
+            chunk_lons = lons[start:start + chunk_size]
+            # Bounding box prefilter; NaN coordinates fail it too
+            candidates = np.flatnonzero(
+                (chunk_lons >= minx) & (chunk_lons <= maxx) &
+                (chunk_lats >= miny) & (chunk_lats <= maxy)
+            )
+            if candidates.size == 0:
+                continue
+
+            points = shapely.points(chunk_lons[candidates], chunk_lats[candidates])
+            point_idx, zone_idx = self._tree.query(points, predicate='within')
+
+            # Keep the lowest zone index per point, like the single-point lookup
+            first_zone = np.full(candidates.size, np.iinfo(np.int64).max, dtype=np.int64)
+            np.minimum.at(first_zone, point_idx, zone_idx)
+            matched = first_zone != np.iinfo(np.int64).max
+            location_ids[start + candidates[matched]] = self._zone_ids[first_zone[matched]]
 
-        return pickup_id, dropoff_id
\ No newline at end of file
+        return location_ids
@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+from typing import Optional
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from logger import Logger
+
+logger = Logger.get_logger('services.zone_registry')
+
+# Must match ZONE_REGISTRY_VERSION in data/build_zone_registry.py, which
+# documents the array layout of the artifact. _with_missing and _zone_table are
+# copies of the build's own; it refuses to build while a copy differs.
+ZONE_REGISTRY_VERSION = 1
+# Where data/build_zone_registry.py writes it: the repository's data directory,
+# mounted at /data next to /app in docker-compose.yml
+ZONE_REGISTRY_PATH = Path(os.getenv('ZONE_REGISTRY_PATH',
+                                    Path(__file__).resolve().parent.parent.parent / 'data' / 'zone_registry.npz'))
+
+
+def _with_missing(values: np.ndarray) -> np.ndarray:
+    """Object array with the registry's '' placeholders turned back into NaN."""
+    result = values.astype(object)
+    result[values == ''] = np.nan
+    return result
+
+
+def _zone_table(registry) -> pd.DataFrame:
+    """Zone attributes shaped like taxi_zones.csv, with missing values as NaN."""
+    return pd.DataFrame({
+        'LocationID': registry['location_id'].astype(np.int64),
+        'Borough': _with_missing(registry['borough']),
+        'Zone': _with_missing(registry['zone']),
+        'service_zone': _with_missing(registry['service_zone']),
+    })
+
+
+class ZoneRegistry:
+    """Read access to the compiled zone registry built by data/build_zone_registry.py."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @classmethod
+    def open(cls, path: Path = ZONE_REGISTRY_PATH) -> Optional['ZoneRegistry']:
+        """Return the registry at path, or None if it is missing or has another format version."""
+        if not path.exists():
+            logger.warning(f"No zone registry at {path}, loading the GeoJSON and taxi_zones.csv")
+            return None
+        with np.load(path) as registry:
+            version = int(registry['format_version'])
+        if version != ZONE_REGISTRY_VERSION:
+            logger.warning(f"Ignoring zone registry {path} with unsupported version {version}")
+            return None
+        return cls(path)
+
+    def zones_gdf(self) -> gpd.GeoDataFrame:
+        """Zone polygons with the same columns as nycneighborhoods_converted.geo.json."""
+        with np.load(self.path) as registry:
+            offsets = registry['wkb_offsets']
+            data = registry['wkb_data'].tobytes()
+            wkbs = np.array([data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)], dtype=object)
+            return gpd.GeoDataFrame(
+                {
+                    'zone_id': registry['geom_zone_id'].astype(str),
+                    'zone_name': _with_missing(registry['geom_zone_name']),
+                    'borough': _with_missing(registry['geom_borough']),
+                    'service_zone': _with_missing(registry['geom_service_zone']),
+                },
+                geometry=shapely.from_wkb(wkbs),
+                crs='EPSG:4326'
+            )
+
+    def taxi_zones(self) -> pd.DataFrame:
+        """Zone attributes shaped like taxi_zones.csv, with missing values as NaN."""
+        with np.load(self.path) as registry:
+            return _zone_table(registry)
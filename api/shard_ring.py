@@ -0,0 +1,38 @@
+import bisect
+import hashlib
+from typing import List, Sequence
+
+# Points each shard gets on the ring. More points spread keys more evenly between
+# shards, at the cost of a larger table to search.
+RING_REPLICAS = 160
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ShardRing:
+    """
+    Consistent hash ring mapping keys to shards.
+
+    Every shard is hashed onto the ring at RING_REPLICAS points derived from its
+    name, and a key belongs to the shard owning the first point at or after the
+    key's own hash. Points depend only on shard names, so adding a shard to n
+    others moves about 1/(n+1) of the keys, all of them to the new shard.
+    """
+
+    def __init__(self, shards: Sequence[str], replicas: int = RING_REPLICAS):
+        if not shards:
+            raise ValueError("A shard ring needs at least one shard")
+        self.shards: List[str] = list(shards)
+        points = sorted((_hash(f"{shard}#{i}"), index) for index, shard in enumerate(self.shards)
+                        for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+
+    def shard(self, key: str) -> int:
+        """Index (into shards) of the shard a key belongs to."""
+        if len(self.shards) == 1:
+            return 0
+        position = bisect.bisect_left(self._points, _hash(key))
+        return self._owners[position % len(self._points)]
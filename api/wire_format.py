@@ -0,0 +1,273 @@
+"""
+Wire format of the request and reply messages exchanged through Redis.
+
+Kept identical in api/wire_format.py and model/wire_format.py.
+
+The first byte of a message is its format version:
+
+  '{'   version 0, JSON (what every component has always sent)
+  0x01  version 1, the binary envelope below
+
+Readers accept both, and a model worker replies in the version the request
+came in, so APIs sending either format can share workers during a rollout.
+Only switch the API to binary once every worker understands it.
+
+Version 1 is little-endian: the version byte, a kind byte, length-prefixed
+UTF-8 strings, then a fixed-layout record per trip or prediction:
+
+  request  (kind 1 trip, 2 batch)   request_id, reply_to, reply_ttl u32,
+                                    deadline f64 (NaN when none), count u32,
+                                    count x TRIP_DTYPE
+  reply    (kind 3 trip, 4 batch)   request_id, model_version, count u32,
+                                    count x PREDICTION_DTYPE, then one u32-
+                                    prefixed error message per failed record
+
+Payloads the layout cannot represent exactly (extra or missing fields,
+timezone-aware pickups, values out of range) are sent as JSON instead.
+"""
+import json
+import math
+import struct
+from datetime import datetime
+from typing import Any, Dict, List, Tuple, Union
+import numpy as np
+
+WIRE_JSON = 0
+WIRE_BINARY = 1
+
+KIND_TRIP = 1
+KIND_BATCH = 2
+KIND_TRIP_REPLY = 3
+KIND_BATCH_REPLY = 4
+
+TRIP_FIELDS = ('PULocationID', 'DOLocationID', 'store_and_fwd_flag', 'trip_distance', 'tpep_pickup_datetime')
+REQUEST_FIELDS = ('request_id', 'reply_to', 'reply_ttl', 'deadline')
+PREDICTION_FIELDS = ('trip_duration', 'fare_amount', 'tolls_amount', 'congestion_surcharge', 'total_amount')
+
+# Pickup times are naive datetimes, sent as microseconds since 1970-01-01
+TRIP_DTYPE = np.dtype([('PULocationID', '<u2'), ('DOLocationID', '<u2'), ('store_and_fwd_flag', 'S1'),
+                       ('trip_distance', '<f8'), ('tpep_pickup_datetime', '<i8')])
+PREDICTION_DTYPE = np.dtype([('ok', 'u1')] + [(field, '<f8') for field in PREDICTION_FIELDS])
+
+_HEADER = struct.Struct('<BB')
+_LENGTH = struct.Struct('<H')
+_COUNT = struct.Struct('<I')
+_REQUEST_META = struct.Struct('<Id')
+_MAX_STRING = 0xFFFF
+_MAX_ZONE = 0xFFFF
+
+Message = Union[str, bytes]
+
+
+class _Unencodable(Exception):
+    """The payload does not fit the binary layout; send it as JSON."""
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _pack_string(value: Any) -> bytes:
+    if not isinstance(value, str):
+        raise _Unencodable()
+    encoded = value.encode()
+    if len(encoded) > _MAX_STRING:
+        raise _Unencodable()
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_string(buffer: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = _LENGTH.unpack_from(buffer, offset)
+    offset += _LENGTH.size
+    return buffer[offset:offset + length].decode(), offset + length
+
+
+def _as_bytes(raw: Message) -> bytes:
+    # Redis clients that decode responses hand binary messages over as str, decoded
+    # with errors='surrogateescape', which this reverses exactly
+    return raw.encode('utf-8', 'surrogateescape') if isinstance(raw, str) else raw
+
+
+def version_of(raw: Message) -> int:
+    """Wire format version of a message, from its first byte."""
+    first = raw[:1]
+    if first in ('{', b'{'):
+        return WIRE_JSON
+    if first in ('\x01', b'\x01'):
+        return WIRE_BINARY
+    raise ValueError(f"Unsupported wire format version {ord(first) if first else None}")
+
+
+def _trip_records(trips: List[Dict[str, Any]]) -> bytes:
+    rows, pickups = [], []
+    for trip in trips:
+        if not isinstance(trip, dict) or len(trip) != len(TRIP_FIELDS):
+            raise _Unencodable()
+        try:
+            pu, do, flag = trip['PULocationID'], trip['DOLocationID'], trip['store_and_fwd_flag']
+            distance, pickup = trip['trip_distance'], trip['tpep_pickup_datetime']
+        except KeyError:
+            raise _Unencodable()
+        if type(pu) is not int or type(do) is not int or not 0 <= pu <= _MAX_ZONE or not 0 <= do <= _MAX_ZONE \
+                or not isinstance(flag, str) or len(flag) != 1 or not flag.isascii() \
+                or type(distance) not in (int, float) \
+                or not isinstance(pickup, datetime) or pickup.tzinfo is not None:
+            raise _Unencodable()
+        rows.append((pu, do, flag, distance, 0))
+        pickups.append(pickup)
+    records = np.array(rows, dtype=TRIP_DTYPE)
+    if pickups:
+        records['tpep_pickup_datetime'] = np.array(pickups, dtype='datetime64[us]').astype('<i8')
+    return _COUNT.pack(len(records)) + records.tobytes()
+
+
+def _decode_trips(buffer: bytes, offset: int) -> List[Dict[str, Any]]:
+    (count,) = _COUNT.unpack_from(buffer, offset)
+    records = np.frombuffer(buffer, TRIP_DTYPE, count=count, offset=offset + _COUNT.size)
+    columns = (
+        records['PULocationID'].tolist(),
+        records['DOLocationID'].tolist(),
+        records['store_and_fwd_flag'].astype('U1').tolist(),
+        records['trip_distance'].tolist(),
+        records['tpep_pickup_datetime'].astype('datetime64[us]').tolist()
+    )
+    return [dict(zip(TRIP_FIELDS, values)) for values in zip(*columns)]
+
+
+def _encode_binary_request(data: Dict[str, Any]) -> bytes:
+    if 'trips' in data:
+        kind = KIND_BATCH
+        if set(data) != {'trips', *REQUEST_FIELDS} or not isinstance(data['trips'], list):
+            raise _Unencodable()
+        trips = data['trips']
+    else:
+        kind = KIND_TRIP
+        if set(data) != {*TRIP_FIELDS, *REQUEST_FIELDS}:
+            raise _Unencodable()
+        trips = [{field: data[field] for field in TRIP_FIELDS}]
+    reply_ttl, deadline = data['reply_ttl'], data['deadline']
+    if type(reply_ttl) is not int or not 0 <= reply_ttl < 2 ** 32 \
+            or (deadline is not None and type(deadline) not in (int, float)):
+        raise _Unencodable()
+    return b''.join((
+        _HEADER.pack(WIRE_BINARY, kind),
+        _pack_string(data['request_id']),
+        _pack_string(data['reply_to']),
+        _REQUEST_META.pack(reply_ttl, math.nan if deadline is None else deadline),
+        _trip_records(trips)
+    ))
+
+
+def encode_request(data: Dict[str, Any], version: int = WIRE_JSON) -> Message:
+    """Serialize a request (one trip, or a batch under 'trips') in the given format version."""
+    if version == WIRE_BINARY:
+        try:
+            return _encode_binary_request(data)
+        except _Unencodable:
+            pass
+    return json.dumps(data, default=_json_default)
+
+
+def decode_request(raw: Message) -> Tuple[Dict[str, Any], int]:
+    """
+    Request data and the format version it came in. Pickup times are datetimes in
+    binary requests; JSON requests carry them as ISO strings, as they always have.
+    """
+    version = version_of(raw)
+    if version == WIRE_JSON:
+        return json.loads(raw), version
+    buffer = _as_bytes(raw)
+    _, kind = _HEADER.unpack_from(buffer, 0)
+    request_id, offset = _unpack_string(buffer, _HEADER.size)
+    reply_to, offset = _unpack_string(buffer, offset)
+    reply_ttl, deadline = _REQUEST_META.unpack_from(buffer, offset)
+    trips = _decode_trips(buffer, offset + _REQUEST_META.size)
+    data = {'request_id': request_id, 'reply_to': reply_to, 'reply_ttl': reply_ttl}
+    if not math.isnan(deadline):
+        data['deadline'] = deadline
+    if kind == KIND_BATCH:
+        data['trips'] = trips
+    elif kind == KIND_TRIP and len(trips) == 1:
+        data.update(trips[0])
+    else:
+        raise ValueError(f"Unexpected message kind {kind} in a request")
+    return data, version
+
+
+def _encode_binary_reply(reply: Dict[str, Any]) -> bytes:
+    if 'predictions' in reply:
+        kind = KIND_BATCH_REPLY
+        if set(reply) != {'request_id', 'predictions'} or not isinstance(reply['predictions'], list):
+            raise _Unencodable()
+        predictions = reply['predictions']
+    else:
+        kind = KIND_TRIP_REPLY
+        predictions = [{field: value for field, value in reply.items() if field != 'request_id'}]
+    rows, errors = [], []
+    model_versions = set()
+    for prediction in predictions:
+        if set(prediction) == {'error'} and isinstance(prediction['error'], str):
+            encoded = prediction['error'].encode()
+            errors.append(_COUNT.pack(len(encoded)) + encoded)
+            rows.append((0,) + (0.0,) * len(PREDICTION_FIELDS))
+            continue
+        if set(prediction) != {'model_version', *PREDICTION_FIELDS}:
+            raise _Unencodable()
+        model_versions.add(prediction['model_version'])
+        values = [prediction[field] for field in PREDICTION_FIELDS]
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            raise _Unencodable()
+        rows.append((1, *values))
+    records = np.array(rows, dtype=PREDICTION_DTYPE)
+    # Every prediction in a reply comes from the same model
+    if len(model_versions) > 1:
+        raise _Unencodable()
+    return b''.join((
+        _HEADER.pack(WIRE_BINARY, kind),
+        _pack_string(reply['request_id'] or ''),
+        _pack_string(model_versions.pop() if model_versions else ''),
+        _COUNT.pack(len(records)),
+        records.tobytes(),
+        *errors
+    ))
+
+
+def encode_reply(reply: Dict[str, Any], version: int = WIRE_JSON) -> Message:
+    """Serialize a reply (one prediction, or a batch under 'predictions') in the given format version."""
+    if version == WIRE_BINARY and reply.get('request_id') is not None:
+        try:
+            return _encode_binary_reply(reply)
+        except _Unencodable:
+            pass
+    return json.dumps(reply)
+
+
+def decode_reply(raw: Message) -> Dict[str, Any]:
+    """Reply data, shaped as the JSON reply would be, whichever format version it came in."""
+    if version_of(raw) == WIRE_JSON:
+        return json.loads(raw)
+    buffer = _as_bytes(raw)
+    _, kind = _HEADER.unpack_from(buffer, 0)
+    request_id, offset = _unpack_string(buffer, _HEADER.size)
+    model_version, offset = _unpack_string(buffer, offset)
+    (count,) = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    records = np.frombuffer(buffer, PREDICTION_DTYPE, count=count, offset=offset)
+    offset += records.nbytes
+    columns = [records[field].tolist() for field in PREDICTION_FIELDS]
+    predictions = []
+    for ok, values in zip(records['ok'].tolist(), zip(*columns)):
+        if ok:
+            predictions.append({'model_version': model_version, **dict(zip(PREDICTION_FIELDS, values))})
+            continue
+        (length,) = _COUNT.unpack_from(buffer, offset)
+        offset += _COUNT.size
+        predictions.append({'error': buffer[offset:offset + length].decode()})
+        offset += length
+    if kind == KIND_BATCH_REPLY:
+        return {'request_id': request_id, 'predictions': predictions}
+    if kind == KIND_TRIP_REPLY and len(predictions) == 1:
+        return {'request_id': request_id, **predictions[0]}
+    raise ValueError(f"Unexpected message kind {kind} in a reply")
@@ -0,0 +1,158 @@
+import argparse
+import ast
+import os
+from pathlib import Path
+from typing import Dict
+import numpy as np
+import pandas as pd
+
+# Bump whenever the array layout below changes; loaders refuse other versions.
+#
+# Layout of zone_registry.npz:
+#   format_version   int64 scalar
+#   location_id      int32[n_zones]        taxi_zones.csv LocationID
+#   borough          str[n_zones]          '' where missing
+#   zone             str[n_zones]          '' where missing
+#   service_zone     str[n_zones]          '' where missing
+#   geom_zone_id     int32[n_geoms]        zone_id of each GeoJSON feature
+#   geom_zone_name   str[n_geoms]
+#   geom_borough     str[n_geoms]
+#   geom_service_zone str[n_geoms]
+#   geom_bounds      float64[n_geoms, 4]   (minx, miny, maxx, maxy)
+#   wkb_offsets      int64[n_geoms + 1]    slice of wkb_data per feature
+#   wkb_data         uint8[...]            concatenated WKB geometries
+ZONE_REGISTRY_VERSION = 1
+# Where the build writes the registry by default and where the API, the model worker
+# and process_data.py look for it (docker-compose.yml mounts this directory at /data)
+ZONE_REGISTRY_PATH = Path(os.getenv('ZONE_REGISTRY_PATH', Path(__file__).resolve().parent / 'zone_registry.npz'))
+
+# The services' own loaders, which cannot import this module from their images and
+# declare the version they read and carry copies of the decoders below. A build
+# refuses to run while a loader reads another version or decodes differently, so a
+# format change has to reach all three.
+REGISTRY_LOADERS = [
+    Path(__file__).resolve().parent.parent / 'model' / 'zone_registry.py',
+    Path(__file__).resolve().parent.parent / 'api' / 'services' / 'zone_registry.py',
+]
+
+
+def _with_missing(values: np.ndarray) -> np.ndarray:
+    """Object array with the registry's '' placeholders turned back into NaN."""
+    result = values.astype(object)
+    result[values == ''] = np.nan
+    return result
+
+
+def _zone_table(registry) -> pd.DataFrame:
+    """Zone attributes shaped like taxi_zones.csv, with missing values as NaN."""
+    return pd.DataFrame({
+        'LocationID': registry['location_id'].astype(np.int64),
+        'Borough': _with_missing(registry['borough']),
+        'Zone': _with_missing(registry['zone']),
+        'service_zone': _with_missing(registry['service_zone']),
+    })
+
+
+# Decoders every loader carries a copy of
+SHARED_DECODERS = ('_with_missing', '_zone_table')
+
+
+def loader_version(loader_path: Path) -> int:
+    """ZONE_REGISTRY_VERSION a loader module declares, read from its source."""
+    for node in ast.parse(loader_path.read_text()).body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'ZONE_REGISTRY_VERSION'
+                                                for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"{loader_path} does not declare ZONE_REGISTRY_VERSION")
+
+
+def _functions(path: Path) -> Dict[str, str]:
+    """Dump of every top-level function in a module, comparable across files."""
+    return {node.name: ast.dump(node) for node in ast.parse(path.read_text()).body
+            if isinstance(node, ast.FunctionDef)}
+
+
+def check_loader_decoders():
+    """Raise if a service's loader decodes the registry with other code than this build's."""
+    own = _functions(Path(__file__).resolve())
+    for loader_path in REGISTRY_LOADERS:
+        if not loader_path.exists():
+            continue
+        theirs = _functions(loader_path)
+        for name in SHARED_DECODERS:
+            if theirs.get(name) != own[name]:
+                raise ValueError(f"{name} in {loader_path} differs from the one in {Path(__file__).name}; "
+                                 f"copy it over")
+
+
+def check_loader_versions():
+    """Raise if a service's loader reads another registry version than this build writes."""
+    for loader_path in REGISTRY_LOADERS:
+        if not loader_path.exists():
+            print(f"Skipping the version check of {loader_path}, which is not in this checkout")
+            continue
+        version = loader_version(loader_path)
+        if version != ZONE_REGISTRY_VERSION:
+            raise ValueError(f"{loader_path} reads zone registry v{version}, but this build writes "
+                             f"v{ZONE_REGISTRY_VERSION}; update the loaders with the format")
+
+
+def build_zone_registry(geojson_path: str, taxi_zones_path: str, output_path: str) -> Path:
+    """Compile zone geometry and zone attributes into a single .npz artifact."""
+    check_loader_versions()
+    check_loader_decoders()
+    # Only the build step needs geopandas; loading the table stays pandas-only.
+    # Read the GeoJSON the same way the API's ZoneMapper does so the geometry matches.
+    import geopandas as gpd
+    import shapely
+
+    taxi_zones = pd.read_csv(taxi_zones_path)
+    zones_gdf = gpd.read_file(geojson_path)
+
+    geometries = np.asarray(zones_gdf.geometry.values)
+    wkbs = shapely.to_wkb(geometries)
+    offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(wkb) for wkb in wkbs])
+
+    def strings(values) -> np.ndarray:
+        return np.array(['' if pd.isna(v) else str(v) for v in values])
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'wb') as f:
+        np.savez(
+            f,
+            format_version=np.int64(ZONE_REGISTRY_VERSION),
+            location_id=taxi_zones['LocationID'].to_numpy(dtype=np.int32),
+            borough=strings(taxi_zones['Borough']),
+            zone=strings(taxi_zones['Zone']),
+            service_zone=strings(taxi_zones['service_zone']),
+            geom_zone_id=zones_gdf['zone_id'].to_numpy(dtype=np.int32),
+            geom_zone_name=strings(zones_gdf['zone_name']),
+            geom_borough=strings(zones_gdf['borough']),
+            geom_service_zone=strings(zones_gdf['service_zone']),
+            geom_bounds=shapely.bounds(geometries),
+            wkb_offsets=offsets,
+            wkb_data=np.frombuffer(b''.join(wkbs), dtype=np.uint8),
+        )
+    print(f"Saved zone registry v{ZONE_REGISTRY_VERSION} with {len(taxi_zones)} zones "
+          f"and {len(geometries)} geometries to {output_path}")
+    return output_path
+
+
+def load_zone_table(registry_path: str) -> pd.DataFrame:
+    """Zone attributes from a registry as a taxi_zones.csv-shaped DataFrame."""
+    with np.load(registry_path) as registry:
+        if int(registry['format_version']) != ZONE_REGISTRY_VERSION:
+            raise ValueError(f"Unsupported zone registry version {int(registry['format_version'])}")
+        return _zone_table(registry)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile taxi zone geometry and attributes into a binary registry')
+    default_dir = Path(os.getcwd()) / 'data'
+    parser.add_argument('--geojson', type=str, default=str(default_dir / 'nycneighborhoods_converted.geo.json'), help='Converted zone GeoJSON file')
+    parser.add_argument('--taxi-zones', type=str, default=str(default_dir / 'taxi_zones.csv'), help='Taxi zone lookup CSV')
+    parser.add_argument('--output', type=str, default=str(ZONE_REGISTRY_PATH), help='Output registry path')
+    args = parser.parse_args()
+    build_zone_registry(args.geojson, args.taxi_zones, args.output)
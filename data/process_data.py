@@ -3,6 +3,7 @@ import os
 import argparse
 from pathlib import Path
 from typing import Optional
+from build_zone_registry import ZONE_REGISTRY_PATH, load_zone_table
 
 class DataLoader:
     def __init__(self, 
@@ -98,8 +99,14 @@ class DataLoader:
     def _drop_extra_columns(self, df: pd.DataFrame) -> pd.DataFrame:
         return df.drop(columns=["LocationID_pu", "LocationID_do"], errors='ignore')
     
+    def _load_taxi_zones(self) -> pd.DataFrame:
+        """Zone attributes from the compiled registry when present, else taxi_zones.csv."""
+        if ZONE_REGISTRY_PATH.exists():
+            return load_zone_table(str(ZONE_REGISTRY_PATH))
+        return pd.read_csv("data/taxi_zones.csv")
+
     def join_vs_taxi_zones(self, df: pd.DataFrame) -> pd.DataFrame:
-        taxi_zones = pd.read_csv("data/taxi_zones.csv")
+        taxi_zones = self._load_taxi_zones()
         df = df.merge(taxi_zones, left_on="PULocationID", right_on="LocationID", how="left")
         df = df.merge(taxi_zones, left_on="DOLocationID", right_on="LocationID", how="left", suffixes=("_pu", "_do"))
         return df
@@ -0,0 +1,60 @@
+"""
+Cold-start benchmark for the model worker.
+
+Times taxi zone loading and full Predictor construction in fresh
+interpreters, once from taxi_zones.csv and once from the compiled zone
+registry (see data/build_zone_registry.py). Run from the model directory:
+
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from zone_registry import ZONE_REGISTRY_PATH
+
+SNIPPET = """
+import logging, time
+logging.disable(logging.WARNING)
+import pandas, numpy
+from zone_registry import load_taxi_zones
+start = time.perf_counter()
+load_taxi_zones()
+zones = time.perf_counter() - start
+from main import Predictor
+start = time.perf_counter()
+Predictor(local=True)
+print(zones, time.perf_counter() - start)
+"""
+
+
+def time_cold_start(registry_path: str, runs: int):
+    """Median seconds for zone loading and for Predictor construction."""
+    env = dict(os.environ, ZONE_REGISTRY_PATH=registry_path)
+    zones, predictor = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-W', 'ignore', '-c', SNIPPET], env=env,
+                             capture_output=True, text=True, check=True)
+        zone_time, predictor_time = map(float, out.stdout.strip().splitlines()[-1].split())
+        zones.append(zone_time)
+        predictor.append(predictor_time)
+    return statistics.median(zones), statistics.median(predictor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark model worker cold start')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per variant')
+    parser.add_argument('--registry', type=str, default=ZONE_REGISTRY_PATH, help='Compiled zone registry')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.registry):
+        sys.exit(f"No zone registry at {args.registry}; build it with data/build_zone_registry.py")
+
+    for name, path in (('taxi_zones.csv', os.devnull + '.missing'), ('zone registry', args.registry)):
+        zones, predictor = time_cold_start(path, args.runs)
+        print(f"{name:<15} zones {zones * 1000:>7.1f} ms   Predictor() {predictor * 1000:>7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
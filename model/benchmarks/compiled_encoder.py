@@ -0,0 +1,125 @@
+"""
+Parity check and latency benchmark for the compiled feature encoder.
+
+Replays trips through Predictor.predict_batch twice, once through the
+compiled encoders and once through the DataFrame pipelines, and exits
+non-zero if any prediction differs. Then times single-row predictions on
+both paths. Run from the model directory:
+
+    python -m benchmarks.compiled_encoder --rows 20000
+    python -m benchmarks.compiled_encoder --replay yellow_tripdata_2024-01.parquet
+
+Without --replay the trips are synthetic, drawn over every LocationID
+(including the unknown zones 264 and 265), hour, weekday and flag.
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import numpy as np
+import pandas as pd
+from main import Predictor
+from zone_table import MAX_LOCATION_ID
+
+REPLAY_COLUMNS = ['PULocationID', 'DOLocationID', 'store_and_fwd_flag', 'trip_distance', 'tpep_pickup_datetime']
+
+
+def synthetic_trips(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1)
+    trips = []
+    for _ in range(n):
+        trips.append({
+            'PULocationID': int(rng.integers(1, MAX_LOCATION_ID + 1)),
+            'DOLocationID': int(rng.integers(1, MAX_LOCATION_ID + 1)),
+            'store_and_fwd_flag': 'Y' if rng.random() < 0.05 else 'N',
+            'trip_distance': float(np.round(rng.exponential(3.0), 2)),
+            'tpep_pickup_datetime': start + timedelta(seconds=int(rng.integers(0, 366 * 24 * 3600)))
+        })
+    return trips
+
+
+def replay_trips(path: str, n: int) -> List[Dict[str, Any]]:
+    df = pd.read_parquet(path, columns=REPLAY_COLUMNS) if path.endswith('.parquet') else pd.read_csv(path, usecols=REPLAY_COLUMNS)
+    df = df.dropna().head(n)
+    df['tpep_pickup_datetime'] = pd.to_datetime(df['tpep_pickup_datetime'])
+    return [
+        {
+            'PULocationID': int(row.PULocationID),
+            'DOLocationID': int(row.DOLocationID),
+            'store_and_fwd_flag': str(row.store_and_fwd_flag),
+            'trip_distance': float(row.trip_distance),
+            'tpep_pickup_datetime': row.tpep_pickup_datetime.to_pydatetime()
+        }
+        for row in df.itertuples(index=False)
+    ]
+
+
+def outcome(prediction) -> tuple:
+    if isinstance(prediction, Exception):
+        return ('error',)
+    return (prediction.fare_amount, prediction.trip_duration)
+
+
+def check_parity(predictor: Predictor, trips: List[Dict[str, Any]], batch_size: int) -> int:
+    """Number of trips whose compiled and pipeline results differ."""
+    mismatches = 0
+    for start in range(0, len(trips), batch_size):
+        batch = trips[start:start + batch_size]
+        predictor.engine.compiled = True
+        compiled = predictor.predict_batch(batch)
+        predictor.engine.compiled = False
+        reference = predictor.predict_batch(batch)
+        for trip, a, b in zip(batch, compiled, reference):
+            if outcome(a) != outcome(b):
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"MISMATCH {trip}: compiled {outcome(a)} pipeline {outcome(b)}")
+    predictor.engine.compiled = True
+    return mismatches
+
+
+def time_single_rows(predictor: Predictor, trips: List[Dict[str, Any]]) -> List[float]:
+    timings = []
+    for trip in trips:
+        start = time.perf_counter()
+        predictor.predict_batch([trip])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the compiled feature encoder')
+    parser.add_argument('--rows', type=int, default=20000, help='Trips in the parity replay set')
+    parser.add_argument('--replay', type=str, default=None, help='Parquet or CSV of historical trips')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size for the parity replay')
+    parser.add_argument('--latency-rows', type=int, default=2000, help='Single-row predictions to time per path')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    # Without the prediction cache, so both paths really score every trip
+    predictor = Predictor(local=True, cache_size=0)
+    if not predictor.engine.compiled:
+        sys.exit("Compiled encoders are not available (COMPILED_ENCODER=0 or the pipelines are unsupported)")
+
+    trips = replay_trips(args.replay, args.rows) if args.replay else synthetic_trips(args.rows)
+    mismatches = check_parity(predictor, trips, args.batch_size)
+    print(f"parity: {len(trips)} trips, {mismatches} mismatches")
+
+    sample = trips[:args.latency_rows]
+    compiled = time_single_rows(predictor, sample)
+    predictor.engine.compiled = False
+    pipeline = time_single_rows(predictor, sample)
+    predictor.engine.compiled = True
+    for name, timings in (('pipeline', pipeline), ('compiled', compiled)):
+        print(f"{name:<9} per row p50 {statistics.median(timings) * 1e6:>8.0f} us   "
+              f"p99 {np.percentile(timings, 99) * 1e6:>8.0f} us")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
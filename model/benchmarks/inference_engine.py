@@ -0,0 +1,82 @@
+"""
+Benchmark for multi-target scoring in the InferenceEngine.
+
+Compares, per batch size, encoding every target separately and scoring the
+boosters one after the other against the engine's shared encoding, with
+the boosters scored sequentially and on parallel threads. Exits non-zero if
+the variants disagree. Run from the model directory:
+
+    python -m benchmarks.inference_engine --batch-sizes 1,32,256,4096
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+import numpy as np
+from feature_encoder import FLAGS
+from main import Predictor
+
+
+def random_inputs(valid_location: np.ndarray, n: int, rng: np.random.Generator):
+    ids = np.flatnonzero(valid_location)
+    return (rng.choice(ids, n), rng.choice(ids, n), rng.integers(0, len(FLAGS), n),
+            rng.integers(0, 24, n), rng.integers(0, 7, n), rng.exponential(3.0, n))
+
+
+def separate(engine, inputs):
+    return {target: encoder.predict(encoder.encode(*inputs)) for target, encoder in engine.encoders.items()}
+
+
+def timed(fn, inputs, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*inputs)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark shared encoding and concurrent boosters')
+    parser.add_argument('--batch-sizes', type=str, default='1,32,256,4096,32768', help='Comma-separated batch sizes')
+    parser.add_argument('--repeats', type=int, default=50, help='Timed runs per variant and batch size')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    engine = Predictor(local=True).engine
+    if not engine.compiled:
+        sys.exit("Compiled encoders are not available (COMPILED_ENCODER=0 or the pipelines are unsupported)")
+    for target, overlay in engine._overlays.items():
+        shared = 'separate' if overlay is None else f"{sum(len(columns) for _, columns, _ in overlay)} own columns"
+        print(f"{target:<14} {shared}")
+
+    rng = np.random.default_rng(0)
+    failed = False
+    print(f"{'rows':>7} {'separate':>12} {'shared':>12} {'shared+threads':>15}")
+    for n in map(int, args.batch_sizes.split(',')):
+        inputs = random_inputs(engine.valid_location, n, rng)
+        reference = separate(engine, inputs)
+
+        def shared(*inputs, parallel_min_rows: int):
+            engine.parallel_min_rows = parallel_min_rows
+            return engine.predict_compiled(*inputs)
+
+        for parallel_min_rows in (sys.maxsize, 0):
+            outputs = shared(*inputs, parallel_min_rows=parallel_min_rows)
+            failed |= any(not np.array_equal(outputs[t], reference[t]) for t in engine.targets)
+
+        repeats = max(3, args.repeats // max(1, n // 4096))
+        results = [
+            timed(lambda *x: separate(engine, x), inputs, repeats),
+            timed(lambda *x: shared(*x, parallel_min_rows=sys.maxsize), inputs, repeats),
+            timed(lambda *x: shared(*x, parallel_min_rows=0), inputs, repeats),
+        ]
+        print(f"{n:>7} " + ' '.join(f"{r * 1000:>{w}.3f}ms" for r, w in zip(results, (10, 10, 13))))
+
+    print("outputs identical" if not failed else "OUTPUT MISMATCH")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
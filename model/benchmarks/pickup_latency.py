@@ -0,0 +1,92 @@
+"""
+Pickup latency check for an idle model worker.
+
+Starts `python main.py` against the Redis at REDIS_HOST/REDIS_PORT, reading
+a scratch request queue (or stream, with REQUEST_TRANSPORT=stream) so live
+requests on the same Redis are left alone, waits for its heartbeat key, then
+sends single requests separated by random idle gaps, so they land at every
+point of the worker's blocking read. Reports
+round-trip percentiles (enqueue to reply, which includes scoring one row)
+and exits non-zero if p99 exceeds --max-p99-ms. Run from the model
+directory with Redis up:
+
+    python -m benchmarks.pickup_latency --requests 100
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import numpy as np
+import redis
+from main import HEARTBEAT_KEY_PREFIX
+from transport import LANES, enqueue, lane_key
+
+REPLY_KEY = 'benchmarks:pickup_latency:replies'
+QUEUE = 'benchmarks:pickup_latency:requests'
+STREAM = 'benchmarks:pickup_latency:stream'
+SCRATCH_KEYS = [REPLY_KEY] + [lane_key(name, lane) for name in (QUEUE, STREAM) for lane in LANES]
+TRIP = {
+    'PULocationID': 132,
+    'DOLocationID': 236,
+    'store_and_fwd_flag': 'N',
+    'trip_distance': 3.66,
+    'tpep_pickup_datetime': '2024-05-03T08:15:00'
+}
+
+
+def wait_for_heartbeat(client: redis.Redis, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    key = f"{HEARTBEAT_KEY_PREFIX}*-{process.pid}"
+    while time.monotonic() < deadline:
+        if next(client.scan_iter(match=key), None):
+            return
+        if process.poll() is not None:
+            sys.exit(f"Worker exited with status {process.returncode}")
+        time.sleep(0.1)
+    sys.exit(f"No heartbeat from the worker within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check request pickup latency on an idle worker')
+    parser.add_argument('--requests', type=int, default=100, help='Requests to send')
+    parser.add_argument('--max-gap', type=float, default=2.5, help='Longest idle gap between requests, in seconds')
+    parser.add_argument('--max-p99-ms', type=float, default=20, help='Fail if p99 round-trip exceeds this')
+    args = parser.parse_args()
+
+    client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                         decode_responses=True)
+    client.delete(*SCRATCH_KEYS)
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', 'main.py'],
+                               env=dict(os.environ, REQUEST_QUEUE=QUEUE, REQUEST_STREAM=STREAM),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_heartbeat(client, process, timeout=60)
+        rng = random.Random(0)
+        timings = []
+        for _ in range(args.requests):
+            time.sleep(rng.uniform(0, args.max_gap))
+            message = json.dumps(dict(TRIP, request_id=str(uuid.uuid4()), reply_to=REPLY_KEY))
+            start = time.perf_counter()
+            enqueue(client, message, queue=QUEUE, stream=STREAM)
+            if client.brpop(REPLY_KEY, timeout=10) is None:
+                sys.exit("No reply within 10s")
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+        client.delete(*SCRATCH_KEYS)
+
+    p99 = np.percentile(timings, 99)
+    print(f"{len(timings)} requests: p50 {statistics.median(timings):.2f} ms   "
+          f"p99 {p99:.2f} ms   max {max(timings):.2f} ms")
+    sys.exit(1 if p99 > args.max_p99_ms else 0)
+
+
+if __name__ == "__main__":
+    main()
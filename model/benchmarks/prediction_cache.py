@@ -0,0 +1,152 @@
+"""
+Correctness check and benchmark for the in-process prediction cache.
+
+Replays a skewed quote workload (a few hot zone pairs, as with airport
+runs, over a long tail of random trips) through Predictor.predict_batch
+with and without the cache. Exits non-zero if a cached prediction differs
+from the uncached one, if identical rows in a batch are scored more than
+once, if the default settings key or score a rounded distance, if entries
+outlive their TTL, if replacing a model artifact does not empty the cache,
+or if a batch scored across a reload is tagged or cached as the new model.
+Then reports hit rate and per-batch latency. The predictors load a
+temporary copy of the model artifacts, so the reload checks leave the real
+ones untouched. Run from the model directory:
+
+    python -m benchmarks.prediction_cache --batches 500
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+import numpy as np
+from benchmarks.compiled_encoder import outcome, synthetic_trips
+from main import MODEL_ARTIFACTS, Predictor
+
+
+def skewed_trips(n: int, hot_share: float, seed: int = 0) -> List[Dict[str, Any]]:
+    """Synthetic trips where hot_share of them repeat one of a handful of hot routes."""
+    rng = np.random.default_rng(seed)
+    hot = synthetic_trips(20, seed=seed + 1)
+    tail = synthetic_trips(n, seed=seed)
+    return [hot[rng.integers(len(hot))] if rng.random() < hot_share else trip for trip in tail]
+
+
+def time_batches(predictor: Predictor, trips: List[Dict[str, Any]], batch_size: int) -> List[float]:
+    timings = []
+    for start in range(0, len(trips), batch_size):
+        begin = time.perf_counter()
+        predictor.predict_batch(trips[start:start + batch_size])
+        timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the prediction cache')
+    parser.add_argument('--batches', type=int, default=500, help='Batches in the replay')
+    parser.add_argument('--batch-size', type=int, default=32, help='Requests per batch')
+    parser.add_argument('--hot-share', type=float, default=0.5, help='Share of requests on the hot routes')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    scratch = tempfile.mkdtemp(prefix='prediction_cache_')
+    try:
+        for target, path in MODEL_ARTIFACTS.items():
+            MODEL_ARTIFACTS[target] = shutil.copy2(path, scratch)
+        failures = run(args)
+    finally:
+        shutil.rmtree(scratch)
+    sys.exit(1 if failures else 0)
+
+
+def run(args) -> List[str]:
+    trips = skewed_trips(args.batches * args.batch_size, args.hot_share)
+    cached = Predictor(local=True)
+    uncached = Predictor(local=True, cache_size=0)
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    # Cached results must match scoring every trip
+    sample = trips[:2000]
+    warm = cached.predict_batch(sample)
+    again = cached.predict_batch(sample)
+    reference = uncached.predict_batch(sample)
+    check(all(outcome(a) == outcome(b) == outcome(c) for a, b, c in zip(warm, again, reference)),
+          "cached predictions match uncached scoring")
+
+    # Without an opted-in resolution, keys and scoring use the exact distance
+    exact = dict(trips[0], trip_distance=2.349)
+    check(cached.cache.key(exact)[-1] == 2.349
+          and outcome(cached.predict_batch([exact])[0]) == outcome(uncached.predict_batch([exact])[0]),
+          "a 2.349-mile trip is keyed and priced as 2.349 miles by default")
+
+    # Identical rows in one batch are scored once
+    scored_rows = []
+    predict_rows = uncached._predict_rows
+    uncached._predict_rows = lambda rows, engine: scored_rows.append(len(rows)) or predict_rows(rows, engine)
+    uncached.predict_batch([trips[0]] * 8 + [trips[1]] * 8)
+    uncached._predict_rows = predict_rows
+    check(scored_rows == [len({uncached.cache.key(trip) for trip in trips[:2]})],
+          f"16 rows of 2 distinct trips were scored as {scored_rows}")
+
+    # Entries expire after the TTL
+    ttl = cached.cache.ttl
+    cached.cache.ttl = 0.05
+    cached.cache.invalidate(cached.model_version_id)
+    cached.predict_batch(sample[:10])
+    time.sleep(0.1)
+    hits = cached.cache.hits
+    cached.predict_batch(sample[:10])
+    check(cached.cache.hits == hits, "expired entries are not served")
+    cached.cache.ttl = ttl
+
+    # Replacing a model artifact empties the cache
+    cached.predict_batch(sample)
+    artifact = MODEL_ARTIFACTS['fare_amount']
+    stat = os.stat(artifact)
+    os.utime(artifact, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    cached._check_artifacts()
+    check(cached.cache.stats()['size'] == 0 and cached.model_version == cached._artifact_version(),
+          "a replaced artifact reloads the models and drops cached predictions")
+
+    # A batch scored while the models reload keeps the version it was scored with
+    old_version = cached.model_version_id
+    artifact_digest, predict_rows = cached._artifact_digest, cached._predict_rows
+    cached._artifact_digest = lambda: 'reloaded'
+
+    def reload_midway(rows, engine):
+        cached._load_models()
+        return predict_rows(rows, engine)
+
+    cached._predict_rows = reload_midway
+    message = json.dumps(dict(trips[0], tpep_pickup_datetime=trips[0]['tpep_pickup_datetime'].isoformat()))
+    replies, _ = cached._score_messages([(None, message)])
+    cached._artifact_digest, cached._predict_rows = artifact_digest, predict_rows
+    check(json.loads(replies[0][2])['model_version'] == old_version and cached.cache.stats()['size'] == 0,
+          "a batch scored across a reload is tagged with the old version and not cached under the new one")
+    cached._load_models()
+
+    # Throughput on the skewed workload, starting from a cold cache
+    cached.cache.invalidate(cached.model_version_id)
+    cached.cache.hits = cached.cache.misses = 0
+    with_cache = time_batches(cached, trips, args.batch_size)
+    without_cache = time_batches(uncached, trips, args.batch_size)
+    stats = cached.cache.stats()
+    print(f"hot share {args.hot_share:.0%}: hit rate {stats['hit_rate']:.1%}, {stats['size']} entries")
+    for name, timings in (('uncached', without_cache), ('cached', with_cache)):
+        print(f"{name:<9} per batch p50 {statistics.median(timings) * 1e3:>7.2f} ms   "
+              f"p99 {np.percentile(timings, 99) * 1e3:>7.2f} ms")
+    return failures
+
+
+if __name__ == "__main__":
+    main()
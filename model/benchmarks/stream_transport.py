@@ -0,0 +1,133 @@
+"""
+Delivery check for the Redis Streams request transport.
+
+Runs StreamTransport through the failure cases it exists for and exits
+non-zero if any of them misbehaves:
+
+  * a consumer that dies before acking leaves its entries pending, and
+    another consumer reclaims and acks them once they go stale
+  * entries redelivered more than max_deliveries times go to the
+    dead-letter stream instead of being retried forever
+  * an idle consumer whose blocking read returns both lanes batches them
+    separately, interactive first
+  * producers keep the stream near STREAM_MAXLEN
+
+Uses an in-process fakeredis server, or with --redis the Redis at
+REDIS_HOST/REDIS_PORT, where it only touches benchmarks:stream_transport
+keys. Run from the model directory:
+
+    python -m benchmarks.stream_transport
+"""
+import argparse
+import os
+import sys
+import time
+import redis
+from transport import StreamTransport, enqueue
+
+STREAM = 'benchmarks:stream_transport'
+BULK_STREAM = f"{STREAM}:bulk"
+DEAD_LETTER = f"{STREAM}:dead"
+
+
+def connect(real: bool) -> redis.Redis:
+    if not real:
+        import fakeredis
+        return fakeredis.FakeRedis(decode_responses=True)
+    return redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                       decode_responses=True)
+
+
+def consumer(client: redis.Redis, name: str, claim_idle_ms: int, max_deliveries: int = 5) -> StreamTransport:
+    transport = StreamTransport(stream=STREAM, group='check', claim_idle_ms=claim_idle_ms,
+                                claim_interval=0, max_deliveries=max_deliveries)
+    transport.setup(client)
+    transport.consumer = name
+    return transport
+
+
+def pending(client: redis.Redis) -> int:
+    return client.xpending(STREAM, 'check')['pending']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check StreamTransport redelivery, dead-lettering and trimming')
+    parser.add_argument('--redis', action='store_true',
+                        help='Use the Redis at REDIS_HOST/REDIS_PORT instead of fakeredis')
+    args = parser.parse_args()
+
+    client = connect(args.redis)
+    client.delete(STREAM, BULK_STREAM, DEAD_LETTER)
+    failures = []
+
+    def check(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    # A consumer reads a batch and dies before writing responses
+    idle_ms = 200
+    dead = consumer(client, 'dead-worker', idle_ms)
+    for i in range(10):
+        client.xadd(STREAM, {'data': f'request-{i}'})
+    received = dead.receive(client, batch_size=10, batch_wait_ms=0)
+    check(len(received) == 10 and pending(client) == 10, "unacked entries stay pending after the consumer dies")
+
+    alive = consumer(client, 'live-worker', idle_ms)
+    check(alive.receive(client, batch_size=10, batch_wait_ms=0) == [], "fresh pending entries are not reclaimed early")
+
+    time.sleep(idle_ms / 1000 * 1.5)
+    reclaimed = alive.receive(client, batch_size=10, batch_wait_ms=0)
+    check(sorted(raw for _, raw in reclaimed) == sorted(raw for _, raw in received),
+          "stale entries are reclaimed by a live consumer")
+    pipe = client.pipeline(transaction=False)
+    alive.ack(pipe, [token for token, _ in reclaimed])
+    pipe.execute()
+    check(pending(client) == 0, "reclaimed entries are acked after processing")
+
+    # An entry that keeps killing its consumer ends up dead-lettered
+    poison_id = client.xadd(STREAM, {'data': 'poison'})
+    crashing = consumer(client, 'crashing-worker', 0, max_deliveries=2)
+    crashing.receive(client, batch_size=1, batch_wait_ms=0)
+    for _ in range(3):
+        crashing._claim_cursors = dict.fromkeys(crashing._claim_cursors, '0-0')
+        crashing.receive(client, batch_size=1, batch_wait_ms=0)
+    dead_letters = client.xrange(DEAD_LETTER)
+    check(pending(client) == 0 and any(fields.get('id') == poison_id for _, fields in dead_letters),
+          "entries over max_deliveries move to the dead-letter stream")
+
+    # Both lanes fill between the per-lane reads and the blocking one, so the
+    # blocking read returns an entry from each: the batches still keep to one lane
+    client.delete(STREAM, BULK_STREAM)
+    idle = consumer(client, 'idle-worker', idle_ms)
+    client.xadd(BULK_STREAM, {'data': 'bulk'})
+    client.xadd(STREAM, {'data': 'interactive'})
+    read = idle._read
+    idle._read = lambda client, lanes, count, block=None: read(client, lanes, count, block) if block else []
+    first = idle.receive(client, batch_size=10, batch_wait_ms=0, timeout=1)
+    idle._read = read
+    second = idle.receive(client, batch_size=10, batch_wait_ms=0, timeout=1)
+    batches = [[raw for _, raw in first], [raw for _, raw in second]]
+    check(batches == [['interactive'], ['bulk']], f"a blocking read over both lanes never mixes them ({batches})")
+
+    # Producers trim the stream
+    client.delete(STREAM, BULK_STREAM)
+    pipe = client.pipeline(transaction=False)
+    for i in range(5000):
+        pipe.xadd(STREAM, {'data': str(i)}, maxlen=1000, approximate=True)
+    pipe.execute()
+    length = client.xlen(STREAM)
+    check(length < 2000, f"approximate MAXLEN keeps the stream near its cap ({length} entries for cap 1000)")
+
+    # The API-side helper adds to the stream the workers read
+    client.delete(STREAM)
+    enqueue(client, '{}', name='stream', stream=STREAM)
+    received = consumer(client, 'live-worker', idle_ms).receive(client, batch_size=1, batch_wait_ms=0)
+    check([raw for _, raw in received] == ['{}'], "enqueue adds requests to the stream the workers read")
+
+    client.delete(STREAM, BULK_STREAM, DEAD_LETTER)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
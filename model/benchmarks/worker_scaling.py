@@ -0,0 +1,101 @@
+"""
+Throughput-vs-workers benchmark for the model worker.
+
+Starts `python main.py` with WORKERS=1, 2, ... against the Redis at
+REDIS_HOST/REDIS_PORT. For each worker count it floods a scratch request
+queue (or stream, with REQUEST_TRANSPORT=stream) with synthetic trips and
+measures how many responses per second come back. The workers read only
+the benchmarks: keys, so live requests on the same Redis are left alone.
+Run from the model directory with Redis up:
+
+    python -m benchmarks.worker_scaling --workers 1,2,4 --requests 20000
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+import redis
+from benchmarks.compiled_encoder import synthetic_trips
+from transport import LANES, enqueue, lane_key
+
+REPLY_KEY = 'benchmarks:worker_scaling:replies'
+QUEUE = 'benchmarks:worker_scaling:requests'
+STREAM = 'benchmarks:worker_scaling:stream'
+SCRATCH_KEYS = [REPLY_KEY] + [lane_key(name, lane) for name in (QUEUE, STREAM) for lane in LANES]
+
+
+def encode(trip, request_id: str) -> str:
+    return json.dumps(dict(
+        trip,
+        tpep_pickup_datetime=trip['tpep_pickup_datetime'].isoformat(),
+        request_id=request_id,
+        reply_to=REPLY_KEY
+    ))
+
+
+def wait_for_replies(client: redis.Redis, count: int, timeout: float) -> int:
+    received = 0
+    deadline = time.monotonic() + timeout
+    while received < count and time.monotonic() < deadline:
+        if client.brpop(REPLY_KEY, timeout=1):
+            received += 1
+            drained = client.rpop(REPLY_KEY, count - received)
+            received += len(drained or [])
+    return received
+
+
+def run(client: redis.Redis, workers: int, messages, timeout: float) -> float:
+    """Responses per second with the given number of workers."""
+    env = dict(os.environ, WORKERS=str(workers), REQUEST_QUEUE=QUEUE, REQUEST_STREAM=STREAM)
+    client.delete(*SCRATCH_KEYS)
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', 'main.py'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Wait until the workers answer before starting the clock
+        for _ in range(workers * 2):
+            enqueue(client, messages[0], queue=QUEUE, stream=STREAM)
+        if wait_for_replies(client, workers * 2, timeout) < workers * 2:
+            raise RuntimeError(f"workers={workers} did not come up within {timeout}s")
+
+        start = time.perf_counter()
+        pipe = client.pipeline(transaction=False)
+        for message in messages:
+            enqueue(pipe, message, queue=QUEUE, stream=STREAM)
+        pipe.execute()
+        received = wait_for_replies(client, len(messages), timeout)
+        elapsed = time.perf_counter() - start
+        if received < len(messages):
+            raise RuntimeError(f"workers={workers} answered {received}/{len(messages)} requests")
+        return len(messages) / elapsed
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark model worker throughput by worker count')
+    parser.add_argument('--workers', type=str, default=','.join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                        help='Comma-separated worker counts')
+    parser.add_argument('--requests', type=int, default=20000, help='Requests per worker count')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for responses')
+    args = parser.parse_args()
+
+    client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                         decode_responses=True)
+    messages = [encode(trip, str(uuid.uuid4())) for trip in synthetic_trips(args.requests)]
+
+    print(f"{os.cpu_count()} CPUs")
+    baseline = None
+    for workers in map(int, args.workers.split(',')):
+        throughput = run(client, workers, messages, args.timeout)
+        baseline = baseline or throughput
+        print(f"workers={workers:<3} {throughput:>9.0f} req/s   x{throughput / baseline:.2f}")
+    client.delete(*SCRATCH_KEYS)
+
+
+if __name__ == "__main__":
+    main()
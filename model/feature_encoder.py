@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from zone_table import MAX_LOCATION_ID
+
+# Every model feature is a function of exactly one of these request keys, so each
+# encoded column can be precomputed as a lookup table over that key's domain.
+KEY_FEATURES = {
+    'pu': ('Zone_pu', 'Borough_pu', 'service_zone_pu'),
+    'do': ('Zone_do', 'Borough_do', 'service_zone_do'),
+    'flag': ('store_and_fwd_flag',),
+    'hour': ('hour_of_day_pu', 'time_of_day_pu'),
+    'dow': ('day_of_week_pu',),
+}
+FLAGS = ('N', 'Y')
+# A Monday; weekday d of the reference week is REFERENCE_DATE + d days
+REFERENCE_DATE = datetime(2024, 1, 1, 12)
+REFERENCE_DISTANCE = 1.0
+
+
+class UnsupportedPipeline(Exception):
+    """The pipeline has a shape the compiled encoder cannot reproduce exactly."""
+
+
+class CompiledEncoder:
+    """
+    NumPy lookup-table version of a fitted preprocessing pipeline.
+
+    Compiles the target encoder and column transformer of a
+    ``Pipeline([target_enc, col_transform, xgb])`` into one table per request key.
+    Encoding a batch is then a handful of array gathers, and the result is fed
+    straight to the booster with in-place prediction.
+    """
+
+    def __init__(self, pipeline: Pipeline, build_features: Callable[[Dict[str, Any]], Tuple[Dict[str, Any], List[str]]],
+                 valid_location: Optional[np.ndarray] = None):
+        if not isinstance(pipeline, Pipeline) or len(pipeline.steps) < 2:
+            raise UnsupportedPipeline("expected a Pipeline of preprocessing steps and a final estimator")
+        self.preprocessor = pipeline[:-1]
+        self.estimator = pipeline.steps[-1][1]
+        if not hasattr(self.estimator, 'get_booster'):
+            raise UnsupportedPipeline(f"final step {type(self.estimator).__name__} is not an XGBoost model")
+        self.booster = self.estimator.get_booster()
+        best_iteration = getattr(self.estimator, 'best_iteration', None)
+        self.iteration_range = (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+        self.missing = self.estimator.missing
+
+        self._build_features = build_features
+        sources = self._output_sources(self.preprocessor.steps[-1][1])
+        self.n_features = len(sources)
+        self.columns = {key: np.array([i for i, s in enumerate(sources) if s in features], dtype=np.intp)
+                        for key, features in KEY_FEATURES.items()}
+        self.distance_col, self.distance_mean, self.distance_scale = self._distance_affine(sources)
+
+        owned = sum(len(cols) for cols in self.columns.values()) + 1
+        if owned != self.n_features:
+            raise UnsupportedPipeline(f"{self.n_features - owned} encoded columns depend on unsupported features")
+
+        self._compile_tables(valid_location)
+        self._self_check()
+
+    def _output_sources(self, ct: ColumnTransformer) -> List[str]:
+        """Name of the input feature behind each output column of the column transformer."""
+        if not isinstance(ct, ColumnTransformer):
+            raise UnsupportedPipeline("expected a ColumnTransformer as the last preprocessing step")
+        sources: List[str] = [None] * sum(s.stop - s.start for s in ct.output_indices_.values())
+        for name, transformer, columns in ct.transformers_:
+            out = ct.output_indices_[name]
+            if out.stop == out.start:
+                continue
+            if name == 'remainder':
+                names = [ct.feature_names_in_[i] for i in columns]
+            elif isinstance(transformer, OneHotEncoder):
+                if transformer.drop_idx_ is not None:
+                    raise UnsupportedPipeline("OneHotEncoder with drop is not supported")
+                names = [col for col, cats in zip(columns, transformer.categories_) for _ in cats]
+            elif isinstance(transformer, StandardScaler):
+                names = list(columns)
+            else:
+                raise UnsupportedPipeline(f"unsupported transformer {type(transformer).__name__}")
+            if len(names) != out.stop - out.start:
+                raise UnsupportedPipeline(f"could not map the output columns of {name}")
+            sources[out] = names
+        return sources
+
+    def _distance_affine(self, sources: List[str]) -> Tuple[int, float, float]:
+        """Column index and StandardScaler parameters for trip_distance."""
+        if sources.count('trip_distance') != 1:
+            raise UnsupportedPipeline("trip_distance must map to exactly one scaled column")
+        ct = self.preprocessor.steps[-1][1]
+        for name, transformer, columns in ct.transformers_:
+            if isinstance(transformer, StandardScaler) and 'trip_distance' in columns:
+                k = list(columns).index('trip_distance')
+                mean = transformer.mean_[k] if transformer.with_mean else 0.0
+                scale = transformer.scale_[k] if transformer.with_std else 1.0
+                return sources.index('trip_distance'), mean, scale
+        raise UnsupportedPipeline("trip_distance is not standard-scaled")
+
+    def _request(self, pu: int, do: int, flag: str = 'N', when: datetime = REFERENCE_DATE) -> Dict[str, Any]:
+        return {
+            'PULocationID': pu,
+            'DOLocationID': do,
+            'store_and_fwd_flag': flag,
+            'trip_distance': REFERENCE_DISTANCE,
+            'tpep_pickup_datetime': when
+        }
+
+    def _encode_requests(self, requests: List[Dict[str, Any]]) -> np.ndarray:
+        """Run requests through the real enrichment, validation and preprocessing."""
+        rows, features = [], None
+        for request in requests:
+            row, features = self._build_features(request)
+            rows.append(row)
+        encoded = self.preprocessor.transform(pd.DataFrame(rows, columns=features))
+        return encoded.toarray() if hasattr(encoded, 'toarray') else np.asarray(encoded)
+
+    def _scan_locations(self) -> np.ndarray:
+        """LocationIDs that pass enrichment and validation on both ends of a trip."""
+        valid_location = np.zeros(MAX_LOCATION_ID + 1, dtype=bool)
+        for location_id in range(1, MAX_LOCATION_ID + 1):
+            try:
+                self._build_features(self._request(location_id, location_id))
+                valid_location[location_id] = True
+            except Exception:
+                pass
+        return valid_location
+
+    def _compile_tables(self, valid_location: Optional[np.ndarray] = None):
+        """Build one lookup table per request key from the fitted transformers."""
+        # Validation does not depend on the model, so encoders can share one scan
+        self.valid_location = valid_location if valid_location is not None else self._scan_locations()
+        ids = np.flatnonzero(self.valid_location)
+        if ids.size == 0:
+            raise UnsupportedPipeline("no LocationID passes validation")
+        base = int(ids[0])
+
+        def table(size: int, index: np.ndarray, requests: List[Dict[str, Any]], key: str) -> np.ndarray:
+            values = np.zeros((size, len(self.columns[key])), dtype=np.float64)
+            values[index] = self._encode_requests(requests)[:, self.columns[key]]
+            return values
+
+        size = MAX_LOCATION_ID + 1
+        self.tables = {
+            'pu': table(size, ids, [self._request(int(i), base) for i in ids], 'pu'),
+            'do': table(size, ids, [self._request(base, int(i)) for i in ids], 'do'),
+            'flag': table(len(FLAGS), np.arange(len(FLAGS)), [self._request(base, base, flag=f) for f in FLAGS], 'flag'),
+            'hour': table(24, np.arange(24), [self._request(base, base, when=REFERENCE_DATE.replace(hour=h)) for h in range(24)], 'hour'),
+            'dow': table(7, np.arange(7), [self._request(base, base, when=REFERENCE_DATE + timedelta(days=d)) for d in range(7)], 'dow'),
+        }
+
+    def _self_check(self, n: int = 64, seed: int = 0):
+        """Compare against the real preprocessing on random requests; refuse to compile on any difference."""
+        rng = np.random.default_rng(seed)
+        ids = np.flatnonzero(self.valid_location)
+        pu, do = rng.choice(ids, n), rng.choice(ids, n)
+        flags = rng.integers(0, len(FLAGS), n)
+        hours, dows = rng.integers(0, 24, n), rng.integers(0, 7, n)
+        distances = rng.uniform(0, 60, n)
+        requests = [
+            {
+                'PULocationID': int(pu[i]),
+                'DOLocationID': int(do[i]),
+                'store_and_fwd_flag': FLAGS[flags[i]],
+                'trip_distance': float(distances[i]),
+                'tpep_pickup_datetime': (REFERENCE_DATE + timedelta(days=int(dows[i]))).replace(hour=int(hours[i]))
+            }
+            for i in range(n)
+        ]
+        expected = self._encode_requests(requests)
+        actual = self.encode(pu, do, flags, hours, dows, distances)
+        if not np.array_equal(expected, actual):
+            raise UnsupportedPipeline("compiled encoding differs from the pipeline")
+
+    def encode(self, pu: np.ndarray, do: np.ndarray, flags: np.ndarray, hours: np.ndarray,
+               dows: np.ndarray, distances: np.ndarray) -> np.ndarray:
+        """Dense feature matrix for already-validated request arrays (flags as indexes into FLAGS)."""
+        X = np.empty((len(pu), self.n_features), dtype=np.float64)
+        X[:, self.columns['pu']] = self.tables['pu'][pu]
+        X[:, self.columns['do']] = self.tables['do'][do]
+        X[:, self.columns['flag']] = self.tables['flag'][flags]
+        X[:, self.columns['hour']] = self.tables['hour'][hours]
+        X[:, self.columns['dow']] = self.tables['dow'][dows]
+        X[:, self.distance_col] = (np.asarray(distances, dtype=np.float64) - self.distance_mean) / self.distance_scale
+        return X
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Score an encoded matrix with the booster, skipping DMatrix construction."""
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range, missing=self.missing)
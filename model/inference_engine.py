@@ -0,0 +1,145 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from feature_encoder import CompiledEncoder, KEY_FEATURES
+from logger import logger
+
+# Batches of at least this many rows score the target boosters on parallel threads.
+# XGBoost releases the GIL while predicting, so small batches are not worth the hand-off.
+PARALLEL_MIN_ROWS = int(os.getenv('PARALLEL_MIN_ROWS', 256))
+
+
+class InferenceEngine:
+    """
+    Scores several target pipelines over the same requests.
+
+    Pipelines with identical preprocessing share one transform of the feature
+    DataFrame. On the compiled path every target is encoded from one base matrix:
+    only the columns whose lookup tables differ from the first target (the target
+    encodings, here) are rewritten per target, so adding a model costs a booster
+    call rather than another full encoding.
+
+    Pass the executor of the engine this one replaces to keep using its booster
+    threads instead of starting another pool on every model reload. version names
+    the artifacts the pipelines came from, so a caller that holds on to an engine
+    for a batch can tag its results with the model that produced them.
+    """
+
+    def __init__(self, pipelines: Dict[str, Pipeline],
+                 build_features: Callable[[Dict[str, Any]], Tuple[Dict[str, Any], List[str]]],
+                 compiled: bool = True, parallel_min_rows: int = PARALLEL_MIN_ROWS,
+                 executor: Optional[ThreadPoolExecutor] = None, version: Optional[str] = None):
+        self.pipelines = pipelines
+        self.version = version
+        self.targets = list(pipelines)
+        self.parallel_min_rows = parallel_min_rows
+        if executor is None and len(self.targets) > 1 and (os.cpu_count() or 1) > 1:
+            executor = ThreadPoolExecutor(max_workers=len(self.targets), thread_name_prefix='booster')
+        self.executor = executor
+
+        # Group targets whose preprocessing steps are identical
+        groups: Dict[str, List[str]] = {}
+        for target, pipeline in pipelines.items():
+            groups.setdefault(joblib.hash(pipeline[:-1]), []).append(target)
+        self.pipeline_groups = list(groups.values())
+        logger.info(f"Preprocessing groups: {self.pipeline_groups}")
+
+        self.encoders: Dict[str, CompiledEncoder] = self._compile(build_features) if compiled else {}
+        self.compiled = bool(self.encoders)
+        if self.compiled:
+            self.base = self.encoders[self.targets[0]]
+            self.valid_location = self.base.valid_location
+            self._overlays = {target: self._overlay(encoder) for target, encoder in self.encoders.items()}
+
+    def _compile(self, build_features) -> Dict[str, CompiledEncoder]:
+        """Compiled encoders for every target, or none if any pipeline is unsupported."""
+        encoders: Dict[str, CompiledEncoder] = {}
+        valid_location = None
+        for target, pipeline in self.pipelines.items():
+            try:
+                encoders[target] = CompiledEncoder(pipeline, build_features, valid_location)
+            except Exception as e:
+                logger.info(f"Could not compile {target} feature encoder, using the pipelines: {str(e)}")
+                return {}
+            valid_location = encoders[target].valid_location
+            logger.info(f"Compiled {target} feature encoder ({encoders[target].n_features} features)")
+        return encoders
+
+    def _overlay(self, encoder: CompiledEncoder) -> Optional[List[Tuple[str, np.ndarray, np.ndarray]]]:
+        """
+        (key, columns, table) rewrites that turn the base matrix into this encoder's,
+        or None if its column layout differs and it must encode from scratch.
+        """
+        base = self.base
+        if (encoder.n_features != base.n_features
+                or (encoder.distance_col, encoder.distance_mean, encoder.distance_scale)
+                != (base.distance_col, base.distance_mean, base.distance_scale)
+                or not np.array_equal(encoder.valid_location, base.valid_location)
+                or any(not np.array_equal(encoder.columns[key], base.columns[key]) for key in KEY_FEATURES)):
+            return None
+        overlay = []
+        for key in KEY_FEATURES:
+            differs = np.flatnonzero(np.any(encoder.tables[key] != base.tables[key], axis=0))
+            if differs.size:
+                overlay.append((key, encoder.columns[key][differs], encoder.tables[key][:, differs]))
+        return overlay
+
+    def set_threads(self, n_threads: int):
+        """Limit every booster to n_threads, e.g. in a worker process that shares the CPU."""
+        for pipeline in self.pipelines.values():
+            pipeline.steps[-1][1].get_booster().set_param({'nthread': n_threads})
+        if n_threads == 1 and self.executor is not None:
+            # Other worker processes already occupy the remaining cores
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def _run(self, n_rows: int, jobs: Dict[str, Callable[[], np.ndarray]]) -> Dict[str, np.ndarray]:
+        """Run one job per target, concurrently for large batches."""
+        if self.executor is None or n_rows < self.parallel_min_rows:
+            return {target: job() for target, job in jobs.items()}
+        futures = {target: self.executor.submit(job) for target, job in jobs.items()}
+        return {target: future.result() for target, future in futures.items()}
+
+    def encode(self, pu: np.ndarray, do: np.ndarray, flags: np.ndarray, hours: np.ndarray,
+               dows: np.ndarray, distances: np.ndarray) -> Dict[str, np.ndarray]:
+        """Encoded feature matrix per target, sharing the base matrix where possible."""
+        inputs = {'pu': pu, 'do': do, 'flag': flags, 'hour': hours, 'dow': dows}
+        X = self.base.encode(pu, do, flags, hours, dows, distances)
+        matrices = {}
+        for target, encoder in self.encoders.items():
+            overlay = self._overlays[target]
+            if overlay is None:
+                matrices[target] = encoder.encode(pu, do, flags, hours, dows, distances)
+            elif not overlay:
+                matrices[target] = X
+            else:
+                Xt = X.copy()
+                for key, columns, table in overlay:
+                    Xt[:, columns] = table[inputs[key]]
+                matrices[target] = Xt
+        return matrices
+
+    def predict_compiled(self, pu: np.ndarray, do: np.ndarray, flags: np.ndarray, hours: np.ndarray,
+                         dows: np.ndarray, distances: np.ndarray) -> Dict[str, np.ndarray]:
+        """Predictions per target for pre-validated request arrays."""
+        matrices = self.encode(pu, do, flags, hours, dows, distances)
+        return self._run(len(pu), {
+            target: (lambda encoder=encoder, X=matrices[target]: encoder.predict(X))
+            for target, encoder in self.encoders.items()
+        })
+
+    def predict_frame(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Predictions per target for a feature DataFrame, transforming once per preprocessing group."""
+        transformed = {}
+        for group in self.pipeline_groups:
+            Xt = self.pipelines[group[0]][:-1].transform(df)
+            for target in group:
+                transformed[target] = Xt
+        return self._run(len(df), {
+            target: (lambda pipeline=pipeline, Xt=transformed[target]: pipeline.steps[-1][1].predict(Xt))
+            for target, pipeline in self.pipelines.items()
+        })
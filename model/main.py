@@ -1,16 +1,73 @@
 from joblib import load
 import pandas as pd
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple, Union
 from datetime import datetime
 from schema import TripData, TripPrediction
+import hashlib
 import json
 import redis
 import sys
 import signal
+import socket
+import queue
+import threading
 import time
 import os
 from logger import logger
+from zone_registry import load_taxi_zones
+from zone_table import ZoneTable
+from feature_encoder import FLAGS
+from inference_engine import InferenceEngine
+from supervisor import WORKERS, WorkerSupervisor
+from transport import (SHARD_BLOCK_TIMEOUT, LaneScheduler, Message, assigned_shards, create_transport,
+                       redis_endpoints)
+from prediction_cache import PREDICTION_CACHE_SIZE, FeatureKey, PredictionCache
+from wire_format import WIRE_JSON, decode_request, encode_reply
+import numpy as np
 
+# Micro-batching: drain up to BATCH_SIZE requests, waiting at most BATCH_WAIT_MS
+# for the batch to fill once the first request has arrived. A request that finds
+# nothing queued behind it is scored immediately.
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 32))
+BATCH_WAIT_MS = int(os.getenv('BATCH_WAIT_MS', 5))
+
+# Replies go to the key named in the request's 'reply_to' field and expire after
+# RESPONSE_TTL seconds if nobody reads them. Requests without 'reply_to' fall back
+# to the shared list. Each reply uses the wire format version of its request (see
+# wire_format.py).
+DEFAULT_RESPONSE_KEY = 'prediction_responses'
+RESPONSE_TTL = int(os.getenv('RESPONSE_TTL', 60))
+
+# Requests carry a 'deadline': the Unix time after which the API stops waiting for
+# the reply. Workers drop requests that are already past it instead of scoring them
+# and replying to nobody. Deadlines are compared with this host's clock, so API and
+# model hosts need synchronized clocks.
+REQUEST_EXPIRED = 'Request deadline expired'
+
+# Score well-formed requests through NumPy lookup tables compiled from the pipelines
+# instead of building a DataFrame. Set to 0 to always use the pipelines directly.
+COMPILED_ENCODER = os.getenv('COMPILED_ENCODER', '1') == '1'
+MAX_TRIP_DISTANCE = 100
+
+# Model artifacts per target. Workers check them on every heartbeat and reload the
+# models (dropping cached predictions) when one is replaced.
+MODEL_ARTIFACTS = {
+    'fare_amount': 'xgb_model_fare_amount.pkl',
+    'trip_duration': 'xgb_model_trip_duration.pkl'
+}
+# Workers publish a content hash of the loaded artifacts here and tag every reply
+# with it, so API-side caches can key quotes on the model that produced them.
+MODEL_VERSION_KEY = 'model_version'
+
+# Pipelined worker: the main thread keeps receiving while a scorer thread scores and
+# a writer thread sends responses, with up to PIPELINE_DEPTH batches queued between
+# stages. 0 runs receive, score and respond strictly in sequence on one thread.
+PIPELINE_DEPTH = int(os.getenv('PIPELINE_DEPTH', 2))
+
+# Liveness: a listening worker refreshes model_workers:<host>-<pid> every
+# HEARTBEAT_INTERVAL seconds; the key expires after three missed beats.
+HEARTBEAT_KEY_PREFIX = 'model_workers:'
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', 5))
 
 
 class GracefulKiller:
@@ -25,188 +82,692 @@ class GracefulKiller:
 class Predictor:
     def __init__(self, local: bool = False, 
                  redis_host: str = os.getenv('REDIS_HOST', 'localhost'), 
-                 redis_port: int = int(os.getenv('REDIS_PORT', 6379))):
+                 redis_port: int = int(os.getenv('REDIS_PORT', 6379)),
+                 batch_size: int = BATCH_SIZE,
+                 batch_wait_ms: int = BATCH_WAIT_MS,
+                 pipeline_depth: int = PIPELINE_DEPTH,
+                 cache_size: int = PREDICTION_CACHE_SIZE):
         """Initialize predictor with validated data."""
         # Load taxi zone lookup data
         logger.info("Initializing Predictor")
-        self.taxi_zones = pd.read_csv("./taxi_zones.csv")
+        self.taxi_zones = load_taxi_zones()
+        self.zone_table = ZoneTable(self.taxi_zones)
         self.local = local
         
         # Load models
-        self.fare_pipeline = load("xgb_model_fare_amount.pkl")
-        logger.info("Loaded fare pipeline")
-        self.duration_pipeline = load("xgb_model_trip_duration.pkl")
-        logger.info("Loaded duration pipeline")
-
-        # Initialize Redis connection
-        self.redis_host = redis_host
-        self.redis_port = redis_port
+        self.cache = PredictionCache(max_size=cache_size)
+        self._load_models()
+
+        # Initialize Redis connection: the first endpoint holds the model version and
+        # heartbeats, and requests are read from the assigned shards
+        self.endpoints = redis_endpoints(host=redis_host, port=redis_port)
+        self.redis_host, self.redis_port = self.endpoints[0]
         self.redis_client = None
+        self.lanes = LaneScheduler()
+        self.shards = assigned_shards(len(self.endpoints))
+        self.shard_clients: Dict[int, redis.Redis] = {}
+        self.transports = {shard: create_transport(lanes=self.lanes) for shard in self.shards}
+        self._next_shard = 0
+        self.heartbeat_key = None
+        self._next_heartbeat = 0.0
+        self.requests_served = 0
+        self.requests_expired = 0
+        self.threads: Optional[int] = None
+
+        # Batching configuration
+        self.batch_size = max(1, batch_size)
+        self.batch_wait_ms = max(0, batch_wait_ms)
+        self.pipeline_depth = max(0, pipeline_depth)
 
         if not self.local:
             print("initialized Predictor")
 
+    def _artifact_version(self) -> Tuple[Tuple[str, int, int], ...]:
+        """(path, mtime, size) of every model artifact, which changes when one is replaced."""
+        version = []
+        for path in MODEL_ARTIFACTS.values():
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(version)
+
+    def _load_models(self):
+        """Load the target pipelines, build the inference engine and reset the prediction cache."""
+        version = self._artifact_version()
+        version_id = self._artifact_digest()
+        pipelines = {target: load(path) for target, path in MODEL_ARTIFACTS.items()}
+        self.fare_pipeline = pipelines['fare_amount']
+        self.duration_pipeline = pipelines['trip_duration']
+        logger.info(f"Loaded pipelines for {', '.join(pipelines)}")
+        # A reload keeps the booster threads of the engine it replaces, which may still
+        # be scoring a batch on the scorer thread
+        previous = getattr(self, 'engine', None)
+        # The engine carries its version: a batch takes both from one read of self.engine
+        self.engine = InferenceEngine(pipelines, self._build_features, compiled=COMPILED_ENCODER,
+                                      executor=previous.executor if previous is not None else None,
+                                      version=version_id)
+        self.model_version = version
+        self.cache.invalidate(version_id)
+        logger.info(f"Model version {version_id}")
+
+    @property
+    def model_version_id(self) -> str:
+        """Content hash of the loaded model artifacts, published for the API and tagged on replies."""
+        return self.engine.version
+
+    def _artifact_digest(self) -> str:
+        """Short content hash of the model artifacts, the same on every host that has the same files."""
+        digest = hashlib.sha1()
+        for path in MODEL_ARTIFACTS.values():
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()[:12]
+
+    def _publish_model_version(self):
+        """Advertise the loaded model version to the API."""
+        self.redis_client.set(MODEL_VERSION_KEY, self.model_version_id)
+
+    def _check_artifacts(self):
+        """Reload the models if an artifact changed on disk, keeping the current ones if that fails."""
+        try:
+            if self._artifact_version() == self.model_version:
+                return
+            logger.info("Model artifacts changed, reloading")
+            self._load_models()
+            if self.threads is not None:
+                self.engine.set_threads(self.threads)
+            if self.redis_client is not None:
+                self._publish_model_version()
+        except redis.RedisError:
+            raise
+        except Exception as e:
+            # A half-written artifact fails to load; the next heartbeat tries again
+            logger.info(f"Could not reload models: {str(e)}")
+
+    def configure_worker(self, n_threads: int, slot: int = 0, workers: int = 1):
+        """
+        Prepare a forked worker process: cap model threads, take its share of the
+        shards and drop any inherited connection.
+        """
+        self.threads = n_threads
+        self.engine.set_threads(n_threads)
+        self.shards = assigned_shards(len(self.endpoints), slot, workers)
+        self.transports = {shard: create_transport(lanes=self.lanes) for shard in self.shards}
+        self.redis_client = None
+        self.shard_clients = {}
+
+    def _redis(self, shard: int) -> redis.Redis:
+        host, port = self.endpoints[shard]
+        return redis.Redis(
+            host=host,
+            port=port,
+            db=0,
+            socket_timeout=5,
+            decode_responses=True,  # Automatically decode responses to str
+            encoding_errors='surrogateescape'  # binary messages survive the round trip through str
+        )
+
     def _connect_redis(self, max_retries: int = 5, retry_delay: int = 5):
         """Establish Redis connection with retry logic."""
         logger.info("Connecting to Redis")
         for attempt in range(max_retries):
             try:
-                self.redis_client = redis.Redis(
-                    host=self.redis_host,
-                    port=self.redis_port,
-                    db=0,
-                    socket_timeout=5,
-                    decode_responses=True  # Automatically decode responses to str
-                )
+                self.redis_client = self._redis(0)
                 # Test the connection
                 self.redis_client.ping()
+                self.shard_clients = {shard: self.redis_client if shard == 0 else self._redis(shard)
+                                      for shard in self.shards}
+                for shard, client in self.shard_clients.items():
+                    client.ping()
+                    self.transports[shard].setup(client)
+                self._publish_model_version()
                 logger.info(f"Successfully connected to Redis at {self.redis_host}:{self.redis_port}")
+                if len(self.endpoints) > 1:
+                    logger.info(f"Consuming from shards {', '.join(self._shard_names())}")
                 return
             except redis.ConnectionError as e:
+                self._close_redis()
                 if attempt == max_retries - 1:
                     raise Exception(f"Could not connect to Redis after {max_retries} attempts: {str(e)}")
                 logger.info(f"Failed to connect to Redis (attempt {attempt + 1}/{max_retries}). Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
 
-    def start_listening(self):
-        """Start listening for prediction requests on Redis."""        
-        self._connect_redis()
-        logger.info("Starting to listen for prediction requests...")
-        # Subscribe to the prediction request channel
-        killer = GracefulKiller()
-        
-        # Listen for messages
+    def _close_redis(self):
+        """
+        Disconnect every Redis client's connection pool. A closed client opens a new
+        connection if it is used again, so the clients stay usable if reconnecting fails.
+        """
+        for client in {self.redis_client, *self.shard_clients.values()} - {None}:
+            try:
+                client.close()
+            except Exception as e:
+                logger.info(f"Error closing Redis client: {str(e)}")
+
+    def _shard_names(self) -> List[str]:
+        return [f"{self.endpoints[shard][0]}:{self.endpoints[shard][1]}" for shard in self.shards]
+
+    def _receive_batch(self) -> Tuple[int, List[Message]]:
+        """
+        Receive up to batch_size requests from one shard, waiting at most batch_wait_ms
+        for the batch to fill. Returns the shard, whose connection the replies go back on.
+        """
+        if len(self.shards) == 1:
+            shard = self.shards[0]
+            return shard, self.transports[shard].receive(self.shard_clients[shard], self.batch_size,
+                                                         self.batch_wait_ms)
+        # Several shards: take the first one with requests waiting, starting after the
+        # last one served, and otherwise block briefly on the next one
+        for i in range(len(self.shards)):
+            shard = self.shards[(self._next_shard + i) % len(self.shards)]
+            messages = self.transports[shard].receive(self.shard_clients[shard], self.batch_size,
+                                                      self.batch_wait_ms, timeout=0)
+            if messages:
+                self._next_shard = (self._next_shard + i + 1) % len(self.shards)
+                return shard, messages
+        shard = self.shards[self._next_shard]
+        self._next_shard = (self._next_shard + 1) % len(self.shards)
+        return shard, self.transports[shard].receive(self.shard_clients[shard], self.batch_size,
+                                                     self.batch_wait_ms, timeout=SHARD_BLOCK_TIMEOUT)
+
+    def _parse_request(self, raw: str) -> Tuple[Dict[str, Any], int]:
+        """Decode a raw request message into prediction input data and its wire format version."""
+        data, version = decode_request(raw)
+        # Convert string datetime to datetime object (binary requests carry datetimes)
+        if isinstance(data.get('tpep_pickup_datetime'), str):
+            data['tpep_pickup_datetime'] = datetime.fromisoformat(data['tpep_pickup_datetime'])
+        return data, version
+
+    def _expired(self, deadline: Optional[float], now: float) -> bool:
+        """Whether a request's deadline (None for requests sent without one) has passed."""
+        return deadline is not None and now > float(deadline)
+
+    def _parse_trips(self, trips: List[Dict[str, Any]]) -> List[Union[Dict[str, Any], Exception]]:
+        """Prediction input data for each trip of a batch request, or the error that made it unreadable."""
+        parsed = []
+        for trip in trips:
+            try:
+                trip = dict(trip)
+                if isinstance(trip.get('tpep_pickup_datetime'), str):
+                    trip['tpep_pickup_datetime'] = datetime.fromisoformat(trip['tpep_pickup_datetime'])
+                parsed.append(trip)
+            except Exception as e:
+                parsed.append(e)
+        return parsed
+
+    def _prediction_fields(self, prediction: Union[TripPrediction, Exception], model_version: str) -> Dict[str, Any]:
+        """Response fields for one prediction, or its error."""
+        if isinstance(prediction, Exception):
+            return {'error': str(prediction)}
+        return {
+            'model_version': model_version,
+            'trip_duration': prediction.trip_duration,
+            'fare_amount': prediction.fare_amount,
+            'tolls_amount': prediction.tolls_amount,
+            'congestion_surcharge': prediction.congestion_surcharge,
+            'total_amount': prediction.total_amount
+        }
+
+    def _build_response(self, request_id: Optional[str],
+                        prediction: Union[TripPrediction, Exception, List[Union[TripPrediction, Exception]]],
+                        model_version: str) -> Dict[str, Any]:
+        """
+        Build the response payload for a request: one prediction, or a list for a batch
+        request, tagged with the version of the engine that scored it.
+        """
+        if isinstance(prediction, list):
+            return {
+                'request_id': request_id,
+                'predictions': [self._prediction_fields(item, model_version) for item in prediction]
+            }
+        return {'request_id': request_id, **self._prediction_fields(prediction, model_version)}
+
+    def _score_messages(self, messages: List[Message]) -> Tuple[List[Tuple[str, int, Union[str, bytes]]],
+                                                                List[Optional[Any]]]:
+        """
+        Score a batch of received requests into (reply_to, reply_ttl, payload) replies and ack tokens.
+
+        A batch request carries a 'trips' list instead of a single trip; its trips are
+        scored along with the other requests and answered in one reply, in order.
+        """
+        # Score the whole batch on one engine, which a reload may replace meanwhile
+        engine = self.engine
+        request_ids: List[Optional[str]] = []
+        reply_routes: List[Tuple[str, int, int]] = []  # (reply_to, reply_ttl, wire format version)
+        results: List[Any] = []  # per request: a prediction, an Exception, or a list of them
+        rows: List[Dict[str, Any]] = []
+        row_positions: List[Tuple[int, Optional[int]]] = []  # (request, trip within a batch request)
+        now = time.time()
+        expired = 0
+
+        for _, raw in messages:
+            request_id = None
+            reply_route = (DEFAULT_RESPONSE_KEY, RESPONSE_TTL, WIRE_JSON)
+            try:
+                data, version = self._parse_request(raw)
+                request_id = data.pop('request_id', None)
+                reply_route = (data.pop('reply_to', DEFAULT_RESPONSE_KEY),
+                               int(data.pop('reply_ttl', RESPONSE_TTL)), version)
+                if self._expired(data.pop('deadline', None), now):
+                    # Nobody is waiting for this reply anymore; it is still acked
+                    expired += 1
+                    continue
+                if 'trips' in data:
+                    if not isinstance(data['trips'], list):
+                        raise ValueError("'trips' must be a list")
+                    trips = self._parse_trips(data['trips'])
+                    for i, trip in enumerate(trips):
+                        if not isinstance(trip, Exception):
+                            row_positions.append((len(results), i))
+                            rows.append(trip)
+                    results.append(trips)
+                else:
+                    row_positions.append((len(results), None))
+                    rows.append(data)
+                    results.append(None)
+            except Exception as e:
+                logger.info(f"Error decoding request {request_id}: {str(e)}")
+                results.append(e)
+            request_ids.append(request_id)
+            reply_routes.append(reply_route)
+
+        if expired:
+            self.requests_expired += expired
+            logger.info(f"Dropped {expired} expired requests")
+
+        for (position, item), prediction in zip(row_positions, self.predict_batch(rows, engine)):
+            if item is None:
+                results[position] = prediction
+            else:
+                results[position][item] = prediction
+
+        replies = []
+        for request_id, (reply_to, reply_ttl, version), result in zip(request_ids, reply_routes, results):
+            if isinstance(result, Exception):
+                logger.info(f"Error processing request {request_id}: {str(result)}")
+            replies.append((reply_to, reply_ttl,
+                            encode_reply(self._build_response(request_id, result, engine.version), version)))
+        return replies, [token for token, _ in messages]
+
+    def handle_request(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Response payload for one decoded request, scored in this process.
+
+        The co-located API mode calls this instead of going through Redis; the payload
+        is the same one a worker would send back for the request.
+        """
+        data = dict(data)
+        request_id = data.pop('request_id', None)
+        engine = self.engine
+        if self._expired(data.pop('deadline', None), time.time()):
+            self.requests_expired += 1
+            return {'request_id': request_id, 'error': REQUEST_EXPIRED}
+        try:
+            if 'trips' in data:
+                if not isinstance(data['trips'], list):
+                    raise ValueError("'trips' must be a list")
+                trips = self._parse_trips(data['trips'])
+                scored = iter(self.predict_batch([trip for trip in trips if not isinstance(trip, Exception)], engine))
+                result = [trip if isinstance(trip, Exception) else next(scored) for trip in trips]
+            else:
+                if isinstance(data.get('tpep_pickup_datetime'), str):
+                    data['tpep_pickup_datetime'] = datetime.fromisoformat(data['tpep_pickup_datetime'])
+                result = self.predict_batch([data], engine)[0]
+        except Exception as e:
+            result = e
+        if isinstance(result, Exception):
+            logger.info(f"Error processing request {request_id}: {str(result)}")
+        return self._build_response(request_id, result, engine.version)
+
+    def _send_responses(self, shard: int, replies: List[Tuple[str, int, Union[str, bytes]]],
+                        tokens: List[Optional[Any]]):
+        """Push every reply and ack the batch in a single round-trip to the shard it came from."""
+        pipe = self.shard_clients[shard].pipeline(transaction=False)
+        for reply_to, reply_ttl, payload in replies:
+            pipe.lpush(reply_to, payload)
+            pipe.expire(reply_to, reply_ttl)
+        self.transports[shard].ack(pipe, tokens)
+        pipe.execute()
+        logger.info(f"Sent {len(replies)} responses")
+
+    def _process_batch(self, shard: int, messages: List[Message]):
+        """Score a batch of received requests, push one response per request, then ack the batch."""
+        self._send_responses(shard, *self._score_messages(messages))
+
+    def _heartbeat(self):
+        """Refresh this worker's liveness key when the interval has passed."""
+        now = time.monotonic()
+        if now < self._next_heartbeat:
+            return
+        self._next_heartbeat = now + HEARTBEAT_INTERVAL
+        self._check_artifacts()
+        status = {
+            'pid': os.getpid(),
+            'transport': type(self.transports[self.shards[0]]).__name__,
+            'shards': self._shard_names(),
+            'requests_served': self.requests_served,
+            'requests_expired': self.requests_expired,
+            'lanes': self.lanes.stats(),
+            'cache': self.cache.stats(),
+            'timestamp': time.time()
+        }
+        self.redis_client.set(self.heartbeat_key, json.dumps(status), px=int(HEARTBEAT_INTERVAL * 3000))
+
+    def _reconnect(self, error: Exception, killer: GracefulKiller):
+        """Log a Redis error and try to reconnect, backing off if that fails too."""
+        logger.info(f"Redis error: {str(error)}")
+        # Release the old connections before opening new ones
+        self._close_redis()
+        try:
+            self._connect_redis()
+        except Exception as e:
+            logger.info(f"Failed to reconnect to Redis: {str(e)}")
+            if not killer.kill_now:
+                time.sleep(5)  # Wait before retrying
+
+    def _listen_sequential(self, killer: GracefulKiller):
+        """Receive, score and respond to one batch at a time on this thread."""
         while not killer.kill_now:
             try:
-                # This is more reliable across Redis versions and network conditions
-                message = self.redis_client.brpop('prediction_requests', timeout=1)
-                
-                if message is None:
-                    logger.info("ping")
-                    time.sleep(2)
+                self._heartbeat()
+                # Blocks on the queue for at most a second, so heartbeats and shutdown stay
+                # timely without ever sleeping while a request could be waiting
+                shard, messages = self._receive_batch()
+                if not messages:
                     continue
-                
-                _, data = message  # brpop returns (key, value)
-                
-                try:
-                    # Parse the message data
-                    data = json.loads(data)
-                    request_id = data.pop('request_id', None)
-                    logger.info(f"Received request {request_id}: {data}")
-                    
-                    # Convert string datetime to datetime object
-                    if 'tpep_pickup_datetime' in data:
-                        data['tpep_pickup_datetime'] = datetime.fromisoformat(data['tpep_pickup_datetime'])
-                    
-                    # Make prediction
-                    prediction = self.predict(data)
-
-                    logger.info(f"Prediction: {prediction.model_dump()}")
-                    
-                    # Prepare response
-                    response = {
-                        'request_id': request_id,
-                        'trip_duration': prediction.trip_duration,
-                        'fare_amount': prediction.fare_amount,
-                        'tolls_amount': prediction.tolls_amount,
-                        'congestion_surcharge': prediction.congestion_surcharge,
-                        'total_amount': prediction.total_amount
-                    }
-                    
-                    # Push response to a list instead of using pub/sub
-                    self.redis_client.lpush('prediction_responses', json.dumps(response))
-                    logger.info(f"Sent response for request {request_id}")
-                
-                except Exception as e:
-                    error_response = {
-                        'request_id': request_id,
-                        'error': str(e)
-                    }
-                    self.redis_client.lpush('prediction_responses', json.dumps(error_response))
-                    logger.info(f"Error processing request {request_id}: {str(e)}")
-                        
+
+                logger.info(f"Received batch of {len(messages)} requests")
+                self._process_batch(shard, messages)
+                self.requests_served += len(messages)
+
             except redis.RedisError as e:
-                logger.info(f"Redis error: {str(e)}")
-                # Try to reconnect
+                self._reconnect(e, killer)
+
+    def _listen_pipelined(self, killer: GracefulKiller):
+        """
+        Overlap Redis I/O with scoring: this thread keeps receiving batches, a scorer
+        thread scores them, and a writer thread sends each batch's responses.
+        Bounded queues keep at most pipeline_depth batches waiting per stage.
+        Receiving stays on the main thread so it sees shutdown signals promptly;
+        on shutdown the batches already received drain through the other stages.
+        """
+        received: queue.Queue = queue.Queue(maxsize=self.pipeline_depth)
+        scored: queue.Queue = queue.Queue(maxsize=self.pipeline_depth)
+
+        def score_loop():
+            while True:
+                batch = received.get()
+                if batch is None:
+                    break
+                shard, messages = batch
+                logger.info(f"Received batch of {len(messages)} requests")
                 try:
-                    self._connect_redis()
+                    scored.put((shard, *self._score_messages(messages)))
                 except Exception as e:
-                    logger.info(f"Failed to reconnect to Redis: {str(e)}")
-                    if killer.kill_now:
-                        break
-                    time.sleep(5)  # Wait before retrying
-                    
+                    logger.info(f"Error scoring batch: {str(e)}")
+                self.requests_served += len(messages)
+            scored.put(None)
+
+        def write_loop():
+            while True:
+                batch = scored.get()
+                if batch is None:
+                    return
+                try:
+                    self._send_responses(*batch)
+                except redis.RedisError as e:
+                    # Unacked stream entries are redelivered; list requests time out at the API
+                    logger.info(f"Redis error while sending responses: {str(e)}")
+
+        scorer = threading.Thread(target=score_loop, name='scorer', daemon=True)
+        writer = threading.Thread(target=write_loop, name='writer', daemon=True)
+        scorer.start()
+        writer.start()
+        try:
+            while not killer.kill_now:
+                try:
+                    self._heartbeat()
+                    shard, messages = self._receive_batch()
+                    if messages:
+                        received.put((shard, messages))
+                except redis.RedisError as e:
+                    self._reconnect(e, killer)
+        finally:
+            received.put(None)
+            scorer.join()
+            writer.join()
+
+    def start_listening(self):
+        """Start listening for prediction requests on Redis."""
+        self._connect_redis()
+        self.heartbeat_key = f"{HEARTBEAT_KEY_PREFIX}{socket.gethostname()}-{os.getpid()}"
+        logger.info(f"Starting to listen for prediction requests on {type(self.transports[self.shards[0]]).__name__} "
+                    f"(batch_size={self.batch_size}, batch_wait_ms={self.batch_wait_ms}, "
+                    f"pipeline_depth={self.pipeline_depth})...")
+        killer = GracefulKiller()
+
+        if self.pipeline_depth > 0:
+            self._listen_pipelined(killer)
+        else:
+            self._listen_sequential(killer)
+
         logger.info("Shutting down gracefully...")
-        self.redis_client.close()
-    
+        for shard, client in self.shard_clients.items():
+            self.transports[shard].close(client)
+        try:
+            self.redis_client.delete(self.heartbeat_key)
+        except redis.RedisError:
+            pass
+        self._close_redis()
 
     def _enrich_location_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Add borough, service zone, and zone information based on location IDs."""
-        # Get pickup location info
-        pu_info = self.taxi_zones[self.taxi_zones['LocationID'] == data['PULocationID']].iloc[0]
-        do_info = self.taxi_zones[self.taxi_zones['LocationID'] == data['DOLocationID']].iloc[0]
-        
-        logger.debug(f"Pickup zone info: {pu_info}")
-        logger.debug(f"Dropoff zone info: {do_info}")
-        
-        # Handle potential NaN values with defaults
+        borough_pu, service_zone_pu, zone_pu = self.zone_table.lookup(data['PULocationID'])
+        borough_do, service_zone_do, zone_do = self.zone_table.lookup(data['DOLocationID'])
+
+        # Zone fields are already NaN-free; only the raw request values need the check
         enriched_data = {
-            **data,  # Original data
-            'Borough_pu': pu_info.get('Borough', 'Unknown'),
-            'Borough_do': do_info.get('Borough', 'Unknown'),
-            'service_zone_pu': pu_info.get('service_zone', 'Unknown'),
-            'service_zone_do': do_info.get('service_zone', 'Unknown'),
-            'Zone_pu': pu_info.get('Zone', 'Unknown'),
-            'Zone_do': do_info.get('Zone', 'Unknown')
+            key: 'Unknown' if isinstance(value, float) and value != value else value
+            for key, value in data.items()
         }
-        logger.debug(f"pre NA filter data: {enriched_data}")
-        # Replace any NaN values with 'Unknown'
-        for key, value in enriched_data.items():
-            if pd.isna(value):
-                enriched_data[key] = 'Unknown'
-        
-        logger.info(f"Enriched data: {enriched_data}")
+        enriched_data.update({
+            'Borough_pu': borough_pu,
+            'Borough_do': borough_do,
+            'service_zone_pu': service_zone_pu,
+            'service_zone_do': service_zone_do,
+            'Zone_pu': zone_pu,
+            'Zone_do': zone_do
+        })
+        logger.debug(f"Enriched data: {enriched_data}")
         return enriched_data
     
-    def predict(self, data: Dict[str, Any]) -> TripPrediction:
-        """Make predictions and return validated TripPrediction."""
-        logger.info("predicting")
+    def _build_features(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """Enrich and validate a single request, returning its feature row and column order."""
         enriched_data = self._enrich_location_data(data)
-        logger.info(f"enriched data: {enriched_data}")
         # Validate enriched data using Pydantic model
         validated_data = TripData(**enriched_data)
-        logger.info(f"validated data, {validated_data}")
-        
-        # Convert validated data to DataFrame using the model's dump method
-        df_data, features = validated_data.model_dump_features()
-        logger.info(f"Features: {features}")
-        logger.info(f"df_data: {df_data}")
-        self.df = pd.DataFrame([df_data], columns=features)
-        logger.info(f"df, {self.df.head()}")
-        
-        logger.info(f"predicting on: \n{self.df.iloc[0]}")
-            
-        fare = float(self.fare_pipeline.predict(self.df)[0])
-        duration = float(self.duration_pipeline.predict(self.df)[0])
-        tolls_amount = 0
-        congestion_surcharge = 0
-        total = fare + tolls_amount + congestion_surcharge
-
-        logger.info(f"Prediction: {TripPrediction(fare_amount=fare, trip_duration=duration, tolls_amount=tolls_amount, congestion_surcharge=congestion_surcharge, total_amount=total)}")
-        
-        return TripPrediction(
-            fare_amount=fare,
-            trip_duration=duration,
-            tolls_amount=tolls_amount,
-            congestion_surcharge=congestion_surcharge,
-            total_amount=total
+        logger.debug(f"validated data, {validated_data}")
+        return validated_data.model_dump_features()
+
+    def _to_predictions(self, fares, durations) -> List[Union[TripPrediction, Exception]]:
+        """Wrap raw model outputs in TripPredictions, keeping per-row validation errors."""
+        predictions = []
+        for fare, duration in zip(fares, durations):
+            try:
+                fare = float(fare)
+                tolls_amount = 0
+                congestion_surcharge = 0
+                total = fare + tolls_amount + congestion_surcharge
+                predictions.append(TripPrediction(
+                    fare_amount=fare,
+                    trip_duration=float(duration),
+                    tolls_amount=tolls_amount,
+                    congestion_surcharge=congestion_surcharge,
+                    total_amount=total
+                ))
+            except Exception as e:
+                predictions.append(e)
+        return predictions
+
+    def _score(self, df: pd.DataFrame, engine: InferenceEngine) -> List[Union[TripPrediction, Exception]]:
+        """Run both pipelines once over a feature DataFrame."""
+        outputs = engine.predict_frame(df)
+        return self._to_predictions(outputs['fare_amount'], outputs['trip_duration'])
+
+    def _compiled_inputs(self, data: Dict[str, Any],
+                         engine: InferenceEngine) -> Optional[Tuple[int, int, int, int, int, float]]:
+        """
+        Encoder inputs for a request the compiled encoder handles exactly like the
+        pipeline path, or None if the request needs full enrichment and validation.
+        """
+        pu, do = data.get('PULocationID'), data.get('DOLocationID')
+        flag = data.get('store_and_fwd_flag')
+        distance = data.get('trip_distance')
+        pickup = data.get('tpep_pickup_datetime')
+        valid = engine.valid_location
+        if not (type(pu) is int and 0 <= pu < len(valid) and valid[pu]):
+            return None
+        if not (type(do) is int and 0 <= do < len(valid) and valid[do]):
+            return None
+        if flag not in FLAGS or type(flag) is not str:
+            return None
+        if type(distance) not in (int, float) or not 0 <= distance < MAX_TRIP_DISTANCE:
+            return None
+        if not isinstance(pickup, datetime):
+            return None
+        return pu, do, FLAGS.index(flag), pickup.hour, pickup.weekday(), distance
+
+    def _predict_compiled(self, inputs: List[Tuple[int, int, int, int, int, float]],
+                          engine: InferenceEngine) -> List[Union[TripPrediction, Exception]]:
+        """Score pre-validated requests through the compiled encoders."""
+        pu, do, flags, hours, dows, distances = (np.array(column) for column in zip(*inputs))
+        outputs = engine.predict_compiled(pu, do, flags, hours, dows, distances)
+        return self._to_predictions(outputs['fare_amount'], outputs['trip_duration'])
+
+    def _predict_pipeline(self, rows: List[Dict[str, Any]],
+                          engine: InferenceEngine) -> List[Union[TripPrediction, Exception]]:
+        """Enrich, validate and score requests through the DataFrame pipelines."""
+        results: List[Union[TripPrediction, Exception, None]] = [None] * len(rows)
+        feature_rows = []
+        positions = []
+        features = None
+        for i, data in enumerate(rows):
+            try:
+                df_data, features = self._build_features(data)
+                feature_rows.append(df_data)
+                positions.append(i)
+            except Exception as e:
+                results[i] = e
+
+        if feature_rows:
+            df = pd.DataFrame(feature_rows, columns=features)
+            logger.info(f"predicting on {len(df)} rows")
+            try:
+                predictions = self._score(df, engine)
+            except Exception as e:
+                # Fall back to row-by-row scoring to isolate the failing rows
+                logger.info(f"Batch scoring failed ({str(e)}), scoring rows individually")
+                predictions = []
+                for j in range(len(df)):
+                    try:
+                        predictions.append(self._score(df.iloc[[j]], engine)[0])
+                    except Exception as row_error:
+                        predictions.append(row_error)
+            for i, prediction in zip(positions, predictions):
+                results[i] = prediction
+
+        return results
+
+    def _predict_rows(self, rows: List[Dict[str, Any]],
+                      engine: InferenceEngine) -> List[Union[TripPrediction, Exception]]:
+        """Score requests on the compiled path where possible and through the pipelines otherwise."""
+        results: List[Union[TripPrediction, Exception, None]] = [None] * len(rows)
+        compiled_positions, compiled_inputs = [], []
+        pipeline_positions, pipeline_rows = [], []
+        for i, data in enumerate(rows):
+            inputs = self._compiled_inputs(data, engine) if engine.compiled else None
+            if inputs is None:
+                pipeline_positions.append(i)
+                pipeline_rows.append(data)
+            else:
+                compiled_positions.append(i)
+                compiled_inputs.append(inputs)
+
+        if compiled_inputs:
+            try:
+                predictions = self._predict_compiled(compiled_inputs, engine)
+            except Exception as e:
+                logger.info(f"Compiled scoring failed ({str(e)}), using the pipelines")
+                predictions = self._predict_pipeline([rows[i] for i in compiled_positions], engine)
+            for i, prediction in zip(compiled_positions, predictions):
+                results[i] = prediction
+
+        if pipeline_rows:
+            for i, prediction in zip(pipeline_positions, self._predict_pipeline(pipeline_rows, engine)):
+                results[i] = prediction
+
+        return results
+
+    def predict_batch(self, rows: List[Dict[str, Any]],
+                      engine: Optional[InferenceEngine] = None) -> List[Union[TripPrediction, Exception]]:
+        """
+        Make predictions for a batch of requests with one vectorized call per pipeline.
+
+        Returns one entry per input row, in order: either a TripPrediction or the
+        Exception that made that row fail. A bad row never fails the rest of the batch.
+        Rows with the same feature key are scored once, and rows whose key is in the
+        prediction cache are not scored at all. Scores on engine (default: the current
+        one), and only uses cached predictions made by the same model version.
+        """
+        engine = engine or self.engine
+        version = engine.version
+        results: List[Union[TripPrediction, Exception, None]] = [None] * len(rows)
+        misses: Dict[FeatureKey, List[int]] = {}
+        unkeyed: List[int] = []
+        for i, data in enumerate(rows):
+            key = self.cache.key(data)
+            if key is None:
+                unkeyed.append(i)
+            elif key in misses:
+                misses[key].append(i)
+            else:
+                cached = self.cache.get(key, version)
+                if cached is None:
+                    misses[key] = [i]
+                else:
+                    results[i] = cached
+
+        # Score one row per key, with the distance the key was made from
+        scored = self._predict_rows(
+            [dict(rows[positions[0]], trip_distance=key[-1]) for key, positions in misses.items()]
+            + [rows[i] for i in unkeyed],
+            engine
         )
+        for (key, positions), prediction in zip(misses.items(), scored):
+            if not isinstance(prediction, Exception):
+                self.cache.put(key, prediction, version)
+            for i in positions:
+                results[i] = prediction
+        for i, prediction in zip(unkeyed, scored[len(misses):]):
+            results[i] = prediction
+
+        return results
 
+    def predict(self, data: Dict[str, Any]) -> TripPrediction:
+        """Make predictions and return validated TripPrediction."""
+        logger.info("predicting")
+        prediction = self.predict_batch([data])[0]
+        if isinstance(prediction, Exception):
+            raise prediction
+        logger.info(f"Prediction: {prediction}")
+        return prediction
 
 def main(local: bool = False):
     try:
         predictor = Predictor(local=local)
-        predictor.start_listening()
+        if WORKERS > 1:
+            WorkerSupervisor(predictor, WORKERS).run()
+        else:
+            predictor.start_listening()
     except Exception as e:
         print(f"Error in main: {str(e)}")
         sys.exit(1)
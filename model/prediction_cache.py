@@ -0,0 +1,117 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Most recent predictions kept per worker; 0 disables the cache (identical rows in
+# a batch are still scored once).
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', 50000))
+# Seconds a cached prediction stays valid
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', 300))
+# Opt-in: trip distances are rounded down to a multiple of this many miles before
+# keying and scoring, trading accuracy for hit rate. 0 (the default) keys and
+# scores the exact distance, as QUOTE_CACHE_DISTANCE_RESOLUTION does on the API.
+PREDICTION_CACHE_DISTANCE_RESOLUTION = float(os.getenv('PREDICTION_CACHE_DISTANCE_RESOLUTION', 0))
+
+# (PULocationID, DOLocationID, store_and_fwd_flag, hour, weekday, trip_distance)
+FeatureKey = Tuple[int, int, str, int, int, float]
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions keyed on the model's view of a request.
+
+    The models only see the zone pair, flag, pickup hour and weekday, and the trip
+    distance, so requests that agree on those get the same prediction whatever
+    their exact pickup time. Entries expire after ttl seconds and are tagged with
+    the model version: invalidate() with a new version drops them all, and callers
+    still scoring with an older version neither read nor store entries. Safe to
+    share between threads.
+    """
+
+    def __init__(self, max_size: int = PREDICTION_CACHE_SIZE, ttl: float = PREDICTION_CACHE_TTL,
+                 distance_resolution: float = PREDICTION_CACHE_DISTANCE_RESOLUTION):
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+        self.distance_resolution = distance_resolution
+        self.version: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[FeatureKey, Tuple[float, Any]]' = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def key(self, data: Dict[str, Any]) -> Optional[FeatureKey]:
+        """Canonical feature key for a request, or None if its fields are not of the expected types."""
+        pu, do = data.get('PULocationID'), data.get('DOLocationID')
+        flag = data.get('store_and_fwd_flag')
+        distance = data.get('trip_distance')
+        pickup = data.get('tpep_pickup_datetime')
+        if type(pu) is not int or type(do) is not int or type(flag) is not str:
+            return None
+        if type(distance) not in (int, float) or not math.isfinite(distance):
+            return None
+        if not isinstance(pickup, datetime):
+            return None
+        if self.enabled and self.distance_resolution > 0:
+            # Round down (the epsilon absorbs float error such as 0.29 / 0.01 = 28.999...),
+            # so a distance under a validation bound stays under it
+            steps = math.floor(distance / self.distance_resolution + 1e-9)
+            distance = round(steps * self.distance_resolution, 9)
+        return pu, do, flag, pickup.hour, pickup.weekday(), float(distance)
+
+    def get(self, key: FeatureKey, version: Optional[Hashable] = None) -> Optional[Any]:
+        """
+        Cached value for key, or None on a miss, an expired entry, or a caller scoring
+        with a model version other than the current one.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = None if version != self.version else self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: FeatureKey, value: Any, version: Optional[Hashable] = None):
+        """Store value, unless it was computed under a model version other than the current one."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version: Optional[Hashable] = None):
+        """Drop every entry and start caching for the given model version."""
+        with self._lock:
+            self._entries.clear()
+            self.version = version
+
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters, for heartbeats and logs."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,129 @@
+import gc
+import os
+import signal
+import time
+from typing import Dict
+from logger import logger
+
+# Number of worker processes consuming prediction requests. 1 keeps the classic
+# single-process worker; more than 1 runs them under a WorkerSupervisor.
+WORKERS = int(os.getenv('WORKERS', 1))
+# XGBoost threads per worker; one worker per core should not oversubscribe the CPU
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 1))
+# Seconds a worker gets to finish its in-flight batch after SIGTERM before SIGKILL
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 10))
+# Minimum seconds between restarts of the same worker slot, so a crash loop does not spin
+RESTART_BACKOFF = float(os.getenv('RESTART_BACKOFF', 1))
+
+
+class WorkerSupervisor:
+    """
+    Pre-fork process pool around one fully loaded Predictor.
+
+    The parent loads the zone table, pipelines and compiled encoders once, then
+    forks the workers, so the model memory is shared copy-on-write. Each worker
+    runs its own Redis connections and consumer loop over its share of the
+    Redis shards. The parent restarts workers that die and, on SIGTERM/SIGINT,
+    forwards the signal so every worker drains its in-flight batch before
+    exiting.
+    """
+
+    def __init__(self, predictor, workers: int = WORKERS, worker_threads: int = WORKER_THREADS):
+        self.predictor = predictor
+        self.workers = max(1, workers)
+        self.worker_threads = max(1, worker_threads)
+        self.children: Dict[int, int] = {}  # pid -> worker slot
+        self.started_at: Dict[int, float] = {}  # worker slot -> last start time
+        self.shutting_down = False
+
+    def _exit_gracefully(self, *args):
+        self.shutting_down = True
+
+    def _run_worker(self, slot: int):
+        """Body of a forked worker process; never returns."""
+        # The supervisor forwards shutdown as SIGTERM; ignore the terminal's SIGINT to the
+        # whole process group until the consumer loop installs its own handlers.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        code = 0
+        try:
+            self.predictor.configure_worker(self.worker_threads, slot, self.workers)
+            logger.info(f"Worker {slot} started (pid {os.getpid()})")
+            self.predictor.start_listening()
+        except Exception as e:
+            logger.info(f"Worker {slot} failed: {str(e)}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _spawn(self, slot: int):
+        """Fork a worker for the given slot, backing off if the slot restarts too quickly."""
+        wait = self.started_at.get(slot, 0) + RESTART_BACKOFF - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.started_at[slot] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+        self.children[pid] = slot
+
+    def _reap(self, block: bool = False):
+        """Collect exited workers, returning (slot, status) pairs; block waits for all of them."""
+        exited = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid == 0:
+                break
+            slot = self.children.pop(pid, None)
+            if slot is not None:
+                exited.append((slot, status))
+        return exited
+
+    def _shutdown(self):
+        """Forward SIGTERM to every worker and wait for them to drain, killing stragglers."""
+        logger.info(f"Stopping {len(self.children)} workers")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.children):
+            logger.info(f"Worker {self.children[pid]} did not stop in {SHUTDOWN_TIMEOUT}s, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._reap(block=True)
+
+    def run(self):
+        """Fork the workers and supervise them until SIGTERM/SIGINT."""
+        # Move everything loaded so far out of the GC's reach, so collections in the
+        # workers do not write to (and un-share) the pages holding the models.
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGINT, self._exit_gracefully)
+        signal.signal(signal.SIGTERM, self._exit_gracefully)
+
+        logger.info(f"Starting {self.workers} workers")
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while not self.shutting_down:
+            for slot, status in self._reap():
+                if self.shutting_down:
+                    break
+                logger.info(f"Worker {slot} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+                self._spawn(slot)
+            time.sleep(0.2)
+
+        self._shutdown()
+        logger.info("All workers stopped")
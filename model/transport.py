@@ -0,0 +1,362 @@
+import math
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import redis
+from logger import logger
+
+# 'list' (default): LPUSH/BRPOP on a plain list. A request popped by a worker that
+# then dies is lost. 'stream': a Redis Stream read through a consumer group, acked
+# only once the response is written, so requests held by dead workers are reclaimed.
+REQUEST_TRANSPORT = os.getenv('REQUEST_TRANSPORT', 'list')
+# Names of the request list and stream; must match the API. Benchmarks that start
+# workers point them at scratch keys so they never touch live requests.
+REQUEST_QUEUE = os.getenv('REQUEST_QUEUE', 'prediction_requests')
+REQUEST_STREAM = os.getenv('REQUEST_STREAM', 'prediction_stream')
+STREAM_GROUP = os.getenv('STREAM_GROUP', 'predictors')
+# Entries pending longer than this are assumed to belong to a dead worker and are reclaimed
+STREAM_CLAIM_IDLE_MS = int(os.getenv('STREAM_CLAIM_IDLE_MS', 30000))
+# How often a worker looks for stale entries to reclaim
+STREAM_CLAIM_INTERVAL = float(os.getenv('STREAM_CLAIM_INTERVAL', 5))
+# Entries delivered this many times without being acked are moved to the dead-letter stream
+STREAM_MAX_DELIVERIES = int(os.getenv('STREAM_MAX_DELIVERIES', 5))
+# Producers cap the stream at about this many entries, trimming the oldest first
+STREAM_MAXLEN = int(os.getenv('STREAM_MAXLEN', 100000))
+# Poison entries go to '<stream>:dead', capped at this many entries
+STREAM_DEAD_LETTER_MAXLEN = 10000
+
+# Priority lanes: interactive requests use the queue or stream above, bulk ones
+# (batch repricing, file scoring) '<name>:bulk'. Each batch a worker takes comes from
+# one lane. The interactive lane goes first, but while bulk requests are waiting at
+# least BULK_MIN_SHARE of batches are bulk ones, so bulk never starves. Bulk batches
+# hold at most BULK_BATCH_SIZE requests, which bounds how long an interactive
+# request can wait behind one; a bulk request is usually a whole batch call or file
+# chunk already, so by default they are scored one at a time.
+LANES = ('interactive', 'bulk')
+BULK_MIN_SHARE = float(os.getenv('BULK_MIN_SHARE', 0.1))
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 1))
+
+# Redis endpoints the request queues are spread over, as 'host:port,host:port'. The
+# API sends each request to one of them by consistent hashing on its request_id;
+# replies go back through the same endpoint. Model version and heartbeat keys stay
+# on the first. Unset, the only endpoint is REDIS_HOST:REDIS_PORT.
+REDIS_SHARDS = os.getenv('REDIS_SHARDS', '')
+# Comma-separated indexes into REDIS_SHARDS this host's workers consume from. Unset,
+# they take all of them, split between the worker processes.
+WORKER_SHARDS = os.getenv('WORKER_SHARDS', '')
+# A worker with several shards checks each without blocking, and when all are empty
+# blocks on them in turn for at most this many seconds each.
+SHARD_BLOCK_TIMEOUT = float(os.getenv('SHARD_BLOCK_TIMEOUT', 0.1))
+
+# Redis checks the timeouts of blocking reads only on its server tick (every 100 ms
+# at the default hz 10), so a BRPOP/XREADGROUP with a few-millisecond timeout can
+# overshoot the batch wait many times over. Partial batches poll at this interval.
+BATCH_POLL_INTERVAL = 0.001
+
+# A received request: (transport token to ack it with, raw JSON message)
+Message = Tuple[Optional[Any], Optional[str]]
+
+
+def lane_key(name: str, lane: str) -> str:
+    """Queue or stream name for a lane."""
+    return name if lane == 'interactive' else f"{name}:{lane}"
+
+
+def redis_endpoints(shards: str = REDIS_SHARDS, host: str = os.getenv('REDIS_HOST', 'localhost'),
+                    port: int = int(os.getenv('REDIS_PORT', 6379))) -> List[Tuple[str, int]]:
+    """(host, port) of every Redis shard, in REDIS_SHARDS order."""
+    if not shards.strip():
+        return [(host, port)]
+    endpoints = []
+    for endpoint in shards.split(','):
+        shard_host, _, shard_port = endpoint.strip().rpartition(':')
+        endpoints.append((shard_host or 'localhost', int(shard_port)))
+    return endpoints
+
+
+def assigned_shards(shards: int, slot: int = 0, workers: int = 1, explicit: str = WORKER_SHARDS) -> List[int]:
+    """
+    Shards worker slot of workers consumes from: the WORKER_SHARDS subset (or all
+    shards) dealt out so every shard has a worker and every worker a shard.
+    """
+    pool = [int(index) for index in explicit.split(',') if index.strip()] if explicit.strip() else list(range(shards))
+    if workers >= len(pool):
+        return [pool[slot % len(pool)]]
+    return [index for i, index in enumerate(pool) if i % workers == slot]
+
+
+class LaneScheduler:
+    """Picks the lane of each batch and counts the requests served per lane."""
+
+    def __init__(self, bulk_min_share: float = BULK_MIN_SHARE, bulk_batch_size: int = BULK_BATCH_SIZE):
+        # Interactive batches in a row before bulk gets a turn; None never gives it one
+        self.interactive_per_bulk = math.ceil(1 / bulk_min_share) - 1 if bulk_min_share > 0 else None
+        self.bulk_batch_size = max(1, bulk_batch_size)
+        self.served = {lane: 0 for lane in LANES}
+        self._since_bulk = 0
+
+    def bulk_turn(self) -> bool:
+        """Whether the next batch should be a bulk one, if bulk requests are waiting."""
+        return self.interactive_per_bulk is not None and self._since_bulk >= self.interactive_per_bulk
+
+    def skip_bulk(self):
+        """Bulk had its turn but nothing waiting; try again after another round."""
+        self._since_bulk = 0
+
+    def batch_size(self, lane: str, batch_size: int) -> int:
+        return min(batch_size, self.bulk_batch_size) if lane == 'bulk' else batch_size
+
+    def record(self, lane: str, requests: int):
+        self._since_bulk = 0 if lane == 'bulk' else self._since_bulk + 1
+        self.served[lane] += requests
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.served)
+
+
+class ListTransport:
+    """Requests on Redis lists, one per lane, pushed with LPUSH and popped with BRPOP."""
+
+    def __init__(self, queue: str = REQUEST_QUEUE, lanes: Optional[LaneScheduler] = None):
+        self.queues = {lane: lane_key(queue, lane) for lane in LANES}
+        self._lane_of = {key: lane for lane, key in self.queues.items()}
+        self.lanes = lanes or LaneScheduler()
+
+    def setup(self, client: redis.Redis):
+        pass
+
+    def receive(self, client: redis.Redis, batch_size: int, batch_wait_ms: int, timeout: float = 1) -> List[Message]:
+        """
+        Block up to timeout seconds (0: not at all) for one request, then drain up to
+        batch_size requests of the same lane or until batch_wait_ms elapses. A
+        request with nothing queued behind it is returned at once.
+        """
+        if self.lanes.bulk_turn():
+            queued = client.rpop(self.queues['bulk'], self.lanes.batch_size('bulk', batch_size))
+            if queued:
+                return self._fill(client, 'bulk', queued, batch_size, batch_wait_ms)
+            self.lanes.skip_bulk()
+
+        message = self._pop(client, timeout)
+        if message is None:
+            return []
+        return self._fill(client, self._lane_of[message[0]], [message[1]], batch_size, batch_wait_ms)
+
+    def _pop(self, client: redis.Redis, timeout: float) -> Optional[Tuple[str, str]]:
+        """(queue, request) of the first request waiting, interactive lane first."""
+        keys = [self.queues[lane] for lane in LANES]
+        if timeout > 0:
+            # BRPOP takes from the first non-empty list
+            return client.brpop(keys, timeout=timeout)
+        for key in keys:
+            raw = client.rpop(key)
+            if raw is not None:
+                return key, raw
+        return None
+
+    def _fill(self, client: redis.Redis, lane: str, batch: List[str], batch_size: int,
+              batch_wait_ms: int) -> List[Message]:
+        batch_size = self.lanes.batch_size(lane, batch_size)
+        deadline = time.monotonic() + batch_wait_ms / 1000
+        while len(batch) < batch_size:
+            # Grab whatever is already queued in a single round-trip
+            queued = client.rpop(self.queues[lane], batch_size - len(batch))
+            if queued:
+                batch.extend(queued)
+                continue
+            if len(batch) == 1:
+                # Idle: don't make a lone request wait for company
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, BATCH_POLL_INTERVAL))
+        self.lanes.record(lane, len(batch))
+        return [(None, raw) for raw in batch]
+
+    def ack(self, pipe, tokens: List[Optional[Any]]):
+        pass
+
+    def close(self, client: redis.Redis):
+        pass
+
+
+class StreamTransport:
+    """
+    Requests on Redis Streams, one per lane, read through a consumer group.
+
+    Every worker is a consumer named after its host and pid. Entries are acked in
+    the same pipeline that writes their responses, so a worker that dies mid-batch
+    leaves them pending. Other workers reclaim pending entries idle for longer than
+    claim_idle_ms, which gives at-least-once delivery; the API caps the stream
+    length when it adds entries. Backlog and per-consumer lag are visible with
+    XINFO GROUPS / XINFO CONSUMERS on each stream. Tokens are (stream, entry id).
+    """
+
+    def __init__(self, stream: str = REQUEST_STREAM, group: str = STREAM_GROUP,
+                 claim_idle_ms: int = STREAM_CLAIM_IDLE_MS, claim_interval: float = STREAM_CLAIM_INTERVAL,
+                 max_deliveries: int = STREAM_MAX_DELIVERIES, lanes: Optional[LaneScheduler] = None):
+        self.stream = stream
+        self.streams = {lane: lane_key(stream, lane) for lane in LANES}
+        self.dead_letter = f"{stream}:dead"
+        self.group = group
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self.max_deliveries = max_deliveries
+        self.lanes = lanes or LaneScheduler()
+        self.consumer = None
+        self._claim_cursors = {name: '0-0' for name in self.streams.values()}
+        self._next_claim = 0.0
+        self._held: List[Message] = []  # delivered by a blocking read, for the next batch
+
+    def setup(self, client: redis.Redis):
+        """Create the consumer group (and streams) if needed and pick this worker's consumer name."""
+        # Named at connect time rather than construction, so forked workers get their own pid
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        for name in self.streams.values():
+            try:
+                client.xgroup_create(name, self.group, id='0', mkstream=True)
+                logger.info(f"Created consumer group {self.group} on {name}")
+            except redis.ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    def _entries(self, stream: str, entries) -> List[Message]:
+        # Entries trimmed from the stream while pending come back without fields
+        return [((stream, entry_id), fields.get('data')) for entry_id, fields in entries
+                if entry_id and fields is not None]
+
+    def _reclaim(self, client: redis.Redis, count: int) -> List[Message]:
+        """Take over entries left pending by dead consumers, interactive lane first."""
+        for name in self.streams.values():
+            messages = self._reclaim_stream(client, name, count)
+            if messages:
+                return messages
+        return []
+
+    def _reclaim_stream(self, client: redis.Redis, stream: str, count: int) -> List[Message]:
+        """Take over one stream's entries left pending by dead consumers, dead-lettering poison entries."""
+        result = client.xautoclaim(stream, self.group, self.consumer, self.claim_idle_ms,
+                                   start_id=self._claim_cursors[stream], count=count)
+        self._claim_cursors[stream] = result[0]
+        claimed = self._entries(stream, result[1])
+        if not claimed:
+            return []
+
+        pending = client.xpending_range(stream, self.group, min=claimed[0][0][1], max=claimed[-1][0][1],
+                                        count=len(claimed), consumername=self.consumer)
+        deliveries = {entry['message_id']: entry['times_delivered'] for entry in pending}
+        messages = []
+        for (_, entry_id), raw in claimed:
+            if deliveries.get(entry_id, 0) > self.max_deliveries:
+                logger.info(f"Entry {entry_id} was delivered {deliveries[entry_id]} times, moving it to {self.dead_letter}")
+                pipe = client.pipeline(transaction=False)
+                pipe.xadd(self.dead_letter, {'stream': stream, 'id': entry_id, 'data': raw or ''},
+                          maxlen=STREAM_DEAD_LETTER_MAXLEN, approximate=True)
+                pipe.xack(stream, self.group, entry_id)
+                pipe.execute()
+            else:
+                messages.append(((stream, entry_id), raw))
+        if messages:
+            logger.info(f"Reclaimed {len(messages)} stale entries from {stream}")
+        return messages
+
+    def _read(self, client: redis.Redis, lanes: Tuple[str, ...], count: int,
+              block: Optional[int] = None) -> List[Message]:
+        response = client.xreadgroup(self.group, self.consumer, {self.streams[lane]: '>' for lane in lanes},
+                                     count=count, block=block)
+        # Streams come back in the order they were asked for, interactive first
+        return [message for stream, entries in response or [] for message in self._entries(stream, entries)]
+
+    def _lane(self, message: Message) -> str:
+        return 'interactive' if message[0][0] == self.streams['interactive'] else 'bulk'
+
+    def receive(self, client: redis.Redis, batch_size: int, batch_wait_ms: int, timeout: float = 1) -> List[Message]:
+        """
+        Reclaim stale entries when due, else read up to batch_size new entries of one
+        lane, blocking up to timeout seconds (0: not at all) when both lanes are empty.
+        """
+        if self._held:
+            held, self._held = self._held, []
+            self.lanes.record(self._lane(held[0]), len(held))
+            return held
+
+        if time.monotonic() >= self._next_claim:
+            self._next_claim = time.monotonic() + self.claim_interval
+            reclaimed = self._reclaim(client, batch_size)
+            if reclaimed:
+                return reclaimed
+
+        lane = 'bulk'
+        batch = self._read(client, ('bulk',), self.lanes.batch_size('bulk', batch_size)) \
+            if self.lanes.bulk_turn() else []
+        if not batch:
+            if self.lanes.bulk_turn():
+                self.lanes.skip_bulk()
+            lane = 'interactive'
+            batch = self._read(client, ('interactive',), batch_size)
+        if not batch:
+            # Both lanes empty: block on both, for one entry each. Both lanes can answer
+            # the same read; the interactive entry (read first) starts this batch and the
+            # bulk one, already delivered to this consumer, is held for the next, so a
+            # batch never mixes lanes.
+            entries = self._read(client, LANES, 1, block=int(timeout * 1000) if timeout > 0 else None)
+            if not entries:
+                return []
+            batch, self._held = entries[:1], entries[1:]
+            lane = self._lane(batch[0])
+
+        # Give a partial batch up to batch_wait_ms to fill, unless the worker is idle,
+        # as the list transport does
+        lane_batch_size = self.lanes.batch_size(lane, batch_size)
+        deadline = time.monotonic() + batch_wait_ms / 1000
+        while len(batch) < lane_batch_size:
+            entries = self._read(client, (lane,), lane_batch_size - len(batch))
+            if entries:
+                batch.extend(entries)
+                continue
+            if len(batch) == 1:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, BATCH_POLL_INTERVAL))
+        self.lanes.record(lane, len(batch))
+        return batch
+
+    def ack(self, pipe, tokens: List[Optional[Tuple[str, str]]]):
+        """Queue the acks on the pipeline that writes the responses, after the writes."""
+        entry_ids: Dict[str, List[str]] = {}
+        for token in tokens:
+            if token is not None:
+                entry_ids.setdefault(token[0], []).append(token[1])
+        for stream, ids in entry_ids.items():
+            pipe.xack(stream, self.group, *ids)
+
+    def close(self, client: redis.Redis):
+        """Leave each group if nothing is pending on this consumer, so dead names don't pile up."""
+        for name in self.streams.values():
+            try:
+                if self.consumer and not client.xpending_range(name, self.group, min='-', max='+',
+                                                               count=1, consumername=self.consumer):
+                    client.xgroup_delconsumer(name, self.group, self.consumer)
+            except redis.RedisError as e:
+                logger.info(f"Could not remove consumer {self.consumer} from {name}: {str(e)}")
+
+
+def enqueue(client, payload: str, name: str = REQUEST_TRANSPORT, lane: str = 'interactive',
+            queue: str = REQUEST_QUEUE, stream: str = REQUEST_STREAM):
+    """Send a request the way the API does for the given transport and lane (client or pipeline)."""
+    if name == 'stream':
+        return client.xadd(lane_key(stream, lane), {'data': payload}, maxlen=STREAM_MAXLEN, approximate=True)
+    return client.lpush(lane_key(queue, lane), payload)
+
+
+def create_transport(name: str = REQUEST_TRANSPORT, lanes: Optional[LaneScheduler] = None):
+    """Transport for the REQUEST_TRANSPORT setting."""
+    if name == 'stream':
+        return StreamTransport(lanes=lanes)
+    if name == 'list':
+        return ListTransport(lanes=lanes)
+    raise ValueError(f"Unknown REQUEST_TRANSPORT {name!r}, expected 'list' or 'stream'")
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+from logger import logger
+
+# Must match ZONE_REGISTRY_VERSION in data/build_zone_registry.py, which
+# documents the array layout of the artifact. _with_missing and _zone_table are
+# copies of the build's own; it refuses to build while a copy differs.
+ZONE_REGISTRY_VERSION = 1
+# Where data/build_zone_registry.py writes it: the repository's data directory,
+# mounted at /data next to /app in docker-compose.yml
+ZONE_REGISTRY_PATH = os.getenv('ZONE_REGISTRY_PATH', os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'zone_registry.npz')))
+TAXI_ZONES_PATH = os.getenv('TAXI_ZONES_PATH', './taxi_zones.csv')
+
+
+def _with_missing(values: np.ndarray) -> np.ndarray:
+    """Object array with the registry's '' placeholders turned back into NaN."""
+    result = values.astype(object)
+    result[values == ''] = np.nan
+    return result
+
+
+def _zone_table(registry) -> pd.DataFrame:
+    """Zone attributes shaped like taxi_zones.csv, with missing values as NaN."""
+    return pd.DataFrame({
+        'LocationID': registry['location_id'].astype(np.int64),
+        'Borough': _with_missing(registry['borough']),
+        'Zone': _with_missing(registry['zone']),
+        'service_zone': _with_missing(registry['service_zone']),
+    })
+
+
+def load_taxi_zones() -> pd.DataFrame:
+    """Zone attributes from the compiled registry, falling back to taxi_zones.csv."""
+    if not os.path.exists(ZONE_REGISTRY_PATH):
+        logger.warning(f"No zone registry at {ZONE_REGISTRY_PATH}, loading {TAXI_ZONES_PATH}")
+    else:
+        with np.load(ZONE_REGISTRY_PATH) as registry:
+            version = int(registry['format_version'])
+            if version == ZONE_REGISTRY_VERSION:
+                table = _zone_table(registry)
+                logger.info(f"Loaded taxi zones from registry {ZONE_REGISTRY_PATH}")
+                return table
+            logger.warning(f"Ignoring zone registry with unsupported version {version}, loading {TAXI_ZONES_PATH}")
+    return pd.read_csv(TAXI_ZONES_PATH)
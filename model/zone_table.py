@@ -0,0 +1,39 @@
+from typing import Tuple
+import numpy as np
+import pandas as pd
+
+# LocationIDs run from 1 to 265; slot 0 is never a valid zone.
+MAX_LOCATION_ID = 265
+
+
+class ZoneTable:
+    """
+    Taxi zone attributes in dense arrays indexed directly by LocationID.
+
+    Missing values are replaced with 'Unknown' once at build time, so looking up
+    a zone is a plain array index.
+    """
+
+    def __init__(self, taxi_zones: pd.DataFrame):
+        size = MAX_LOCATION_ID + 1
+        self.known = np.zeros(size, dtype=bool)
+        self.borough = np.full(size, 'Unknown', dtype=object)
+        self.service_zone = np.full(size, 'Unknown', dtype=object)
+        self.zone = np.full(size, 'Unknown', dtype=object)
+
+        for row in taxi_zones.itertuples(index=False):
+            location_id = int(row.LocationID)
+            # Keep the first row per LocationID, as the old mask + iloc[0] lookup did
+            if not 0 < location_id <= MAX_LOCATION_ID or self.known[location_id]:
+                continue
+            self.known[location_id] = True
+            self.borough[location_id] = 'Unknown' if pd.isna(row.Borough) else row.Borough
+            self.service_zone[location_id] = 'Unknown' if pd.isna(row.service_zone) else row.service_zone
+            self.zone[location_id] = 'Unknown' if pd.isna(row.Zone) else row.Zone
+
+    def lookup(self, location_id: int) -> Tuple[str, str, str]:
+        """(borough, service_zone, zone) for one LocationID."""
+        if not (isinstance(location_id, (int, np.integer)) and 0 < location_id <= MAX_LOCATION_ID
+                and self.known[location_id]):
+            raise ValueError(f"Unknown LocationID: {location_id}")
+        return self.borough[location_id], self.service_zone[location_id], self.zone[location_id]